@@ -0,0 +1,135 @@
+"""
+Contention benchmark for POST /shopping/{user_id}/checkout/{list_id}.
+
+Creates one single-item list per simulated buyer, all for the same popular
+food at the same store, then fires every checkout at once against a running
+API and reports throughput, latency percentiles and status codes. Afterwards
+it checks that the stock went down by exactly the number of successful
+checkouts and removes the lists it created.
+
+Usage (API running, e.g. `python main.py` from the repo root):
+    python checkout_benchmark.py --buyers 500 --concurrency 500 \
+        --api-url http://localhost:3000 --api-key $API_KEY
+"""
+import argparse
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import sqlalchemy
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def setup(conn, buyers, stock):
+    """
+    Picks the most listed food and a store carrying it, gives that store
+    `stock` units, and creates one list per buyer holding one unit of it.
+    """
+    food_id = conn.execute(sqlalchemy.text("""
+        SELECT food_id FROM shopping_list_item
+        GROUP BY food_id ORDER BY COUNT(*) DESC LIMIT 1
+        """)).scalar_one()
+    catalog_item_id, store_id = conn.execute(sqlalchemy.text("""
+        SELECT catalog_item.catalog_item_id, catalog.store_id
+        FROM catalog_item
+        JOIN catalog ON catalog.catalog_id = catalog_item.catalog_id
+        WHERE catalog_item.food_id = :food_id
+        ORDER BY catalog_item.catalog_item_id
+        LIMIT 1
+        """), {"food_id": food_id}).one()
+    conn.execute(sqlalchemy.text("""
+        UPDATE catalog_item SET quantity = :stock WHERE catalog_item_id = :catalog_item_id
+        """), {"stock": stock, "catalog_item_id": catalog_item_id})
+
+    user_ids = conn.execute(sqlalchemy.text("""
+        SELECT user_id FROM users ORDER BY user_id LIMIT :buyers
+        """), {"buyers": buyers}).scalars().all()
+    list_ids = conn.execute(sqlalchemy.text("""
+        INSERT INTO shopping_list (name, user_id)
+        SELECT 'checkout_benchmark', user_id FROM unnest(CAST(:user_ids AS bigint[])) AS user_id
+        RETURNING list_id, user_id
+        """), {"user_ids": user_ids}).all()
+    conn.execute(sqlalchemy.text("""
+        INSERT INTO shopping_list_item (list_id, food_id, user_id, quantity)
+        SELECT list_id, :food_id, user_id, 1
+        FROM unnest(CAST(:list_ids AS int[]), CAST(:user_ids AS bigint[])) AS buyer(list_id, user_id)
+        """), {"food_id": food_id,
+               "list_ids": [row.list_id for row in list_ids],
+               "user_ids": [row.user_id for row in list_ids]})
+
+    return food_id, store_id, catalog_item_id, [(row.user_id, row.list_id) for row in list_ids]
+
+
+def cleanup(conn, list_ids):
+    conn.execute(sqlalchemy.text("""
+        DELETE FROM shopping_list_item WHERE list_id = ANY(:list_ids);
+        DELETE FROM shopping_list WHERE list_id = ANY(:list_ids);
+        """), {"list_ids": list_ids})
+
+
+def checkout(api_url, api_key, user_id, list_id, store_id):
+    request = urllib.request.Request(
+        f"{api_url}/shopping/{user_id}/checkout/{list_id}?store_id={store_id}",
+        method="POST", headers={"access_token": api_key})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request) as response:
+            json.load(response)
+            code = response.status
+    except urllib.error.HTTPError as e:
+        code = e.code
+    except urllib.error.URLError:
+        code = "connection error"
+    return code, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent checkout benchmark on one hot food_id")
+    parser.add_argument("--buyers", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--stock", type=int, default=1000000,
+                        help="Units of the hot item before the run, set below --buyers to test selling out")
+    parser.add_argument("--api-url", default=os.environ.get("API_URL", "http://localhost:3000"))
+    parser.add_argument("--api-key", default=os.environ.get("API_KEY"))
+    args = parser.parse_args()
+
+    engine = sqlalchemy.create_engine(os.environ.get("POSTGRES_URI"))
+    with engine.begin() as conn:
+        food_id, store_id, catalog_item_id, buyers = setup(conn, args.buyers, args.stock)
+    print(f"{len(buyers)} buyers checking out food {food_id} at store {store_id}")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(
+            lambda buyer: checkout(args.api_url, args.api_key, buyer[0], buyer[1], store_id), buyers))
+    elapsed = time.perf_counter() - start
+
+    with engine.begin() as conn:
+        remaining = conn.execute(sqlalchemy.text("""
+            SELECT quantity FROM catalog_item WHERE catalog_item_id = :catalog_item_id
+            """), {"catalog_item_id": catalog_item_id}).scalar_one()
+        cleanup(conn, [list_id for _, list_id in buyers])
+
+    codes = Counter(code for code, _ in results)
+    latencies = np.array([latency for _, latency in results]) * 1000
+    sold = codes.get(200, 0)
+
+    print(f"Elapsed: {elapsed:.2f} s, throughput: {len(results) / elapsed:.1f} checkouts/s")
+    print(f"Latency ms - p50: {np.percentile(latencies, 50):.1f}, "
+          f"p95: {np.percentile(latencies, 95):.1f}, p99: {np.percentile(latencies, 99):.1f}, "
+          f"max: {latencies.max():.1f}")
+    print(f"Status codes: {dict(codes)}")
+    expected = args.stock - sold
+    print(f"Stock left: {remaining} (expected {expected}) - "
+          f"{'OK' if remaining == expected else 'ANOMALY: lost or double decrement'}")
+
+
+if __name__ == "__main__":
+    main()
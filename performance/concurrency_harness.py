@@ -0,0 +1,288 @@
+"""
+Stress harness for the race conditions in docs/concurrency_issues.md.
+
+Each scenario replays the statements of one race with many concurrent
+threads against Postgres, once per isolation level, and counts the
+anomalies the race can cause next to throughput, aborts and latency:
+
+- route: the route optimizer picks a store with stock within the budget,
+  "calculates the route", then reads that store again for the response
+  while other transactions sell out and re-price stores. Anomaly: the
+  response shows a store with no stock or over the budget.
+- prices: compare prices reads stores one statement at a time while other
+  transactions swap prices between two stores, which keeps the sum of all
+  prices constant. Anomaly: a comparison whose prices do not add up to it.
+- list_budget: concurrent adds to the same list each check that the list
+  stays within its budget before inserting, while checkouts verify and
+  clear lists. Anomaly: a list over its budget (write skew).
+
+Every transaction in a run uses the isolation level under test, and
+serialization failures and deadlocks are counted as aborts, not retried.
+The scenarios run on their own tables in the concurrency_harness schema,
+which is dropped afterwards, so any database works.
+
+Usage:
+    python concurrency_harness.py --seconds 10 --readers 8 --writers 8
+    python concurrency_harness.py --scenario list_budget --isolation SERIALIZABLE
+"""
+import argparse
+import os
+import random
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+
+import numpy as np
+import sqlalchemy
+from dotenv import load_dotenv
+from sqlalchemy.exc import DBAPIError
+
+load_dotenv()
+
+ISOLATION_LEVELS = ["READ COMMITTED", "REPEATABLE READ", "SERIALIZABLE"]
+ABORT_CODES = {"40001", "40P01"}  # serialization_failure, deadlock_detected
+SCHEMA = "concurrency_harness"
+
+NUM_STORES = 20
+BUDGET = 500  # cents, route scenario
+NUM_LISTS = 8
+LIST_BUDGET = 1000  # cents, list_budget scenario
+THINK_SECONDS = 0.001  # work an endpoint does between its statements
+
+
+class Anomaly(Exception):
+    pass
+
+
+@dataclass
+class Tally:
+    committed: int = 0
+    aborted: int = 0
+    anomalies: int = 0
+    errors: Counter = field(default_factory=Counter)
+    latencies: list = field(default_factory=list)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def record(self, outcome, latency, error=None):
+        with self.lock:
+            if outcome == "committed":
+                self.committed += 1
+                self.latencies.append(latency)
+            elif outcome == "aborted":
+                self.aborted += 1
+            elif outcome == "anomaly":
+                self.committed += 1
+                self.anomalies += 1
+                self.latencies.append(latency)
+            else:
+                self.errors[error] += 1
+
+
+class RouteScenario:
+    name = "route"
+    roles = ("read", "write")
+
+    def setup(self, conn, rng):
+        conn.execute(sqlalchemy.text(f"""
+            CREATE TABLE {SCHEMA}.offer (store_id int PRIMARY KEY, price int NOT NULL, quantity int NOT NULL);
+            INSERT INTO {SCHEMA}.offer
+            SELECT store_id, 300 + (random() * 400)::int, 50 FROM generate_series(1, {NUM_STORES}) AS store_id;
+            """))
+
+    def read(self, conn, rng):
+        chosen = conn.execute(sqlalchemy.text(f"""
+            SELECT store_id FROM {SCHEMA}.offer
+            WHERE quantity > 0 AND price <= :budget
+            ORDER BY price LIMIT 1
+            """), {"budget": BUDGET}).scalar()
+        if chosen is None:
+            return
+        time.sleep(THINK_SECONDS)
+        price, quantity = conn.execute(sqlalchemy.text(f"""
+            SELECT price, quantity FROM {SCHEMA}.offer WHERE store_id = :store_id
+            """), {"store_id": chosen}).one()
+        if quantity <= 0 or price > BUDGET:
+            raise Anomaly(f"store {chosen} now has {quantity} left at {price}")
+
+    def write(self, conn, rng):
+        conn.execute(sqlalchemy.text(f"""
+            UPDATE {SCHEMA}.offer
+            SET quantity = CASE WHEN quantity > 0 THEN 0 ELSE 50 END, price = :price
+            WHERE store_id = :store_id
+            """), {"store_id": rng.randint(1, NUM_STORES), "price": rng.randint(300, 700)})
+
+    def check(self, conn):
+        return 0
+
+
+class PricesScenario:
+    name = "prices"
+    roles = ("read", "write")
+
+    def setup(self, conn, rng):
+        conn.execute(sqlalchemy.text(f"""
+            CREATE TABLE {SCHEMA}.offer (store_id int PRIMARY KEY, price int NOT NULL);
+            INSERT INTO {SCHEMA}.offer
+            SELECT store_id, 100 * store_id FROM generate_series(1, {NUM_STORES}) AS store_id;
+            """))
+        self.total = sum(100 * store_id for store_id in range(1, NUM_STORES + 1))
+
+    def read(self, conn, rng):
+        total = 0
+        for store_id in range(1, NUM_STORES + 1):
+            total += conn.execute(sqlalchemy.text(f"""
+                SELECT price FROM {SCHEMA}.offer WHERE store_id = :store_id
+                """), {"store_id": store_id}).scalar_one()
+        if total != self.total:
+            raise Anomaly(f"prices add up to {total}, not {self.total}")
+
+    def write(self, conn, rng):
+        first, second = rng.sample(range(1, NUM_STORES + 1), 2)
+        conn.execute(sqlalchemy.text(f"""
+            UPDATE {SCHEMA}.offer AS offer
+            SET price = other.price
+            FROM {SCHEMA}.offer AS other
+            WHERE (offer.store_id, other.store_id) IN ((:first, :second), (:second, :first))
+            """), {"first": first, "second": second})
+
+    def check(self, conn):
+        total = conn.execute(sqlalchemy.text(f"SELECT SUM(price) FROM {SCHEMA}.offer")).scalar_one()
+        return int(total != self.total)
+
+
+class ListBudgetScenario:
+    name = "list_budget"
+    roles = ("checkout", "add")
+
+    def setup(self, conn, rng):
+        conn.execute(sqlalchemy.text(f"""
+            CREATE TABLE {SCHEMA}.list (list_id int PRIMARY KEY, budget int NOT NULL);
+            CREATE TABLE {SCHEMA}.list_item (
+                list_id int NOT NULL REFERENCES {SCHEMA}.list (list_id),
+                item_id int GENERATED ALWAYS AS IDENTITY,
+                price int NOT NULL
+            );
+            CREATE INDEX ON {SCHEMA}.list_item (list_id);
+            INSERT INTO {SCHEMA}.list
+            SELECT list_id, {LIST_BUDGET} FROM generate_series(1, {NUM_LISTS}) AS list_id;
+            """))
+
+    def write(self, conn, rng):
+        list_id = rng.randint(1, NUM_LISTS)
+        price = rng.randint(100, 400)
+        total, budget = conn.execute(sqlalchemy.text(f"""
+            SELECT COALESCE(SUM(list_item.price), 0), list.budget
+            FROM {SCHEMA}.list
+            LEFT JOIN {SCHEMA}.list_item ON list_item.list_id = list.list_id
+            WHERE list.list_id = :list_id
+            GROUP BY list.budget
+            """), {"list_id": list_id}).one()
+        time.sleep(THINK_SECONDS)
+        if total + price <= budget:
+            conn.execute(sqlalchemy.text(f"""
+                INSERT INTO {SCHEMA}.list_item (list_id, price) VALUES (:list_id, :price)
+                """), {"list_id": list_id, "price": price})
+
+    def read(self, conn, rng):
+        list_id = rng.randint(1, NUM_LISTS)
+        total = conn.execute(sqlalchemy.text(f"""
+            DELETE FROM {SCHEMA}.list_item WHERE list_id = :list_id RETURNING price
+            """), {"list_id": list_id}).scalars().all()
+        if sum(total) > LIST_BUDGET:
+            raise Anomaly(f"list {list_id} checked out at {sum(total)}, over its {LIST_BUDGET} budget")
+
+    def check(self, conn):
+        return conn.execute(sqlalchemy.text(f"""
+            SELECT COUNT(*) FROM (
+                SELECT list_item.list_id
+                FROM {SCHEMA}.list_item
+                JOIN {SCHEMA}.list ON list.list_id = list_item.list_id
+                GROUP BY list_item.list_id, list.budget
+                HAVING SUM(list_item.price) > list.budget
+            ) AS over_budget
+            """)).scalar_one()
+
+
+SCENARIOS = {scenario.name: scenario for scenario in [RouteScenario(), PricesScenario(), ListBudgetScenario()]}
+
+
+def worker(engine, isolation, operation, tally, stop_at, seed):
+    rng = random.Random(seed)
+    with engine.connect().execution_options(isolation_level=isolation) as conn:
+        while time.monotonic() < stop_at:
+            start = time.perf_counter()
+            outcome, error = "committed", None
+            try:
+                with conn.begin():
+                    try:
+                        operation(conn, rng)
+                    except Anomaly:
+                        outcome = "anomaly"
+            except DBAPIError as e:
+                code = getattr(e.orig, "pgcode", None)
+                outcome, error = ("aborted", None) if code in ABORT_CODES else ("error", code or str(e.orig))
+            tally.record(outcome, time.perf_counter() - start, error)
+
+
+def run(engine, scenario, isolation, args):
+    rng = random.Random(args.seed)
+    with engine.begin() as conn:
+        conn.execute(sqlalchemy.text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA};"))
+        scenario.setup(conn, rng)
+
+    reads, writes = Tally(), Tally()
+    stop_at = time.monotonic() + args.seconds
+    threads = [threading.Thread(target=worker, args=(engine, isolation, scenario.read, reads, stop_at, args.seed + i))
+               for i in range(args.readers)]
+    threads += [threading.Thread(target=worker, args=(engine, isolation, scenario.write, writes, stop_at,
+                                                      args.seed + args.readers + i))
+                for i in range(args.writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with engine.begin() as conn:
+        final_anomalies = scenario.check(conn)
+    return reads, writes, final_anomalies
+
+
+def report(scenario, isolation, reads, writes, final_anomalies, seconds):
+    for role, tally in zip(scenario.roles, (reads, writes)):
+        attempts = tally.committed + tally.aborted
+        latencies = np.array(tally.latencies or [0]) * 1000
+        print(f"{scenario.name:<12} {isolation:<16} {role:<8} "
+              f"{tally.committed / seconds:9.1f}/s  aborts {100 * tally.aborted / max(attempts, 1):5.1f}%  "
+              f"p50 {np.percentile(latencies, 50):6.1f}ms  p99 {np.percentile(latencies, 99):7.1f}ms  "
+              f"anomalies {tally.anomalies}" + (f"  errors {dict(tally.errors)}" if tally.errors else ""))
+    if final_anomalies:
+        print(f"{scenario.name:<12} {isolation:<16} final state has {final_anomalies} anomalies")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the documented race conditions at each isolation level")
+    parser.add_argument("--scenario", choices=list(SCENARIOS), action="append",
+                        help="Scenario to run, repeat for several (default: all)")
+    parser.add_argument("--isolation", choices=ISOLATION_LEVELS, action="append",
+                        help="Isolation level to run, repeat for several (default: all)")
+    parser.add_argument("--seconds", type=float, default=10, help="Duration of each run")
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=365)
+    args = parser.parse_args()
+
+    engine = sqlalchemy.create_engine(os.environ.get("POSTGRES_URI"),
+                                      pool_size=args.readers + args.writers + 1)
+    try:
+        for name in args.scenario or list(SCENARIOS):
+            for isolation in args.isolation or ISOLATION_LEVELS:
+                reads, writes, final_anomalies = run(engine, SCENARIOS[name], isolation, args)
+                report(SCENARIOS[name], isolation, reads, writes, final_anomalies, args.seconds)
+    finally:
+        with engine.begin() as conn:
+            conn.execute(sqlalchemy.text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,7 @@
+import argparse
 import os
+import re
+from dataclasses import dataclass
 from datetime import datetime
 import sqlalchemy
 from dotenv import load_dotenv
@@ -7,15 +10,14 @@ import numpy as np
 
 # Load environment
 load_dotenv()
-engine = sqlalchemy.create_engine(os.environ.get("POSTGRES_URI"), use_insertmanyvalues=True)
-fake = Faker()
 
-# Simple configuration
-NUM_USERS = 100000
-NUM_STORES = 100
-NUM_FOOD_ITEMS = 5000
+# Baseline sizes at --scale 1.0 (roughly 1 million rows in total)
+BASE_USERS = 100000
+BASE_STORES = 100
+BASE_FOOD_ITEMS = 5000
 ITEMS_PER_STORE = 1000
 BATCH_SIZE = 1000
+LIST_AGE_DAYS = 120  # mean days since a generated list was last touched
 
 # Location settings
 SLO_LAT = 35.3050
@@ -56,82 +58,200 @@ FOOD_WORDS = [
     'Tea', 'Coffee', 'Juice', 'Soda', 'Water'
 ]
 
-def reset_tables(conn):
+LIST_NAMES = ["Weekly", "Monthly", "Groceries", "Essentials"]
+
+
+@dataclass
+class GeneratorConfig:
+    """
+    Knobs for one generator run. Sizes are derived from the baseline
+    constants above multiplied by the scale factor.
+    """
+    scale: float = 1.0
+    seed: int = 365
+    food_skew: float = 1.0      # Zipf exponent for food popularity, 0 = uniform
+    user_skew: float = 0.8      # Zipf exponent for user activity, 0 = uniform
+    store_clusters: int = 6     # number of shopping districts stores gather around
+    cluster_spread: float = 0.01
+    lists_per_user: float = 2.0
+    items_per_list: float = 3.0
+
+    @property
+    def num_users(self):
+        return max(1, int(BASE_USERS * self.scale))
+
+    @property
+    def num_stores(self):
+        return max(len(STORE_NAMES), int(BASE_STORES * self.scale))
+
+    @property
+    def num_food_items(self):
+        return max(len(COMMON_ITEMS) + len(FOOD_CATEGORIES), int(BASE_FOOD_ITEMS * self.scale))
+
+    @property
+    def items_per_store(self):
+        return min(ITEMS_PER_STORE, self.num_food_items)
+
+
+def get_db_url(target):
+    if target == "supabase":
+        user = os.getenv('SUPABASE_USER')
+        password = os.getenv('SUPABASE_PASSWORD')
+        host = os.getenv('SUPABASE_HOST')
+        port = os.getenv('SUPABASE_PORT')
+        db = os.getenv('SUPABASE_DB')
+        return f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{db}"
+
+    return os.environ.get("POSTGRES_URI")
+
+
+def zipf_weights(n, skew, rng, pinned=0):
+    """
+    Probability of picking each of n ids, following a Zipf law with the given
+    exponent. The first `pinned` ids take the top ranks, the remaining ranks
+    are shuffled so popularity is not correlated with id order.
+    """
+    if skew <= 0:
+        return np.full(n, 1.0 / n)
+    ranks = np.concatenate([np.arange(1, pinned + 1), rng.permutation(np.arange(pinned + 1, n + 1))])
+    weights = 1.0 / np.power(ranks, skew)
+    return weights / weights.sum()
+
+
+# The only copy of the schema, the datagen container mounts it at /schema.sql
+SCHEMA_SQL = os.environ.get("SCHEMA_SQL", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "schema.sql"))
+
+# Objects of users and their lists, which a catalog-only reset leaves alone
+USER_OBJECTS = re.compile(r"\b(users|shopping_list\w*|touch_shopping_list)\b")
+
+
+def schema_statements(schema_path=None):
+    """
+    The statements of schema.sql, split on the semicolons that end a line
+    outside of $$-quoted function bodies.
+    """
+    with open(schema_path or SCHEMA_SQL, 'r') as file:
+        lines = file.read().splitlines()
+
+    statements, current, in_body = [], [], False
+    for line in lines:
+        current.append(line)
+        in_body ^= line.count("$$") % 2 == 1
+        if not in_body and line.rstrip().endswith(";"):
+            statement = "\n".join(current).strip()
+            if any(not part.lstrip().startswith("--") for part in statement.splitlines()):
+                statements.append(statement)
+            current = []
+    return statements
+
+
+def reset_tables(conn, schema_path=None):
+    """
+    Recreates the public schema from schema.sql, sample rows included.
+    """
     print("Resetting database tables...")
-    
+
     # Drop and recreate the public schema
     conn.execute(sqlalchemy.text("""
         DROP SCHEMA public CASCADE;
         CREATE SCHEMA public;
     """))
-    
-    with open('init.sql', 'r') as file:
+
+    with open(schema_path or SCHEMA_SQL, 'r') as file:
         conn.execute(sqlalchemy.text(file.read()))
-    
+
     print("Tables reset successfully")
 
+
+def reset_catalog_tables(conn, schema_path=None):
+    """
+    Only rebuilds the store/food/catalog tables, leaving users and their lists
+    alone. Used against shared databases such as Supabase. Runs every
+    statement of schema.sql that does not touch users or lists.
+    """
+    print("Resetting catalog tables...")
+
+    conn.execute(sqlalchemy.text("""
+        DROP TABLE IF EXISTS price_history CASCADE;
+        DROP TABLE IF EXISTS price_history_daily CASCADE;
+        DROP FUNCTION IF EXISTS create_price_history_partitions(integer);
+        DROP FUNCTION IF EXISTS record_price_changes() CASCADE;
+        DROP TABLE IF EXISTS materialized_view_refresh;
+        DROP TABLE IF EXISTS store_version;
+        DROP TABLE IF EXISTS catalog_version;
+        DROP FUNCTION IF EXISTS bump_store_version() CASCADE;
+        DROP FUNCTION IF EXISTS bump_catalog_item_versions() CASCADE;
+        DROP FUNCTION IF EXISTS bump_catalog_item_stock() CASCADE;
+        DROP FUNCTION IF EXISTS bump_moved_catalog_version() CASCADE;
+        DROP FUNCTION IF EXISTS bump_renamed_food_versions() CASCADE;
+        DROP FUNCTION IF EXISTS bump_catalog_versions(integer[]);
+        DROP TABLE IF EXISTS catalog_item CASCADE;
+        DROP TABLE IF EXISTS catalog CASCADE;
+        DROP TABLE IF EXISTS food_item CASCADE;
+        DROP TABLE IF EXISTS store CASCADE;
+    """))
+
+    for statement in schema_statements(schema_path):
+        code = "\n".join(line for line in statement.splitlines() if not line.lstrip().startswith("--"))
+        if not USER_OBJECTS.search(code):
+            conn.execute(sqlalchemy.text(statement))
+
+    print("Catalog tables reset successfully")
+
+
 def create_store_hours():
     now = datetime.now()
-    open_time = now.replace(hour=8, minute=0)
-    close_time = now.replace(hour=22, minute=0)
+    open_time = now.replace(hour=8, minute=0, second=0, microsecond=0)
+    close_time = now.replace(hour=22, minute=0, second=0, microsecond=0)
     return open_time, close_time
 
-def generate_location(center_lat, center_long, spread):
-    lat = center_lat + np.random.normal(0, spread)
-    long = center_long + np.random.normal(0, spread)
+
+def generate_location(rng, center_lat, center_long, spread):
+    lat = center_lat + rng.normal(0, spread)
+    long = center_long + rng.normal(0, spread)
     return lat, long
 
-def generate_users(batch_size=1000):
-    user_batches = []
-    for i in range(0, NUM_USERS, batch_size):
-        users = []
-        for _ in range(min(batch_size, NUM_USERS - i)):
-            lat, long = generate_location(SLO_LAT, SLO_LONG, 0.1)
-            user = {
-                "name": fake.unique.name(),
-                "location": "San Luis Obispo",
-                "longitude": long,
-                "latitude": lat
-            }
-            users.append(user)
-        user_batches.append(users)
-    return user_batches
 
-def generate_stores():
+def generate_users(config, rng, fake):
+    users = []
+    for i in range(config.num_users):
+        lat, long = generate_location(rng, SLO_LAT, SLO_LONG, 0.1)
+        users.append({
+            # Suffix keeps names unique past the size of Faker's name pool
+            "name": f"{fake.name()} {i}",
+            "location": "San Luis Obispo",
+            "longitude": long,
+            "latitude": lat
+        })
+    return users
+
+
+def generate_stores(config, rng, fake):
+    # Stores gather around a handful of shopping districts rather than being
+    # spread evenly, so "stores near me" differs a lot between users
+    centers = [generate_location(rng, SLO_LAT, SLO_LONG, 0.1)
+               for _ in range(max(1, config.store_clusters))]
+
+    names = list(STORE_NAMES) + [f"{fake.company()} Market"
+                                 for _ in range(config.num_stores - len(STORE_NAMES))]
     stores = []
-    # Add real stores
-    for name in STORE_NAMES:
-        lat, long = generate_location(SLO_LAT, SLO_LONG, 0.1)
+    for name in names:
+        center_lat, center_long = centers[rng.integers(len(centers))]
+        lat, long = generate_location(rng, center_lat, center_long, config.cluster_spread)
         open_time, close_time = create_store_hours()
-        store = {
+        stores.append({
             "name": name,
             "latitude": lat,
             "longitude": long,
             "open_time": open_time,
-            "close_time": close_time,
-            "catalog_id": None
-        }
-        stores.append(store)
-    
-    # Add generated stores
-    remaining_stores = NUM_STORES - len(STORE_NAMES)
-    for _ in range(remaining_stores):
-        lat, long = generate_location(SLO_LAT, SLO_LONG, 0.1)
-        open_time, close_time = create_store_hours()
-        store = {
-            "name": f"{fake.company()} Market",
-            "latitude": lat,
-            "longitude": long,
-            "open_time": open_time,
-            "close_time": close_time,
-            "catalog_id": None
-        }
-        stores.append(store)
+            "close_time": close_time
+        })
     return stores
 
-def generate_food_items():
+
+def generate_food_items(config, rng):
     food_items = []
-    
+
     # Add common items first
     for name, size, cal, sat, trans, fiber, carb, sugar, protein in COMMON_ITEMS:
         food_items.append({
@@ -145,136 +265,86 @@ def generate_food_items():
             "total_sugars": sugar,
             "protein": protein
         })
-    
+
     # Generate items for each category
-    remaining_items = NUM_FOOD_ITEMS - len(COMMON_ITEMS)
+    remaining_items = config.num_food_items - len(COMMON_ITEMS)
     items_per_category = remaining_items // len(FOOD_CATEGORIES)
-    
+
     for category, prefixes in FOOD_CATEGORIES.items():
         for _ in range(items_per_category):
-            name = f"{np.random.choice(prefixes)} {np.random.choice(FOOD_WORDS)} {category}"
+            name = f"{rng.choice(prefixes)} {rng.choice(FOOD_WORDS)} {category}"
             food_items.append({
                 "name": name,
-                "serving_size": np.random.randint(1, 16),
-                "calories": np.random.randint(0, 500),
-                "saturated_fat": np.random.randint(0, 20),
-                "trans_fat": np.random.randint(0, 2),
-                "dietary_fiber": np.random.randint(0, 7),
-                "total_carbohydrate": np.random.randint(0, 50),
-                "total_sugars": np.random.randint(0, 25),
-                "protein": np.random.randint(0, 25)
+                "serving_size": int(rng.integers(1, 16)),
+                "calories": int(rng.integers(0, 500)),
+                "saturated_fat": int(rng.integers(0, 20)),
+                "trans_fat": int(rng.integers(0, 2)),
+                "dietary_fiber": int(rng.integers(0, 7)),
+                "total_carbohydrate": int(rng.integers(0, 50)),
+                "total_sugars": int(rng.integers(0, 25)),
+                "protein": int(rng.integers(0, 25))
             })
-    
+
     return food_items
 
-def generate_shopping_lists_and_items(conn, user_ids, food_ids):
-    print("Generating shopping lists and items...")
-    
-    lists_per_user = np.random.poisson(lam=2, size=len(user_ids))
-    list_count = 0
-    item_count = 0
-    
-    for i, user_id in enumerate(user_ids):
-        num_lists = int(lists_per_user[i])
-        
-        for _ in range(num_lists):
-            # Create shopping list
-            result = conn.execute(
-                sqlalchemy.text("""
-                INSERT INTO shopping_list (name, user_id)
-                VALUES (:name, :user_id)
-                RETURNING list_id
-                """),
-                {
-                    "name": np.random.choice(["Weekly", "Monthly", "Groceries", "Essentials"]),
-                    "user_id": int(user_id)
-                }
-            )
-            list_id = result.scalar_one()
-            list_count += 1
-            
-            # Generate items for this list
-            num_items = np.random.poisson(3)
-            selected_foods = np.random.choice(food_ids, max(1, num_items), replace=False)
-            
-            list_items = []
-            for food_id in selected_foods:
-                list_items.append({
-                    "list_id": int(list_id),
-                    "food_id": int(food_id),
-                    "user_id": int(user_id),
-                    "quantity": int(np.random.randint(1, 5))
-                })
-                item_count += 1
-            
-            # Insert items in batches
-            if list_items:
-                conn.execute(
-                    sqlalchemy.text("""
-                    INSERT INTO shopping_list_item (list_id, food_id, user_id, quantity)
-                    VALUES (:list_id, :food_id, :user_id, :quantity)
-                    """),
-                    list_items
-                )
-        
-        if i % 1000 == 0:
-            print(f"Processed shopping lists for user {i}/{len(user_ids)}")
-            print(f"Current totals - Lists: {list_count}, Items: {item_count}")
-
-print("Starting data generation...")
-
-with engine.begin() as conn:
-    reset_tables(conn)
-
-    print("Generating users...")
-    user_batches = generate_users()
-    user_ids = []
-    for batch in user_batches:
-        for user in batch:
-            result = conn.execute(
-                sqlalchemy.text("""
-                INSERT INTO users (name, location, longitude, latitude)
-                VALUES (:name, :location, :longitude, :latitude)
-                RETURNING user_id
-                """),
-                user
-            )
-            user_ids.append(result.scalar_one())
-        print(f"Inserted user batch {len(user_ids)//1000}/{NUM_USERS//1000}")
-        
-    print("Generating stores...")
-    stores = generate_stores()
-    store_ids = []
-    for store in stores:
-        result = conn.execute(
-            sqlalchemy.text("""
-            INSERT INTO store (name, latitude, longitude, open_time, close_time)
-            VALUES (:name, :latitude, :longitude, :open_time, :close_time)
-            RETURNING store_id
-            """),
-            store
-        )
-        store_ids.append(result.scalar_one())
-        
-    print("Generating food items...")
-    food_items = generate_food_items()
-    food_ids = []
-    for item in food_items:
-        result = conn.execute(
-            sqlalchemy.text("""
-            INSERT INTO food_item (name, serving_size, calories, saturated_fat, 
-                                trans_fat, dietary_fiber, total_carbohydrate, 
-                                total_sugars, protein)
-            VALUES (:name, :serving_size, :calories, :saturated_fat,
-                    :trans_fat, :dietary_fiber, :total_carbohydrate,
-                    :total_sugars, :protein)
-            RETURNING food_id
-            """),
-            item
-        )
-        food_ids.append(result.scalar_one())
 
+def insert_rows(conn, statement, rows):
+    """
+    Inserts rows in batches with one unnest() statement per batch and returns
+    the generated identity ids in insertion order.
+    """
+    ids = []
+    columns = list(rows[0].keys()) if rows else []
+    for start in range(0, len(rows), BATCH_SIZE):
+        batch = rows[start:start + BATCH_SIZE]
+        params = {column: [row[column] for row in batch] for column in columns}
+        ids.extend(conn.execute(statement, params).scalars().all())
+    return sorted(ids)
+
+
+def insert_users(conn, users):
+    return insert_rows(conn, sqlalchemy.text("""
+        INSERT INTO users (name, location, longitude, latitude)
+        SELECT * FROM unnest(CAST(:name AS text[]), CAST(:location AS text[]),
+                             CAST(:longitude AS float8[]), CAST(:latitude AS float8[]))
+        RETURNING user_id
+        """), users)
+
+
+def insert_stores(conn, stores):
+    return insert_rows(conn, sqlalchemy.text("""
+        INSERT INTO store (name, latitude, longitude, open_time, close_time)
+        SELECT * FROM unnest(CAST(:name AS text[]), CAST(:latitude AS float8[]),
+                             CAST(:longitude AS float8[]), CAST(:open_time AS timestamp[]),
+                             CAST(:close_time AS timestamp[]))
+        RETURNING store_id
+        """), stores)
+
+
+def insert_food_items(conn, food_items):
+    return insert_rows(conn, sqlalchemy.text("""
+        INSERT INTO food_item (name, serving_size, calories, saturated_fat,
+                               trans_fat, dietary_fiber, total_carbohydrate,
+                               total_sugars, protein)
+        SELECT * FROM unnest(CAST(:name AS text[]), CAST(:serving_size AS int[]),
+                             CAST(:calories AS int[]), CAST(:saturated_fat AS int[]),
+                             CAST(:trans_fat AS int[]), CAST(:dietary_fiber AS int[]),
+                             CAST(:total_carbohydrate AS int[]), CAST(:total_sugars AS int[]),
+                             CAST(:protein AS int[]))
+        RETURNING food_id
+        """), food_items)
+
+
+def generate_catalogs(conn, config, rng, store_ids, food_ids, food_weights):
     print("Generating catalogs and catalog items...")
+
+    # Popular foods are stocked by more stores; common items everywhere
+    base_foods = food_ids[:len(COMMON_ITEMS)]
+    other_foods = food_ids[len(COMMON_ITEMS):]
+    other_weights = food_weights[len(COMMON_ITEMS):]
+    other_weights = other_weights / other_weights.sum()
+    num_other = min(config.items_per_store - len(base_foods), len(other_foods))
+
     for i, store_id in enumerate(store_ids, 1):
         catalog_id = conn.execute(
             sqlalchemy.text("""
@@ -284,33 +354,177 @@ with engine.begin() as conn:
             """),
             {"store_id": store_id}
         ).scalar_one()
-        
-        # Common items first
-        base_foods = food_ids[:5]
-        other_foods = np.random.choice(food_ids[5:], ITEMS_PER_STORE - 5, replace=False)
-        selected_foods = np.concatenate([base_foods, other_foods])
-        
-        catalog_items = []
-        for food_id in selected_foods:
-            base_price = np.random.lognormal(mean=1.5, sigma=0.5)
-            catalog_items.append({
+
+        selected = rng.choice(len(other_foods), num_other, replace=False, p=other_weights)
+        selected_foods = list(base_foods) + [other_foods[j] for j in selected]
+        prices = (rng.lognormal(mean=1.5, sigma=0.5, size=len(selected_foods)) * 100).astype(int)
+        quantities = rng.integers(10, 200, size=len(selected_foods))
+
+        conn.execute(
+            sqlalchemy.text("""
+            INSERT INTO catalog_item (catalog_id, food_id, price, quantity)
+            SELECT :catalog_id, * FROM unnest(CAST(:food_ids AS int[]), CAST(:prices AS int[]),
+                                              CAST(:quantities AS int[]))
+            """),
+            {
                 "catalog_id": int(catalog_id),
-                "food_id": int(food_id),
-                "price": int(base_price * 100),
-                "quantity": int(np.random.randint(10, 200))
-            })
+                "food_ids": [int(food_id) for food_id in selected_foods],
+                "prices": prices.tolist(),
+                "quantities": quantities.tolist()
+            }
+        )
+        if i % 10 == 0 or i == len(store_ids):
+            print(f"Processed store {i}/{len(store_ids)}")
 
-        for chunk in [catalog_items[i:i + 100] for i in range(0, len(catalog_items), 100)]:
-            conn.execute(
-                sqlalchemy.text("""
-                INSERT INTO catalog_item (catalog_id, food_id, price, quantity)
-                VALUES (:catalog_id, :food_id, :price, :quantity)
-                """),
-                chunk
-            )
-        print(f"Processed store {i}/{len(store_ids)}")
-    
+
+def generate_shopping_lists_and_items(conn, config, rng, user_ids, food_ids, food_weights):
     print("Generating shopping lists and items...")
-    generate_shopping_lists_and_items(conn, user_ids, food_ids)
 
-print("Data generation complete")
\ No newline at end of file
+    # Active users own most of the lists, popular foods fill most of them
+    num_lists = int(rng.poisson(lam=config.lists_per_user * len(user_ids)))
+    user_weights = zipf_weights(len(user_ids), config.user_skew, rng)
+    list_owners = rng.choice(np.asarray(user_ids), size=num_lists, p=user_weights)
+    list_sizes = np.maximum(1, rng.poisson(config.items_per_list, size=num_lists))
+    picks = rng.choice(np.asarray(food_ids), size=int(list_sizes.sum()), p=food_weights)
+    list_names = rng.choice(LIST_NAMES, size=num_lists)
+    # Last activity, mostly recent with a long tail for the retention job
+    list_ages = np.minimum(rng.exponential(LIST_AGE_DAYS, size=num_lists), 2 * 365) * 86400
+
+    # Item inserts would otherwise mark every list as just touched
+    conn.execute(sqlalchemy.text("ALTER TABLE shopping_list_item DISABLE TRIGGER touch_shopping_list"))
+
+    item_count = 0
+    offset = 0
+    for start in range(0, num_lists, BATCH_SIZE):
+        end = min(start + BATCH_SIZE, num_lists)
+        list_ids = conn.execute(
+            sqlalchemy.text("""
+            INSERT INTO shopping_list (name, user_id, updated_at)
+            SELECT name, user_id, now() - make_interval(secs => age)
+            FROM unnest(CAST(:names AS text[]), CAST(:user_ids AS bigint[]), CAST(:ages AS float8[]))
+                AS list(name, user_id, age)
+            RETURNING list_id
+            """),
+            {
+                "names": list_names[start:end].tolist(),
+                "user_ids": list_owners[start:end].tolist(),
+                "ages": list_ages[start:end].tolist()
+            }
+        ).scalars().all()
+
+        items = {"list_id": [], "food_id": [], "user_id": [], "quantity": []}
+        for list_id, user_id, size in zip(list_ids, list_owners[start:end], list_sizes[start:end]):
+            # Duplicate draws of a hot food collapse into one line item
+            foods = np.unique(picks[offset:offset + size])
+            offset += size
+            items["list_id"].extend([int(list_id)] * len(foods))
+            items["food_id"].extend(int(food_id) for food_id in foods)
+            items["user_id"].extend([int(user_id)] * len(foods))
+            items["quantity"].extend(rng.integers(1, 5, size=len(foods)).tolist())
+        item_count += len(items["list_id"])
+
+        conn.execute(
+            sqlalchemy.text("""
+            INSERT INTO shopping_list_item (list_id, food_id, user_id, quantity)
+            SELECT * FROM unnest(CAST(:list_id AS int[]), CAST(:food_id AS int[]),
+                                 CAST(:user_id AS bigint[]), CAST(:quantity AS int[]))
+            """),
+            items
+        )
+
+        if (start // BATCH_SIZE) % 20 == 0 or end == num_lists:
+            print(f"Current totals - Lists: {end}/{num_lists}, Items: {item_count}")
+
+    conn.execute(sqlalchemy.text("ALTER TABLE shopping_list_item ENABLE TRIGGER touch_shopping_list"))
+
+
+def populate(conn, config, catalog_only=False):
+    """
+    Fills an empty schema with a synthetic dataset. The same config and seed
+    always produce the same data.
+    """
+    rng = np.random.default_rng(config.seed)
+    fake = Faker()
+    Faker.seed(config.seed)
+
+    user_ids = []
+    if not catalog_only:
+        print(f"Generating {config.num_users} users...")
+        user_ids = insert_users(conn, generate_users(config, rng, fake))
+
+    print(f"Generating {config.num_stores} stores...")
+    store_ids = insert_stores(conn, generate_stores(config, rng, fake))
+
+    print(f"Generating {config.num_food_items} food items...")
+    food_ids = insert_food_items(conn, generate_food_items(config, rng))
+
+    # Common items stay the most popular, the rest follow a Zipf curve
+    food_weights = zipf_weights(len(food_ids), config.food_skew, rng, pinned=len(COMMON_ITEMS))
+
+    generate_catalogs(conn, config, rng, store_ids, food_ids, food_weights)
+
+    if not catalog_only:
+        generate_shopping_lists_and_items(conn, config, rng, user_ids, food_ids, food_weights)
+
+    print("Rolling up price history...")
+    conn.execute(sqlalchemy.text("""
+        INSERT INTO price_history_daily (food_id, day, min_price, max_price, price_sum, price_count, change_count)
+        SELECT food_id, (changed_at AT TIME ZONE 'UTC')::date, MIN(price), MAX(price), SUM(price), COUNT(*), COUNT(*)
+        FROM price_history
+        GROUP BY 1, 2
+        ON CONFLICT (food_id, day) DO NOTHING;
+    """))
+
+    print("Refreshing best_price...")
+    conn.execute(sqlalchemy.text("""
+        REFRESH MATERIALIZED VIEW best_price;
+        INSERT INTO materialized_view_refresh (view_name, refreshed_at)
+        VALUES ('best_price', now())
+        ON CONFLICT (view_name) DO UPDATE SET refreshed_at = EXCLUDED.refreshed_at;
+    """))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate performance testing data for The Crusty Cart")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="Multiplier on the baseline sizes (1.0 is ~1 million rows)")
+    parser.add_argument("--seed", type=int, default=365,
+                        help="Random seed, the same seed always produces the same data")
+    parser.add_argument("--food-skew", type=float, default=1.0,
+                        help="Zipf exponent of food popularity on lists and catalogs, 0 for uniform")
+    parser.add_argument("--user-skew", type=float, default=0.8,
+                        help="Zipf exponent of user activity (lists per user), 0 for uniform")
+    parser.add_argument("--store-clusters", type=int, default=6,
+                        help="Number of shopping districts stores are clustered around")
+    parser.add_argument("--target", choices=["local", "supabase"], default="local",
+                        help="local uses POSTGRES_URI, supabase uses the SUPABASE_* variables")
+    parser.add_argument("--catalog-only", action="store_true",
+                        help="Only regenerate stores, food items and catalogs (default for supabase)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = GeneratorConfig(
+        scale=args.scale,
+        seed=args.seed,
+        food_skew=args.food_skew,
+        user_skew=args.user_skew,
+        store_clusters=args.store_clusters
+    )
+    catalog_only = args.catalog_only or args.target == "supabase"
+    engine = sqlalchemy.create_engine(get_db_url(args.target))
+
+    print("Starting data generation...")
+    with engine.begin() as conn:
+        if catalog_only:
+            reset_catalog_tables(conn)
+        else:
+            reset_tables(conn)
+        populate(conn, config, catalog_only=catalog_only)
+
+    print("Data generation complete")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Benchmark for the shopping_list_item layout: add_item_to_list, get_list and
+list_facts against a running API.
+
+Run it once on the plain table and once after partition_shopping_list_item.sql
+to compare the two layouts on the same data. Every request goes to a random
+list (drawn once per run with the same --seed, so both runs hit the same
+lists), fired from --concurrency threads. The script prints the detected
+layout, throughput and latency percentiles per endpoint, and removes the
+items it added afterwards.
+
+Usage (API running, e.g. `python main.py` from the repo root):
+    python list_partition_benchmark.py --requests 5000 --concurrency 32 \
+        --api-url http://localhost:3000 --api-key $API_KEY
+"""
+import argparse
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import sqlalchemy
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def layout(conn):
+    partitions = conn.execute(sqlalchemy.text("""
+        SELECT COUNT(*) FROM pg_inherits WHERE inhparent = 'shopping_list_item'::regclass
+        """)).scalar_one()
+    items = conn.execute(sqlalchemy.text("""
+        SELECT SUM(reltuples)::bigint FROM pg_class
+        WHERE oid = 'shopping_list_item'::regclass
+           OR oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = 'shopping_list_item'::regclass)
+        """)).scalar_one()
+    name = f"hash partitioned ({partitions} partitions)" if partitions else "unpartitioned"
+    return f"{name}, ~{max(items or 0, 0):,} items"
+
+
+def setup(conn, requests, seed):
+    """
+    Draws the lists to read, and for adds one food per request that its list
+    does not hold yet.
+    """
+    lists = conn.execute(sqlalchemy.text("""
+        SELECT list_id, user_id FROM shopping_list
+        WHERE user_id IS NOT NULL
+        ORDER BY md5(list_id::text || :seed)
+        LIMIT :requests
+        """), {"requests": requests, "seed": str(seed)}).all()
+    adds = conn.execute(sqlalchemy.text("""
+        SELECT pick.list_id, pick.user_id, food_item.food_id
+        FROM unnest(CAST(:list_ids AS int[]), CAST(:user_ids AS bigint[])) AS pick(list_id, user_id)
+        CROSS JOIN LATERAL (
+            SELECT food_id FROM food_item
+            WHERE NOT EXISTS (
+                SELECT 1 FROM shopping_list_item
+                WHERE shopping_list_item.list_id = pick.list_id
+                  AND shopping_list_item.user_id = pick.user_id
+                  AND shopping_list_item.food_id = food_item.food_id)
+            ORDER BY food_id
+            LIMIT 1
+        ) AS food_item
+        """), {"list_ids": [row.list_id for row in lists],
+               "user_ids": [row.user_id for row in lists]}).all()
+    return [(row.user_id, row.list_id) for row in lists], [(row.user_id, row.list_id, row.food_id) for row in adds]
+
+
+def cleanup(conn, adds):
+    conn.execute(sqlalchemy.text("""
+        DELETE FROM shopping_list_item
+        USING unnest(CAST(:user_ids AS bigint[]), CAST(:list_ids AS int[]), CAST(:food_ids AS int[]))
+            AS added(user_id, list_id, food_id)
+        WHERE shopping_list_item.user_id = added.user_id
+          AND shopping_list_item.list_id = added.list_id
+          AND shopping_list_item.food_id = added.food_id
+        """), {"user_ids": [user_id for user_id, _, _ in adds],
+               "list_ids": [list_id for _, list_id, _ in adds],
+               "food_ids": [food_id for _, _, food_id in adds]})
+
+
+def call(api_url, api_key, method, path, body=None):
+    data = None if body is None else json.dumps(body).encode()
+    request = urllib.request.Request(f"{api_url}{path}", data=data, method=method,
+                                     headers={"access_token": api_key, "Content-Type": "application/json"})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request) as response:
+            response.read()
+            code = response.status
+    except urllib.error.HTTPError as e:
+        code = e.code
+    except urllib.error.URLError:
+        code = "connection error"
+    return code, time.perf_counter() - start
+
+
+def request_for(endpoint, target):
+    if endpoint == "add_item_to_list":
+        user_id, list_id, food_id = target
+        return "POST", f"/users/{user_id}/lists/{list_id}/item", [{"food_id": food_id, "quantity": 1}]
+    user_id, list_id = target
+    if endpoint == "get_list":
+        return "GET", f"/users/{user_id}/list/{list_id}", None
+    return "GET", f"/users/{user_id}/lists/{list_id}/facts", None
+
+
+def run(args, endpoint, targets):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(
+            lambda target: call(args.api_url, args.api_key, *request_for(endpoint, target)), targets))
+    elapsed = time.perf_counter() - start
+
+    codes = Counter(code for code, _ in results)
+    latencies = np.array([latency for _, latency in results]) * 1000
+    print(f"{endpoint:>17}: {len(results) / elapsed:7.1f} req/s, latency ms - "
+          f"p50: {np.percentile(latencies, 50):.1f}, p95: {np.percentile(latencies, 95):.1f}, "
+          f"p99: {np.percentile(latencies, 99):.1f}, status codes: {dict(codes)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare shopping_list_item layouts through the list endpoints")
+    parser.add_argument("--requests", type=int, default=5000, help="Requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=365, help="Same seed, same lists")
+    parser.add_argument("--api-url", default=os.environ.get("API_URL", "http://localhost:3000"))
+    parser.add_argument("--api-key", default=os.environ.get("API_KEY"))
+    args = parser.parse_args()
+
+    engine = sqlalchemy.create_engine(os.environ.get("POSTGRES_URI"))
+    with engine.begin() as conn:
+        print(f"shopping_list_item: {layout(conn)}")
+        lists, adds = setup(conn, args.requests, args.seed)
+    print(f"{len(lists)} lists, {args.concurrency} concurrent requests")
+
+    try:
+        run(args, "add_item_to_list", adds)
+        run(args, "get_list", lists)
+        run(args, "list_facts", lists)
+    finally:
+        with engine.begin() as conn:
+            cleanup(conn, adds)
+
+
+if __name__ == "__main__":
+    main()
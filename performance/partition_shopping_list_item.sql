@@ -0,0 +1,74 @@
+-- Hash-partitions shopping_list_item by user_id.
+--
+-- Every list endpoint filters items by the list's user_id, so with this
+-- layout each request touches one partition's heap and indexes instead of
+-- the whole table, and writes from different users spread over PARTITIONS
+-- separate tables. The primary key becomes (user_id, list_id, food_id).
+-- A foreign key to shopping_list(list_id, user_id) pins every item to its
+-- list's owner, so a list still holds each food at most once.
+--
+-- shopping_list stays unpartitioned. Lists are looked up by list_id alone
+-- (to tell "no such list" from "not your list"), and with lists partitioned
+-- by user those lookups would probe every partition.
+--
+-- Run in a maintenance window. List writes wait for the copy, reads don't:
+--     psql -U postgres -d perf_db -v partitions=16 -f partition_shopping_list_item.sql
+-- The old table is kept as shopping_list_item_unpartitioned to roll back to.
+-- Drop it once the new layout has proven itself. It loses its foreign keys,
+-- otherwise deleting any list that existed before the migration would fail
+-- on the copy's reference to it. To roll back, delete the copy's rows whose
+-- list, user or food is gone before adding the keys back.
+
+\if :{?partitions}
+\else
+    \set partitions 16
+\endif
+
+BEGIN;
+
+LOCK TABLE shopping_list_item IN EXCLUSIVE MODE;
+
+ALTER TABLE shopping_list ADD CONSTRAINT shopping_list_list_user_key UNIQUE (list_id, user_id);
+
+CREATE TABLE public.shopping_list_item_partitioned (
+    list_id integer NOT NULL,
+    food_id integer NOT NULL,
+    user_id bigint NOT NULL,
+    quantity integer,
+    CONSTRAINT shopping_list_item_partitioned_pkey PRIMARY KEY (user_id, list_id, food_id)
+) PARTITION BY HASH (user_id);
+
+SELECT format('CREATE TABLE public.shopping_list_item_p%s PARTITION OF public.shopping_list_item_partitioned '
+              'FOR VALUES WITH (MODULUS %s, REMAINDER %s)', remainder, :partitions, remainder)
+FROM generate_series(0, :partitions - 1) AS remainder
+\gexec
+
+INSERT INTO shopping_list_item_partitioned (list_id, food_id, user_id, quantity)
+SELECT list_id, food_id, user_id, quantity
+FROM shopping_list_item;
+
+-- Swap the tables, index names are unique per schema
+DROP TRIGGER touch_shopping_list ON shopping_list_item;
+ALTER TABLE shopping_list_item RENAME TO shopping_list_item_unpartitioned;
+ALTER INDEX shopping_list_item_pkey RENAME TO shopping_list_item_unpartitioned_pkey;
+ALTER INDEX unique_user_list_item RENAME TO shopping_list_item_unpartitioned_user_key;
+ALTER TABLE shopping_list_item_unpartitioned
+    DROP CONSTRAINT shopping_list_item_food_id_fkey,
+    DROP CONSTRAINT shopping_list_item_list_id_fkey,
+    DROP CONSTRAINT shopping_list_item_user_id_fkey;
+ALTER TABLE shopping_list_item_partitioned RENAME TO shopping_list_item;
+ALTER INDEX shopping_list_item_partitioned_pkey RENAME TO shopping_list_item_pkey;
+
+ALTER TABLE shopping_list_item
+    ADD CONSTRAINT shopping_list_item_food_id_fkey FOREIGN KEY (food_id) REFERENCES food_item(food_id),
+    ADD CONSTRAINT shopping_list_item_list_user_fkey FOREIGN KEY (list_id, user_id)
+        REFERENCES shopping_list(list_id, user_id),
+    ADD CONSTRAINT shopping_list_item_user_id_fkey FOREIGN KEY (user_id) REFERENCES users(user_id);
+
+CREATE TRIGGER touch_shopping_list
+AFTER INSERT OR UPDATE OR DELETE ON shopping_list_item
+FOR EACH ROW EXECUTE FUNCTION public.touch_shopping_list();
+
+COMMIT;
+
+ANALYZE shopping_list_item;
@@ -0,0 +1,5 @@
+#!/bin/bash
+# Runs once when the primary's data directory is initialised, lets the
+# replica container stream WAL from it.
+set -e
+echo "host replication all all scram-sha-256" >> "$PGDATA/pg_hba.conf"
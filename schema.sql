@@ -4,6 +4,9 @@ CREATE EXTENSION IF NOT EXISTS cube;
 -- Enable earthdistance extension
 CREATE EXTENSION IF NOT EXISTS earthdistance;
 
+-- Enable trigram matching for fuzzy food name search
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- Users table
 CREATE TABLE public.users (
     user_id bigint GENERATED BY DEFAULT AS IDENTITY NOT NULL,
@@ -61,6 +64,9 @@ INSERT INTO catalog(catalog_id, store_id)
 VALUES (1, 1),
 (2, 2);
 
+-- Explicit ids do not advance the identity, the next catalog would collide with them
+SELECT setval(pg_get_serial_sequence('public.catalog', 'catalog_id'), (SELECT MAX(catalog_id) FROM catalog));
+
 -- Catalog Items table (joins specific catalogs with food items and their associated prices)
 CREATE TABLE public.catalog_item (
     catalog_item_id integer generated by default as identity not null,
@@ -82,6 +88,7 @@ CREATE TABLE public.shopping_list (
     list_id integer GENERATED BY DEFAULT AS IDENTITY NOT NULL,
     name text,
     user_id bigint,
+    updated_at timestamp with time zone NOT NULL DEFAULT now(),
     CONSTRAINT shopping_list_pkey PRIMARY KEY (list_id),
     CONSTRAINT shopping_list_user_id_fkey FOREIGN KEY (user_id) REFERENCES users(user_id)
 );
@@ -100,4 +107,312 @@ CREATE TABLE public.shopping_list_item (
 
 CREATE INDEX idx_catalog_item_catalog ON catalog_item(catalog_id);
 CREATE INDEX idx_shopping_list_user ON shopping_list(user_id);
-CREATE INDEX idx_catalog_item_composite ON catalog_item(food_id, price);
\ No newline at end of file
+CREATE INDEX idx_catalog_item_composite ON catalog_item(food_id, price);
+CREATE INDEX idx_store_location ON store USING gist (ll_to_earth(latitude, longitude));
+CREATE INDEX idx_food_item_name_trgm ON food_item USING gin (name gin_trgm_ops);
+CREATE INDEX idx_shopping_list_updated_at ON shopping_list(updated_at);
+
+-- Lists removed by src/retention.py, kept for analytics
+CREATE TABLE public.shopping_list_archive (
+    list_id integer NOT NULL,
+    name text,
+    user_id bigint,
+    updated_at timestamp with time zone NOT NULL,
+    archived_at timestamp with time zone NOT NULL DEFAULT now(),
+    CONSTRAINT shopping_list_archive_pkey PRIMARY KEY (list_id)
+);
+
+CREATE TABLE public.shopping_list_item_archive (
+    list_id integer NOT NULL,
+    food_id integer NOT NULL,
+    user_id bigint NOT NULL,
+    quantity integer,
+    CONSTRAINT shopping_list_item_archive_pkey PRIMARY KEY (list_id, food_id)
+);
+
+-- Any change to a list's items counts as activity. Lists touched within the
+-- last hour are not rewritten again, so busy lists cost no extra writes.
+CREATE FUNCTION public.touch_shopping_list() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE shopping_list
+    SET updated_at = now()
+    WHERE list_id = CASE WHEN TG_OP = 'DELETE' THEN OLD.list_id ELSE NEW.list_id END
+        AND updated_at < now() - interval '1 hour';
+    RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER touch_shopping_list
+AFTER INSERT OR UPDATE OR DELETE ON shopping_list_item
+FOR EACH ROW EXECUTE FUNCTION public.touch_shopping_list();
+
+-- Cheapest offers of every food across all stores, refreshed in the
+-- background by src/best_prices.py (TOP_N there matches the 10 below)
+CREATE MATERIALIZED VIEW public.best_price AS
+SELECT food_id, store_id, price, price_rank, offer_rank
+FROM (
+    SELECT catalog_item.food_id, catalog.store_id, catalog_item.price,
+        RANK() OVER (PARTITION BY catalog_item.food_id ORDER BY catalog_item.price) AS price_rank,
+        ROW_NUMBER() OVER (PARTITION BY catalog_item.food_id
+                           ORDER BY catalog_item.price, catalog_item.catalog_item_id) AS offer_rank
+    FROM catalog_item
+    JOIN catalog ON catalog.catalog_id = catalog_item.catalog_id
+) ranked
+WHERE offer_rank <= 10;
+
+-- Unique index required for REFRESH MATERIALIZED VIEW CONCURRENTLY
+CREATE UNIQUE INDEX idx_best_price_food_offer ON best_price(food_id, offer_rank);
+
+CREATE TABLE public.materialized_view_refresh (
+    view_name text NOT NULL,
+    refreshed_at timestamp with time zone NOT NULL,
+    duration_ms integer,
+    CONSTRAINT materialized_view_refresh_pkey PRIMARY KEY (view_name)
+);
+
+INSERT INTO materialized_view_refresh (view_name, refreshed_at) VALUES ('best_price', now());
+
+-- Every price a catalog item has had, appended by the statement-level
+-- triggers below. Monthly range partitions keep each month's rows together,
+-- and BRIN indexes on changed_at stay tiny because rows arrive in time order.
+CREATE TABLE public.price_history (
+    changed_at timestamp with time zone NOT NULL DEFAULT now(),
+    catalog_item_id integer NOT NULL,
+    food_id integer NOT NULL,
+    store_id integer,
+    old_price integer,
+    price integer NOT NULL
+) PARTITION BY RANGE (changed_at);
+
+CREATE INDEX idx_price_history_changed_at ON price_history USING brin (changed_at);
+
+-- Catches rows no monthly partition was created for in time
+CREATE TABLE public.price_history_default PARTITION OF public.price_history DEFAULT;
+
+-- Creates the partitions for this month and the next months_ahead months (UTC),
+-- called by src/price_history.py. Rows of a missing month that landed in the
+-- default partition are moved into the new partition before it is attached,
+-- attaching a range the default partition still holds rows of would fail.
+CREATE FUNCTION public.create_price_history_partitions(months_ahead integer) RETURNS void
+LANGUAGE plpgsql AS $$
+DECLARE
+    month_start timestamp;
+    partition_name text;
+BEGIN
+    FOR i IN 0..months_ahead LOOP
+        month_start := date_trunc('month', now() AT TIME ZONE 'UTC') + make_interval(months => i);
+        partition_name := 'price_history_' || to_char(month_start, 'YYYY_MM');
+        CONTINUE WHEN to_regclass('public.' || partition_name) IS NOT NULL;
+
+        LOCK TABLE price_history_default IN EXCLUSIVE MODE;
+        EXECUTE format('CREATE TABLE public.%I (LIKE public.price_history INCLUDING DEFAULTS)', partition_name);
+        EXECUTE format(
+            'WITH moved AS (DELETE FROM public.price_history_default WHERE changed_at >= %L AND changed_at < %L RETURNING *) '
+            'INSERT INTO public.%I SELECT * FROM moved',
+            month_start AT TIME ZONE 'UTC',
+            (month_start + interval '1 month') AT TIME ZONE 'UTC',
+            partition_name);
+        EXECUTE format(
+            'ALTER TABLE public.price_history ATTACH PARTITION public.%I FOR VALUES FROM (%L) TO (%L)',
+            partition_name,
+            month_start AT TIME ZONE 'UTC',
+            (month_start + interval '1 month') AT TIME ZONE 'UTC');
+    END LOOP;
+END;
+$$;
+
+SELECT public.create_price_history_partitions(3);
+
+-- One set-based insert per statement, however many rows it changed
+CREATE FUNCTION public.record_price_changes() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO price_history (catalog_item_id, food_id, store_id, old_price, price)
+        SELECT new_items.catalog_item_id, new_items.food_id, catalog.store_id, NULL, new_items.price
+        FROM new_items
+        LEFT JOIN catalog ON catalog.catalog_id = new_items.catalog_id
+        WHERE new_items.price IS NOT NULL AND new_items.food_id IS NOT NULL;
+    ELSE
+        INSERT INTO price_history (catalog_item_id, food_id, store_id, old_price, price)
+        SELECT new_items.catalog_item_id, new_items.food_id, catalog.store_id, old_items.price, new_items.price
+        FROM new_items
+        JOIN old_items ON old_items.catalog_item_id = new_items.catalog_item_id
+        LEFT JOIN catalog ON catalog.catalog_id = new_items.catalog_id
+        WHERE new_items.price IS DISTINCT FROM old_items.price
+            AND new_items.price IS NOT NULL AND new_items.food_id IS NOT NULL;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER record_price_inserts
+AFTER INSERT ON catalog_item
+REFERENCING NEW TABLE AS new_items
+FOR EACH STATEMENT EXECUTE FUNCTION public.record_price_changes();
+
+CREATE TRIGGER record_price_updates
+AFTER UPDATE ON catalog_item
+REFERENCING OLD TABLE AS old_items NEW TABLE AS new_items
+FOR EACH STATEMENT EXECUTE FUNCTION public.record_price_changes();
+
+-- Per food and UTC day, rolled up from price_history by src/price_history.py.
+-- The prices cover every catalog item's price when the day began and every
+-- change during it, change_count counts the changes alone.
+CREATE TABLE public.price_history_daily (
+    food_id integer NOT NULL,
+    day date NOT NULL,
+    min_price integer NOT NULL,
+    max_price integer NOT NULL,
+    price_sum bigint NOT NULL,
+    price_count integer NOT NULL,
+    change_count integer NOT NULL DEFAULT 0,
+    CONSTRAINT price_history_daily_pkey PRIMARY KEY (food_id, day)
+);
+
+-- Versions behind the ETags of GET /stores/ and GET /stores/{store_id}/catalog
+-- (src/etags.py). The triggers below bump them in the same transaction as
+-- the change they cover, so a version never runs ahead of the data.
+CREATE TABLE public.store_version (
+    singleton boolean NOT NULL DEFAULT true,
+    version bigint NOT NULL,
+    CONSTRAINT store_version_pkey PRIMARY KEY (singleton),
+    CONSTRAINT store_version_singleton CHECK (singleton)
+);
+
+-- Starts at the creation time, so a recreated database never reissues an
+-- ETag a client may still hold
+INSERT INTO store_version (version) VALUES ((extract(epoch FROM now()) * 1000)::bigint);
+
+-- Stores without a row have version 0
+CREATE TABLE public.catalog_version (
+    store_id integer NOT NULL,
+    version bigint NOT NULL DEFAULT 1,
+    CONSTRAINT catalog_version_pkey PRIMARY KEY (store_id)
+);
+
+CREATE FUNCTION public.bump_store_version() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE store_version SET version = version + 1;
+    RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER bump_store_version
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON store
+FOR EACH STATEMENT EXECUTE FUNCTION public.bump_store_version();
+
+-- Stores are locked in order, so concurrent bumps cannot deadlock
+CREATE FUNCTION public.bump_catalog_versions(store_ids integer[]) RETURNS void
+LANGUAGE sql AS $$
+    INSERT INTO catalog_version AS stored (store_id)
+    SELECT DISTINCT store_id FROM unnest(store_ids) AS store_id
+    WHERE store_id IS NOT NULL
+    ORDER BY store_id
+    ON CONFLICT (store_id) DO UPDATE SET version = stored.version + 1;
+$$;
+
+-- One bump per store and statement, however many of its items changed.
+-- Only changes to which foods a catalog holds bump it here, price and
+-- quantity updates are bumped at commit by bump_catalog_item_stock below.
+CREATE FUNCTION public.bump_catalog_item_versions() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM bump_catalog_versions(ARRAY(
+            SELECT catalog.store_id FROM catalog
+            WHERE catalog.catalog_id IN (SELECT catalog_id FROM new_items)));
+    ELSIF TG_OP = 'UPDATE' THEN
+        PERFORM bump_catalog_versions(ARRAY(
+            SELECT catalog.store_id FROM catalog
+            WHERE catalog.catalog_id IN (
+                SELECT unnest(ARRAY[new_items.catalog_id, old_items.catalog_id])
+                FROM new_items
+                JOIN old_items ON old_items.catalog_item_id = new_items.catalog_item_id
+                WHERE (new_items.catalog_id, new_items.food_id)
+                    IS DISTINCT FROM (old_items.catalog_id, old_items.food_id))));
+    ELSE
+        PERFORM bump_catalog_versions(ARRAY(
+            SELECT catalog.store_id FROM catalog
+            WHERE catalog.catalog_id IN (SELECT catalog_id FROM old_items)));
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER bump_catalog_item_inserts
+AFTER INSERT ON catalog_item
+REFERENCING NEW TABLE AS new_items
+FOR EACH STATEMENT EXECUTE FUNCTION public.bump_catalog_item_versions();
+
+CREATE TRIGGER bump_catalog_item_updates
+AFTER UPDATE ON catalog_item
+REFERENCING OLD TABLE AS old_items NEW TABLE AS new_items
+FOR EACH STATEMENT EXECUTE FUNCTION public.bump_catalog_item_versions();
+
+CREATE TRIGGER bump_catalog_item_deletes
+AFTER DELETE ON catalog_item
+REFERENCING OLD TABLE AS old_items
+FOR EACH STATEMENT EXECUTE FUNCTION public.bump_catalog_item_versions();
+
+-- Price and quantity changes, checkouts included. The trigger is deferred
+-- to commit and bumps each store once per transaction, so the store's
+-- catalog_version row is only locked while the transaction commits rather
+-- than for all of it, and buyers at one store don't queue on each other.
+CREATE FUNCTION public.bump_catalog_item_stock() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    changed_store integer;
+BEGIN
+    SELECT store_id INTO changed_store FROM catalog WHERE catalog_id = NEW.catalog_id;
+    IF changed_store IS NOT NULL
+            AND current_setting('crusty.catalog_bumped_' || changed_store, true) IS DISTINCT FROM 'on' THEN
+        PERFORM bump_catalog_versions(ARRAY[changed_store]);
+        PERFORM set_config('crusty.catalog_bumped_' || changed_store, 'on', true);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+CREATE CONSTRAINT TRIGGER bump_catalog_item_stock
+AFTER UPDATE OF price, quantity ON catalog_item
+DEFERRABLE INITIALLY DEFERRED
+FOR EACH ROW WHEN (OLD.price IS DISTINCT FROM NEW.price OR OLD.quantity IS DISTINCT FROM NEW.quantity)
+EXECUTE FUNCTION public.bump_catalog_item_stock();
+
+-- A catalog moving to another store changes both stores' catalogs
+CREATE FUNCTION public.bump_moved_catalog_version() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM bump_catalog_versions(ARRAY[OLD.store_id]);
+    ELSE
+        PERFORM bump_catalog_versions(ARRAY[OLD.store_id, NEW.store_id]);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER bump_moved_catalog_version
+AFTER UPDATE OF store_id OR DELETE ON catalog
+FOR EACH ROW EXECUTE FUNCTION public.bump_moved_catalog_version();
+
+-- Renaming a food changes the catalog of every store that lists it
+CREATE FUNCTION public.bump_renamed_food_versions() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM bump_catalog_versions(ARRAY(
+        SELECT catalog.store_id
+        FROM catalog_item
+        JOIN catalog ON catalog.catalog_id = catalog_item.catalog_id
+        WHERE catalog_item.food_id = NEW.food_id));
+    RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER bump_renamed_food_versions
+AFTER UPDATE OF name ON food_item
+FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+EXECUTE FUNCTION public.bump_renamed_food_versions();
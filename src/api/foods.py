@@ -0,0 +1,150 @@
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, status, Query
+import sqlalchemy
+from sqlalchemy.orm.exc import NoResultFound
+import logging
+from src import database as db
+from src import food_index, nearby_stores, transactions, value_index
+from src.api import auth
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(
+    prefix="/foods",
+    tags=["foods"],
+    dependencies=[Depends(auth.get_api_key)],
+)
+
+
+@router.get("/search", status_code=status.HTTP_200_OK)
+def search_foods(q: str = Query(..., min_length=1, max_length=100, description="Start of a food name, e.g. 'chick br'"),
+                 limit: int = Query(10, gt=0, le=50, description="Most results to return"),
+                 fuzzy: bool = Query(True, description="Fall back to fuzzy matching when no name starts with q")):
+    """
+    Autocomplete for food names. Every word in q matches the start of a word
+    in the name, so "fr ch" finds "Fresh Chicken". Typos fall back to
+    trigram similarity in Postgres.
+    """
+    matches = food_index.current(db.engine).search(q, limit)
+
+    if not matches and fuzzy:
+        with db.engine.begin() as conn:
+            matches = conn.execute(sqlalchemy.text("""
+                SELECT food_id, name
+                FROM food_item
+                WHERE name % :q
+                ORDER BY similarity(name, :q) DESC, food_id
+                LIMIT :limit
+                """), {"q": q, "limit": limit}).all()
+
+    return [
+        {
+            "food_id": food_id,
+            "name": name
+        }
+        for food_id, name in matches
+    ]
+
+
+@router.get("/best-value", status_code=status.HTTP_200_OK)
+def best_value(metric: str = Query("protein", description="protein, calories or serving"),
+               k: int = Query(10, gt=0, le=100, description="How many items to return"),
+               user_id: Optional[int] = Query(None, description="Only stores within max_dist km of this user"),
+               max_dist: float = Query(10, gt=0, le=nearby_stores.MAX_RADIUS_KM)):
+    """
+    The catalog items with the lowest price per gram of protein, per calorie
+    or per serving, from the precomputed rankings in value_index.
+    """
+    units = {
+        "protein": "gram of protein",
+        "calories": "calorie",
+        "serving": "serving",
+    }
+    if metric not in units:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Invalid metric option")
+
+    store_ids = None
+    if user_id is not None:
+        with db.engine.begin() as conn:
+            try:
+                nearby = nearby_stores.get(conn, user_id, max_dist)
+            except NoResultFound:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                    detail="User does not exist")
+        store_ids = set(nearby.within(max_dist)[0])
+        if not store_ids:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                detail="No stores in range")
+
+    ranked = value_index.current(db.engine).top(metric, k, store_ids)
+
+    # The shared snapshot only holds numbers, names come from the database
+    with db.engine.begin() as conn:
+        food_names = dict(conn.execute(sqlalchemy.text("""
+            SELECT food_id, name FROM food_item WHERE food_id = ANY(:food_ids)
+            """), {"food_ids": list({offer.food_id for _, offer in ranked})}).all())
+        store_names = dict(conn.execute(sqlalchemy.text("""
+            SELECT store_id, name FROM store WHERE store_id = ANY(:store_ids)
+            """), {"store_ids": list({offer.store_id for _, offer in ranked})}).all())
+
+    return [
+        {
+            "food_id": offer.food_id,
+            "item": food_names.get(offer.food_id),
+            "store_id": offer.store_id,
+            "store_name": store_names.get(offer.store_id),
+            "price": f"${offer.price / 100:.2f}",
+            "cents_per_unit": round(cents, 3),
+            "unit": units[metric]
+        }
+        for cents, offer in ranked
+    ]
+
+
+@router.get("/{food_id}/price-trend", status_code=status.HTTP_200_OK)
+@transactions.retry_on_conflict
+def price_trend(food_id: int,
+                days: int = Query(30, gt=0, le=366, description="Window in days, ending today (UTC)")):
+    """
+    Lowest, highest and average price a food was listed at over the last
+    days, overall and per day, from the daily price rollups. Prices that
+    held steady count too, not just the changes.
+    """
+    with db.read_only().begin() as conn:
+        rollups = conn.execute(sqlalchemy.text("""
+            SELECT day, min_price, max_price, price_sum, price_count, change_count
+            FROM price_history_daily
+            WHERE food_id = :food_id
+              AND day > (now() AT TIME ZONE 'UTC')::date - :days
+            ORDER BY day
+            """), {"food_id": food_id, "days": days}).all()
+        if not rollups and conn.execute(sqlalchemy.text("""
+                SELECT food_id FROM food_item WHERE food_id = :food_id
+                """), {"food_id": food_id}).first() is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                detail="Food_id does not exist")
+
+    def dollars(cents):
+        return None if cents is None else f"${cents / 100:.2f}"
+
+    total = sum(day.price_sum for day in rollups)
+    count = sum(day.price_count for day in rollups)
+    return {
+        "food_id": food_id,
+        "days": days,
+        "min_price": dollars(min((day.min_price for day in rollups), default=None)),
+        "max_price": dollars(max((day.max_price for day in rollups), default=None)),
+        "avg_price": dollars(total / count if count else None),
+        "price_changes": sum(day.change_count for day in rollups),
+        "daily": [
+            {
+                "day": day.day.isoformat(),
+                "min_price": dollars(day.min_price),
+                "max_price": dollars(day.max_price),
+                "avg_price": dollars(day.price_sum / day.price_count),
+                "price_changes": day.change_count
+            }
+            for day in rollups
+        ]
+    }
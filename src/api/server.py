@@ -1,11 +1,15 @@
-from fastapi import FastAPI, exceptions
+from fastapi import Depends, FastAPI, Request, exceptions, status
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import JSONResponse
 from pydantic import ValidationError
-from src.api import auth, stores, users, shopping
+from src.api import auth, stores, users, shopping, foods, warmup
+from src import best_prices, deadline, metrics, price_history
+from src import database as db
 import json
 import logging
 import sys
 from starlette.middleware.cors import CORSMiddleware
+from starlette.routing import Match
 
 logging.basicConfig(
     level=logging.DEBUG,
@@ -46,10 +50,68 @@ app = FastAPI(
 #     allow_headers=["*"],
 # )
 
+# Store lists and catalogs run to hundreds of KB of repetitive JSON, small
+# responses are not worth the CPU
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=6)
+
 # Include routers
 app.include_router(users.router)
 app.include_router(stores.router)
 app.include_router(shopping.router)
+app.include_router(foods.router)
+
+@app.on_event("startup")
+def start_background_jobs():
+    best_prices.start_scheduler(db.engine)
+    price_history.start_scheduler(db.engine)
+
+@app.on_event("startup")
+async def start_warm_up():
+    warmup.start(app)
+
+def route_name(scope):
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.name
+    return None
+
+@app.middleware("http")
+async def enforce_deadline(request: Request, call_next):
+    """
+    Gives every request a deadline that its database work has to finish in,
+    answering 503 instead of tying up a worker once it has passed.
+    """
+    name = route_name(request.scope)
+    current = deadline.start(deadline.budget_ms(name, request.headers.get(deadline.DEADLINE_HEADER)))
+    try:
+        response = await call_next(request)
+    except Exception:
+        # Cancelled statements surface as whatever error the endpoint raised
+        if not current.expired:
+            raise
+    if current.expired:
+        metrics.increment("deadline_exceeded", name)
+        logging.warning(f"{name} ran past its {current.budget_ms}ms deadline")
+        return JSONResponse({"detail": "Request took too long, try again later"},
+                            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            headers={"Retry-After": "1"})
+    return response
+
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next):
+    """
+    Keeps a user's reads on the primary for a moment after they write, see
+    database.reader(). The marker travels in a cookie rather than living in
+    this process, since the next request may reach another worker. Added
+    after enforce_deadline so it also marks writes that ended in a 503.
+    """
+    marker = db.start_request(request.cookies.get(db.WRITE_COOKIE))
+    response = await call_next(request)
+    if marker.changed:
+        response.set_cookie(db.WRITE_COOKIE, marker.cookie(), max_age=db.STICKY_SECONDS,
+                            httponly=True, samesite="strict")
+    return response
 
 @app.exception_handler(exceptions.RequestValidationError)
 @app.exception_handler(ValidationError)
@@ -63,4 +125,32 @@ async def validation_exception_handler(request, exc):
 
 @app.get("/")
 async def root():
-    return {"message": "Welcome to the The Crusty Cart API"}
\ No newline at end of file
+    return {"message": "Welcome to the The Crusty Cart API"}
+
+@app.get("/health")
+async def health():
+    """
+    Liveness: the process is up and serving. Needs no API key and does not
+    touch the database.
+    """
+    return {"status": "ok"}
+
+@app.get("/ready")
+async def ready():
+    """
+    Readiness: 503 until this worker has finished warming up, see
+    src/api/warmup.py. Needs no API key.
+    """
+    if not warmup.is_ready():
+        return JSONResponse({"status": "warming up"}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            headers={"Retry-After": "1"})
+    return {"status": "ready"}
+
+@app.get("/metrics", dependencies=[Depends(auth.get_api_key)])
+async def get_metrics():
+    """
+    Counters for this worker process, e.g. how many database executions
+    request coalescing saved (singleflight_shared) per route. Needs the API
+    key, unlike /health and /ready.
+    """
+    return metrics.snapshot()
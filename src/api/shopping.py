@@ -2,13 +2,15 @@ from xmlrpc.client import MAXINT
 from fastapi import APIRouter, Depends, HTTPException, status, Path, Query
 from pydantic import BaseModel, Field, validator
 from typing import Optional, Dict
+from datetime import datetime
 import sqlalchemy
 from sqlalchemy.exc import NoResultFound
 import logging
 from src import database as db
-from src.api import auth
+from src import best_prices, nearby_stores, singleflight, store_hours, transactions
+from src.api import auth, users
 import math
-from geopy.distance import geodesic
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
@@ -19,23 +21,60 @@ router = APIRouter(
 )
 
 
+def open_stores_only(conn, store_ids, distances, when):
+    """
+    Drops the stores closed at `when` from a nearby store list, before any
+    price or catalog work is done for them.
+    """
+    if when is None:
+        return store_ids, distances
+    open_ids = store_hours.open_store_ids(conn, when)
+    kept = [(store_id, distance) for store_id, distance in zip(store_ids, distances)
+            if store_id in open_ids]
+    return [store_id for store_id, _ in kept], [distance for _, distance in kept]
+
+
+EARTH_RADIUS_KM = 6378.168  # same sphere as earthdistance's earth()
+MAX_ROUTE_ITEMS = 200
+
+
+def haversine_km(latitude, longitude, latitudes, longitudes):
+    """
+    Great circle distances in km from one point to arrays of points.
+    """
+    lat1, lon1 = np.radians(latitude), np.radians(longitude)
+    lat2, lon2 = np.radians(latitudes), np.radians(longitudes)
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def first_per_group(groups, *keys):
+    """
+    Index of the row with the smallest keys (most significant first) in each
+    group, and which groups have rows at all.
+    """
+    order = np.lexsort(tuple(reversed(keys)) + (groups,))
+    present, first = np.unique(groups[order], return_index=True)
+    return present, order[first]
+
+
 @router.get("/route_optimize", status_code=status.HTTP_200_OK)
+@transactions.retry_on_conflict
 def optimize_shopping_route(
     user_id: int,
     food_id: int,
-    budget: int = Query(0, ge=0, description="Budget in cents, must be greater than or equal to 0")):
+    budget: int = Query(0, ge=0, description="Budget in cents, must be greater than or equal to 0"),
+    open_now: bool = Query(False, description="Only consider stores that are open right now"),
+    open_at: Optional[datetime] = Query(None, description="Only consider stores open at this time, overrides open_now")):
     """
     Finds nearby stores with a given food_id.
     If a budget is specified (greater than 0), only stores offering the food item within the budget are considered.
     Otherwise, the closest store to the user with the valid food item is selected.
+    Stores closed at the requested time are skipped when open_now or open_at is given.
     """
+    when = store_hours.requested_time(open_now, open_at)
     
-    get_user_info_query = sqlalchemy.text("""
-        SELECT longitude, latitude
-        FROM users
-        WHERE user_id = :user_id
-    """)
-
     find_matching_store_ids_query = sqlalchemy.text(f"""
         SELECT longitude, latitude,
             store.name as store_name, store.store_id as store_id,
@@ -46,6 +85,7 @@ def optimize_shopping_route(
         JOIN food_item ON food_item.food_id = catalog_item.food_id
         WHERE food_item.food_id = :food_id
         {"AND catalog_item.price <= :budget" if budget > 0 else ""}
+        {"AND store.store_id = ANY(:open_store_ids)" if when is not None else ""}
     """)
 
     food_data = {"food_id": food_id, "budget": budget} if budget > 0 else {"food_id": food_id}
@@ -76,20 +116,31 @@ def optimize_shopping_route(
                     detail="No stores carrying this item.")
             
             try:
-                user_info = conn.execute(get_user_info_query, {"user_id": user_id}).one()
+                nearby = nearby_stores.get(conn, user_id)
             except NoResultFound as e:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail=f"User does not exist, {e}")
 
+            if when is not None:
+                food_data["open_store_ids"] = list(store_hours.open_store_ids(conn, when))
+
             result = conn.execute(find_matching_store_ids_query, food_data)
 
+    # Nearby stores come from the distance cache, far away ones are computed
+    # on the same sphere so both rank together
+    def distance(row):
+        cached = nearby.distance_to(row.store_id)
+        if cached is not None:
+            return cached
+        return float(haversine_km(nearby.latitude, nearby.longitude, row.latitude, row.longitude))
+
     valid_stores = [
         {
             "name": row.store_name,
             "store_id": row.store_id,
             "price": row.price,
-            "distance": geodesic((user_info.latitude, user_info.longitude), (row.latitude, row.longitude)).km
+            "distance": distance(row)
         }
         for row in result
     ]
@@ -123,13 +174,111 @@ def optimize_shopping_route(
     }
 
 
+class RouteItem(BaseModel):
+    food_id: int
+    budget: int = Field(0, ge=0)  # cents, 0 for no limit
+
+class RouteRequest(BaseModel):
+    user_id: int
+    items: list[RouteItem] = Field(..., min_items=1, max_items=MAX_ROUTE_ITEMS)
+    open_now: bool = False
+    open_at: Optional[datetime] = None  # overrides open_now
+
+
+@router.post("/route_optimize", status_code=status.HTTP_200_OK)
+@transactions.retry_on_conflict
+def optimize_shopping_routes(request: RouteRequest):
+    """
+    Batch version of GET /route_optimize: the closest and best value store for
+    every requested food_id, each with its own optional budget. All items are
+    looked up in one catalog query and all distances computed in one pass.
+    Items that cannot be found get an error instead of failing the request.
+    """
+    when = store_hours.requested_time(request.open_now, request.open_at)
+
+    find_offers = sqlalchemy.text(f"""
+        SELECT item.position, food_item.food_id IS NOT NULL AS food_exists,
+            store.store_id, store.name AS store_name, store.latitude, store.longitude,
+            catalog_item.price
+        FROM unnest(CAST(:food_ids AS int[]), CAST(:budgets AS int[]))
+            WITH ORDINALITY AS item(food_id, budget, position)
+        LEFT JOIN food_item ON food_item.food_id = item.food_id
+        LEFT JOIN (catalog_item
+                   JOIN catalog ON catalog.catalog_id = catalog_item.catalog_id
+                   JOIN store ON store.store_id = catalog.store_id)
+            ON catalog_item.food_id = item.food_id
+            AND (item.budget = 0 OR catalog_item.price <= item.budget)
+            {"AND store.store_id = ANY(:open_store_ids)" if when is not None else ""}
+    """)
+    params = {"food_ids": [item.food_id for item in request.items],
+              "budgets": [item.budget for item in request.items]}
+
+    with db.engine.connect().execution_options(isolation_level="REPEATABLE READ") as conn:
+        with conn.begin():
+            try:
+                nearby = nearby_stores.get(conn, request.user_id)
+            except NoResultFound:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                    detail="User does not exist.")
+
+            if when is not None:
+                params["open_store_ids"] = list(store_hours.open_store_ids(conn, when))
+
+            rows = conn.execute(find_offers, params).all()
+
+    missing_food = {row.position - 1 for row in rows if not row.food_exists}
+    offers = [row for row in rows if row.store_id is not None]
+
+    closest, best_value = {}, {}
+    if offers:
+        groups = np.array([row.position - 1 for row in offers])
+        prices = np.array([row.price for row in offers])
+        distances = haversine_km(nearby.latitude, nearby.longitude,
+                                 np.array([row.latitude for row in offers], dtype=float),
+                                 np.array([row.longitude for row in offers], dtype=float))
+        for found, keys in ((closest, (distances,)), (best_value, (prices, distances))):
+            present, rows_at = first_per_group(groups, *keys)
+            found.update(zip(present.tolist(), rows_at.tolist()))
+
+    def describe(row_index):
+        row = offers[row_index]
+        return {
+            "Name": row.store_name,
+            "Store ID": row.store_id,
+            "Distance Away": f"{distances[row_index]:.2f} km",
+            "Price of Item": f"${row.price/100:,.2f}"
+        }
+
+    results = []
+    for position, item in enumerate(request.items):
+        if position in missing_food:
+            results.append({"food_id": item.food_id, "error": "Food does not exist."})
+        elif position not in closest:
+            results.append({"food_id": item.food_id,
+                            "error": "No stores found within constraints. Try upping your budget."})
+        else:
+            results.append({
+                "food_id": item.food_id,
+                "Closest Store": describe(closest[position]),
+                "Best Value Store": describe(best_value[position])
+            })
+
+    return results
+
+
 @router.get("/{user_id}/fulfill_list/{list_id}", status_code=status.HTTP_200_OK)
+@transactions.retry_on_conflict
 def fulfill_list(user_id: int, list_id: int,
                  budget: int = Query(MAXINT, 
                     description="Most willing you're to spend on an item in cents", gt=0),
                  max_dist: int = Query(10, description="Range in km", gt=0),
                  order_by: int = Query(1, 
-                    description="Order by option: 1=price,distance; 2=price; 3=distance")):
+                    description="Order by option: 1=price,distance; 2=price; 3=distance"),
+                 open_now: bool = Query(False, description="Only consider stores that are open right now"),
+                 open_at: Optional[datetime] = Query(None, 
+                    description="Only consider stores open at this time, overrides open_now"),
+                 max_staleness: Optional[int] = Query(None, ge=0,
+                    description="Accept prices up to this many seconds old for a faster answer")):
     """
     Generate a list of the closest_stores to fufil a list
     currently there is a user input max price per budget
@@ -150,76 +299,100 @@ def fulfill_list(user_id: int, list_id: int,
         )
     
     find_items = sqlalchemy.text(f"""
-        WITH they_got_it AS (
+        WITH nearby AS (
+            SELECT *
+            FROM unnest(CAST(:store_ids AS int[]), CAST(:distances AS float8[]))
+                AS nearby(store_id, distance)
+        ),
+        they_got_it AS (
             SELECT 
                 food_item.name AS item,
                 store.name AS store_name, 
                 store.store_id AS store_id,
                 catalog_item.price AS price,
-                ROUND((earth_distance(
-                    ll_to_earth(store.latitude, store.longitude), 
-                    ll_to_earth((SELECT latitude FROM users WHERE users.user_id = :user_id), 
-                                (SELECT longitude FROM users WHERE users.user_id = :user_id))
-                ) / 1000)::NUMERIC, 1)::FLOAT AS distance
-            FROM store
+                ROUND(nearby.distance::NUMERIC, 1)::FLOAT AS distance
+            FROM nearby
+            JOIN store ON store.store_id = nearby.store_id
             JOIN catalog ON catalog.store_id = store.store_id
             JOIN catalog_item ON catalog.catalog_id = catalog_item.catalog_id
             JOIN food_item ON food_item.food_id = catalog_item.food_id
             WHERE food_item.food_id IN (
                 SELECT food_id
                 FROM shopping_list_item
-                WHERE list_id = :list_id
+                WHERE list_id = :list_id AND user_id = :user_id
                 )
                 AND price < :budget
-            ORDER BY item, {option}
+                AND (CAST(:food_ids AS int[]) IS NULL OR food_item.food_id = ANY(:food_ids))
         ),
         ranked_stores AS (
             SELECT  item, store_name, store_id, price, distance, 
                     RANK() OVER (PARTITION BY item ORDER BY {option}) AS ranks
             FROM they_got_it
-            WHERE distance < :range
         )
         SELECT item, store_name, store_id, price, distance, ranks
         FROM ranked_stores
         WHERE ranks = 1
     """)
+
+    # Cheapest nearby offers from best_price, plus a row without a store for
+    # every listed food none of whose cheapest offers is nearby
+    find_cached_items = sqlalchemy.text(f"""
+        WITH nearby AS (
+            SELECT *
+            FROM unnest(CAST(:store_ids AS int[]), CAST(:distances AS float8[]))
+                AS nearby(store_id, distance)
+        ),
+        wanted AS (
+            SELECT food_id
+            FROM shopping_list_item
+            WHERE list_id = :list_id AND user_id = :user_id
+        ),
+        ranked_stores AS (
+            SELECT best_price.food_id, best_price.store_id, best_price.price, nearby.distance,
+                RANK() OVER (PARTITION BY best_price.food_id ORDER BY {option}) AS ranks
+            FROM best_price
+            JOIN wanted ON wanted.food_id = best_price.food_id
+            JOIN nearby ON nearby.store_id = best_price.store_id
+            WHERE best_price.price < :budget
+        )
+        SELECT wanted.food_id, food_item.name AS item, store.name AS store_name, store.store_id,
+            ranked_stores.price, ROUND(ranked_stores.distance::NUMERIC, 1)::FLOAT AS distance
+        FROM wanted
+        LEFT JOIN ranked_stores ON ranked_stores.food_id = wanted.food_id AND ranked_stores.ranks = 1
+        LEFT JOIN store ON store.store_id = ranked_stores.store_id
+        LEFT JOIN food_item ON food_item.food_id = ranked_stores.food_id
+    """)
     
-    with db.engine.connect().execution_options(isolation_level="REPEATABLE READ") as conn:
+    with db.read_only(user_id).connect() as conn:
         with conn.begin():
             # block of checks before executing the big sql statement to catch errors
             try:
-                conn.execute(sqlalchemy.text("""
-                    SELECT 1 FROM users 
-                    WHERE user_id = :user_id
-                    """), {"user_id": user_id}).one()
+                nearby = nearby_stores.get(conn, user_id, max_dist)
             except NoResultFound:
                 raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                     detail="User does not exist.")
 
-            try:
-                conn.execute(sqlalchemy.text("""
-                    SELECT 1 FROM shopping_list 
-                    WHERE list_id = :list_id
-                    """), {"list_id": list_id}).one()
-            except NoResultFound:
-                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                    detail="List does not exist.")
-
-            try:
-                conn.execute(
-                    sqlalchemy.text("""
-                    SELECT 1 FROM shopping_list 
-                    WHERE list_id = :list_id AND user_id = :user_id
-                    """),{"user_id": user_id, "list_id": list_id}).one()
-            except NoResultFound:
-                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                    detail="User is not associated with this list.")
+            users.check_list_access(conn, user_id, list_id)
             
-            shopping_list = conn.execute(find_items, 
-                                        {"user_id": user_id,
-                                        "list_id": list_id,
-                                        "budget": budget,
-                                        "range": max_dist})
+            store_ids, distances = nearby.within(max_dist)
+            store_ids, distances = open_stores_only(conn, store_ids, distances,
+                                                    store_hours.requested_time(open_now, open_at))
+            params = {"store_ids": store_ids,
+                      "distances": distances,
+                      "list_id": list_id,
+                      "user_id": user_id,
+                      "budget": budget,
+                      "food_ids": None}
+            shopping_list = []
+            if store_ids and order_by != 3 and best_prices.fresh_enough(conn, max_staleness):
+                cached = conn.execute(find_cached_items, params).all()
+                shopping_list = [item for item in cached if item.store_id is not None]
+                # Foods whose cheapest offers are all out of range still need the full search
+                params["food_ids"] = [item.food_id for item in cached if item.store_id is None]
+                if params["food_ids"]:
+                    shopping_list += conn.execute(find_items, params).all()
+            elif store_ids:
+                shopping_list = conn.execute(find_items, params).all()
 
     
     return_list = []
@@ -239,9 +412,16 @@ def fulfill_list(user_id: int, list_id: int,
 
 
 @router.get("/{user_id}/find_snack/{food_id}", status_code=status.HTTP_200_OK)
+@singleflight.coalesce("find_snack")
+@transactions.retry_on_conflict
 def find_snack(user_id: int, food_id: int,
                 max_dist: int = Query(10, description="Range in km", gt=0),
-                order_by: int = Query(3, description="Order by option: 1=price,distance; 2=price; 3=distance")):
+                order_by: int = Query(3, description="Order by option: 1=price,distance; 2=price; 3=distance"),
+                open_now: bool = Query(False, description="Only consider stores that are open right now"),
+                open_at: Optional[datetime] = Query(None, 
+                    description="Only consider stores open at this time, overrides open_now"),
+                max_staleness: Optional[int] = Query(None, ge=0,
+                    description="Accept prices up to this many seconds old for a faster answer")):
     """
     Lookin for a quick snack, just put in your food_id.
     We'll find you the closet place thats got what you want.
@@ -262,50 +442,74 @@ def find_snack(user_id: int, food_id: int,
         )
     
     find_item = sqlalchemy.text(f"""
-        WITH they_got_it AS (
+        WITH nearby AS (
+            SELECT *
+            FROM unnest(CAST(:store_ids AS int[]), CAST(:distances AS float8[]))
+                AS nearby(store_id, distance)
+        ),
+        they_got_it AS (
             SELECT 
                 food_item.name AS item,
                 store.name AS store_name, 
                 store.store_id AS store_id,
                 catalog_item.price AS price,
-                ROUND((earth_distance(
-                    ll_to_earth(store.latitude, store.longitude), 
-                    ll_to_earth((SELECT latitude FROM users WHERE users.user_id = :user_id), 
-                                (SELECT longitude FROM users WHERE users.user_id = :user_id))
-                ) / 1000)::NUMERIC, 1)::FLOAT AS distance
-            FROM store
+                ROUND(nearby.distance::NUMERIC, 1)::FLOAT AS distance
+            FROM nearby
+            JOIN store ON store.store_id = nearby.store_id
             JOIN catalog ON catalog.store_id = store.store_id
             JOIN catalog_item ON catalog.catalog_id = catalog_item.catalog_id
             JOIN food_item ON food_item.food_id = catalog_item.food_id
             WHERE food_item.food_id = :food_id
-            ORDER BY item, {option}
         ),
         ranked_stores AS (
             SELECT  item, store_name, store_id, price, distance, 
                     RANK() OVER (PARTITION BY item ORDER BY {option}) AS ranks
             FROM they_got_it
-            WHERE distance < :range
         )
         SELECT item, store_name, store_id, price, distance, ranks
         FROM ranked_stores
         WHERE ranks = 1
         LIMIT 1
     """)
+
+    # The cheapest nearby offer is the cheapest nearby one among the cheapest
+    # offers overall, when any of those is nearby
+    find_cached_item = sqlalchemy.text(f"""
+        WITH nearby AS (
+            SELECT *
+            FROM unnest(CAST(:store_ids AS int[]), CAST(:distances AS float8[]))
+                AS nearby(store_id, distance)
+        )
+        SELECT food_item.name AS item, store.name AS store_name, store.store_id,
+            best_price.price, ROUND(nearby.distance::NUMERIC, 1)::FLOAT AS distance
+        FROM best_price
+        JOIN nearby ON nearby.store_id = best_price.store_id
+        JOIN store ON store.store_id = best_price.store_id
+        JOIN food_item ON food_item.food_id = best_price.food_id
+        WHERE best_price.food_id = :food_id
+        ORDER BY {option}
+        LIMIT 1
+    """)
     
-    with db.engine.connect().execution_options(isolation_level="REPEATABLE READ") as conn:
+    with db.read_only(user_id).connect() as conn:
         with conn.begin():
             try:
-                store = conn.execute(find_item, 
-                                             {"user_id": user_id,
-                                              "food_id": food_id,
-                                              "range": max_dist}).one()
+                nearby = nearby_stores.get(conn, user_id, max_dist)
+            except NoResultFound:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                    detail="User does not exist.")
+
+            store_ids, distances = nearby.within(max_dist)
+            store_ids, distances = open_stores_only(conn, store_ids, distances,
+                                                    store_hours.requested_time(open_now, open_at))
+            params = {"store_ids": store_ids, "distances": distances, "food_id": food_id}
+            store = None
+            if order_by != 3 and best_prices.fresh_enough(conn, max_staleness):
+                store = conn.execute(find_cached_item, params).first()
+            try:
+                if store is None:
+                    store = conn.execute(find_item, params).one()
             except NoResultFound:
-                try:
-                    conn.execute(sqlalchemy.text("SELECT 1 FROM users WHERE user_id = :user_id"),
-                                 {"user_id": user_id}).one()
-                except NoResultFound:
-                    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                                        detail="User does not exist.")
                 try:
                     conn.execute(sqlalchemy.text("SELECT 1 FROM food_item WHERE food_id = :food_id"),
                                  {"food_id": food_id}).one()
@@ -325,3 +529,88 @@ def find_snack(user_id: int, food_id: int,
     }
     
     return return_item
+
+
+@router.post("/{user_id}/checkout/{list_id}", status_code=status.HTTP_200_OK)
+@db.writes_user_data
+@transactions.retry_on_conflict
+def checkout_list(user_id: int, list_id: int,
+                  store_id: int = Query(..., description="Store to buy the whole list from")):
+    """
+    Reserves every item on a shopping list at one store, all or nothing.
+    Stock is decremented with a single conditional UPDATE, whose row locks
+    are held until the checkout commits, so buyers of the same popular item
+    queue on it for the length of a checkout. The items are locked in
+    catalog_item_id order, so checkouts sharing items cannot deadlock.
+    """
+    reserve_items = sqlalchemy.text("""
+        WITH wanted AS (
+            SELECT food_id, quantity
+            FROM shopping_list_item
+            WHERE list_id = :list_id AND user_id = :user_id
+        ),
+        stocked AS (
+            SELECT DISTINCT ON (catalog_item.food_id)
+                catalog_item.catalog_item_id, catalog_item.food_id
+            FROM catalog_item
+            JOIN catalog ON catalog.catalog_id = catalog_item.catalog_id
+            WHERE catalog.store_id = :store_id
+                AND catalog_item.food_id IN (SELECT food_id FROM wanted)
+            ORDER BY catalog_item.food_id, catalog_item.catalog_item_id
+        ),
+        locked AS (
+            SELECT catalog_item_id
+            FROM catalog_item
+            WHERE catalog_item_id IN (SELECT catalog_item_id FROM stocked)
+            ORDER BY catalog_item_id
+            FOR UPDATE
+        ),
+        reserved AS (
+            UPDATE catalog_item
+            SET quantity = catalog_item.quantity - wanted.quantity
+            FROM locked
+            JOIN stocked ON stocked.catalog_item_id = locked.catalog_item_id
+            JOIN wanted ON wanted.food_id = stocked.food_id
+            WHERE catalog_item.catalog_item_id = stocked.catalog_item_id
+                AND catalog_item.quantity >= wanted.quantity
+            RETURNING catalog_item.food_id, catalog_item.price, catalog_item.quantity AS remaining
+        )
+        SELECT wanted.food_id, wanted.quantity, reserved.price, reserved.remaining,
+               reserved.food_id IS NOT NULL AS is_reserved
+        FROM wanted
+        LEFT JOIN reserved ON reserved.food_id = wanted.food_id
+        ORDER BY wanted.food_id
+    """)
+
+    # READ COMMITTED on purpose: a concurrent buyer's decrement makes the
+    # UPDATE recheck quantity against the newest row instead of failing
+    # the whole checkout like REPEATABLE READ would
+    with db.engine.connect().execution_options(isolation_level="READ COMMITTED") as conn:
+        with conn.begin():
+            users.check_list_access(conn, user_id, list_id)
+
+            items = conn.execute(reserve_items, {"list_id": list_id, "user_id": user_id,
+                                                 "store_id": store_id}).all()
+            if not items:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="List is empty, add something to it!")
+
+            # Raising inside the transaction rolls back every decrement
+            missing = [item.food_id for item in items if not item.is_reserved]
+            if missing:
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                    detail=f"Food ID(s) {missing} not in stock at this store.")
+
+    return {
+        "store_id": store_id,
+        "items": [
+            {
+                "food_id": item.food_id,
+                "quantity": item.quantity,
+                "price": f"${item.price / 100:.2f}",
+                "remaining_stock": item.remaining
+            }
+            for item in items
+        ],
+        "total": f"${sum(item.price * item.quantity for item in items) / 100:.2f}"
+    }
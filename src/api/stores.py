@@ -1,13 +1,16 @@
 from typing import Optional
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, status, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel, Field
 import sqlalchemy
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
 import logging
 from src import database as db
+from src import best_prices, catalog_upload, etags, nearby_stores, singleflight, store_hours, transactions, value_index
 from src.api import auth
-from datetime import datetime
+from datetime import datetime, time
 
 logger = logging.getLogger(__name__)
 
@@ -22,8 +25,12 @@ class StoreLocation(BaseModel):
     latitude: float = Field(le=90, ge=-90)
 
 class Hours(BaseModel):
-    open_time: int
-    close_time: int
+    open_time: time
+    close_time: time  # earlier than open_time for stores open past midnight
+
+class PriceChange(BaseModel):
+    food_id: int
+    price: int = Field(gt=0)  # cents
 
 class Store(BaseModel):
     store_id: int
@@ -31,13 +38,11 @@ class Store(BaseModel):
     hours: Hours  # (open_time, close_time)
     location: StoreLocation
 
-@router.get("/")
-def get_stores():
-    """
-    Retrieves all stores with their locations and hours.
-    """
-    with db.engine.begin() as conn:
-        
+@singleflight.coalesce("get_stores")
+@transactions.retry_on_conflict
+def fetch_stores():
+    with db.read_only().begin() as conn:
+        etag = etags.stores_tag(conn)
         try:
             result = conn.execute(sqlalchemy.text(
                 """
@@ -67,14 +72,149 @@ def get_stores():
         }
         for row in result
     ]
-    return stores
+    return etag, stores
+
+
+@transactions.retry_on_conflict
+def stores_etag():
+    with db.read_only().begin() as conn:
+        return etags.stores_tag(conn)
+
+
+@router.get("/", responses={304: {"description": "Not modified since the ETag in If-None-Match"}})
+def get_stores(if_none_match: Optional[str] = Header(None)):
+    """
+    Retrieves all stores with their locations and hours.
+    """
+    if if_none_match:
+        etag = stores_etag()
+        if etags.matches(if_none_match, etag):
+            return etags.not_modified(etag, "get_stores")
+
+    etag, stores = fetch_stores()
+    return JSONResponse(stores, headers=etags.headers(etag))
             
 
-@router.get("/{store_id}/catalog")
-def get_catalog(store_id: int):
+@router.put("/{store_id}/location", status_code=status.HTTP_204_NO_CONTENT)
+def update_store_location(store_id: int, new_location: StoreLocation):
     """
-    Retrieves the list of items that the store has in its catalog, including item_sku, name, price, and quantity.
+    Moves a store, every user's nearby stores are recomputed on their next request.
     """
+    with db.engine.begin() as conn:
+        updated = conn.execute(sqlalchemy.text("""
+            UPDATE store
+            SET longitude = :long, latitude = :lat
+            WHERE store_id = :store_id
+            RETURNING store_id
+            """), {"store_id": store_id, "long": new_location.longitude,
+                   "lat": new_location.latitude}).scalar()
+    if updated is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+            detail="Store does not found :(")
+
+    nearby_stores.invalidate_stores()
+
+
+@router.put("/{store_id}/hours", status_code=status.HTTP_204_NO_CONTENT)
+def update_store_hours(store_id: int, hours: Hours):
+    """
+    Changes a store's daily opening hours.
+    """
+    with db.engine.begin() as conn:
+        updated = conn.execute(sqlalchemy.text("""
+            UPDATE store
+            SET open_time = CURRENT_DATE + CAST(:open_time AS time),
+                close_time = CURRENT_DATE + CAST(:close_time AS time)
+            WHERE store_id = :store_id
+            RETURNING store_id
+            """), {"store_id": store_id, "open_time": hours.open_time,
+                   "close_time": hours.close_time}).scalar()
+    if updated is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+            detail="Store does not found :(")
+
+    store_hours.invalidate()
+
+
+@router.put("/{store_id}/prices", status_code=status.HTTP_204_NO_CONTENT)
+@transactions.retry_on_conflict
+def update_prices(store_id: int, changes: list[PriceChange]):
+    """
+    Re-prices items in a store's catalog.
+    """
+    with db.engine.begin() as conn:
+        updated = conn.execute(sqlalchemy.text("""
+            UPDATE catalog_item
+            SET price = new.price
+            FROM catalog, unnest(CAST(:food_ids AS int[]), CAST(:prices AS int[])) AS new(food_id, price)
+            WHERE catalog.store_id = :store_id
+              AND catalog_item.catalog_id = catalog.catalog_id
+              AND catalog_item.food_id = new.food_id
+            RETURNING catalog_item.catalog_item_id, catalog_item.price
+            """), {"store_id": store_id,
+                   "food_ids": [change.food_id for change in changes],
+                   "prices": [change.price for change in changes]}).all()
+    if not updated:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+            detail="None of those foods are in this store's catalog")
+
+    value_index.update_prices(updated)
+
+
+@transactions.retry_on_conflict
+def apply_catalog_upload(store_id, spooled, columns):
+    with db.engine.begin() as conn:
+        catalog_id = conn.execute(sqlalchemy.text("""
+            SELECT catalog_id FROM catalog WHERE store_id = :store_id ORDER BY catalog_id LIMIT 1
+            """), {"store_id": store_id}).scalar()
+        if catalog_id is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                detail="Store does not have a catalog")
+        try:
+            result = catalog_upload.merge(conn, catalog_id, store_id, spooled, columns)
+        except catalog_upload.UploadError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    value_index.update_prices(zip(result.updated_ids, result.updated_prices))
+    if result.inserted:
+        value_index.invalidate()
+    return result
+
+
+@router.post("/{store_id}/catalog/upload", openapi_extra={"requestBody": {"required": True, "content": {
+    "text/csv": {"schema": {"type": "string"}},
+    "application/x-ndjson": {"schema": {"type": "string"}}}}})
+async def upload_catalog(store_id: int, request: Request):
+    """
+    Applies a CSV (with a header) or NDJSON feed of food_id, price and
+    quantity to a store's catalog. Listed foods are updated, others added.
+    """
+    media = catalog_upload.media_type(request.headers.get("content-type"))
+    if media is None:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Send text/csv or application/x-ndjson")
+    try:
+        spooled, columns = await catalog_upload.spool(request.stream(), media)
+    except catalog_upload.UploadTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except catalog_upload.UploadError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    with spooled:
+        result = await run_in_threadpool(apply_catalog_upload, store_id, spooled, columns)
+
+    return {
+        "inserted": result.inserted,
+        "updated": result.updated,
+        "rejected": result.rejected,
+        "superseded": result.superseded,
+        "errors": result.errors
+    }
+
+
+@singleflight.coalesce("get_catalog")
+@transactions.retry_on_conflict
+def fetch_catalog(store_id):
     fetch_catalog = sqlalchemy.text("""
         SELECT food_item.food_id, name, quantity, price
         FROM catalog_item
@@ -83,17 +223,13 @@ def get_catalog(store_id: int):
         WHERE catalog.store_id = :store_id
     """)
 
-    with db.engine.begin() as conn:
+    with db.read_only().begin() as conn:
         
-        try:
-            conn.execute(sqlalchemy.text("""
-                SELECT 1 FROM store 
-                WHERE store_id = :store_id
-                """), {"store_id": store_id}).one()
-        except NoResultFound:
+        etag = etags.catalog_tag(conn, store_id)
+        if etag is None:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                 detail="Store does not found :(")
-        
+
         catalog = conn.execute(fetch_catalog, {"store_id": store_id})
 
     return_list = [
@@ -107,12 +243,37 @@ def get_catalog(store_id: int):
         
     ]
     
-    return return_list
+    return etag, return_list
+
+
+@transactions.retry_on_conflict
+def catalog_etag(store_id):
+    with db.read_only().begin() as conn:
+        return etags.catalog_tag(conn, store_id)
+
+
+@router.get("/{store_id}/catalog", responses={304: {"description": "Not modified since the ETag in If-None-Match"}})
+def get_catalog(store_id: int, if_none_match: Optional[str] = Header(None)):
+    """
+    Retrieves the list of items that the store has in its catalog, including item_sku, name, price, and quantity.
+    Send the ETag of a previous response in If-None-Match to get a 304 while the catalog is unchanged.
+    """
+    if if_none_match:
+        etag = catalog_etag(store_id)
+        if etags.matches(if_none_match, etag):
+            return etags.not_modified(etag, "get_catalog")
+
+    etag, catalog = fetch_catalog(store_id)
+    return JSONResponse(catalog, headers=etags.headers(etag))
 
 
 @router.post("/compare-prices")
+@singleflight.coalesce("compare_prices")
+@transactions.retry_on_conflict
 def compare_prices(food_id: int, 
-            max_stores: int = Query(3, description="How many stores would you like to see", gt=0)
+            max_stores: int = Query(3, description="How many stores would you like to see", gt=0),
+            max_staleness: Optional[int] = Query(None, ge=0,
+                description="Accept prices up to this many seconds old for a faster answer")
                    ):
     """
     Find the stores with the best prices
@@ -128,6 +289,17 @@ def compare_prices(food_id: int,
         ORDER BY price ASC
         LIMIT :max_stores
     """)
+
+    find_cached_stores = sqlalchemy.text("""
+        SELECT store.store_id AS id, store.name AS store, food_item.name,
+                best_price.price, best_price.price_rank AS rank
+        FROM best_price
+        JOIN store ON store.store_id = best_price.store_id
+        JOIN food_item ON food_item.food_id = best_price.food_id
+        WHERE best_price.food_id = :food_id
+        ORDER BY best_price.offer_rank
+        LIMIT :max_stores
+    """)
     
     
     print(type(food_id), type(max_stores))
@@ -136,7 +308,7 @@ def compare_prices(food_id: int,
         "max_stores": max_stores
     }]
 
-    with db.engine.connect().execution_options(isolation_level="REPEATABLE READ") as conn:
+    with db.read_only().connect() as conn:
         with conn.begin():
             try:
                 conn.execute(sqlalchemy.text("""
@@ -146,7 +318,9 @@ def compare_prices(food_id: int,
             except NoResultFound:
                 raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                                     detail="Food_id does not exist.")
-                                    
+
+            if max_stores <= best_prices.TOP_N and best_prices.fresh_enough(conn, max_staleness):
+                find_stores = find_cached_stores
             stores = conn.execute(find_stores, query_params)
 
 
@@ -6,6 +6,7 @@ import sqlalchemy
 from sqlalchemy.exc import IntegrityError, NoResultFound
 import logging
 from src import database as db
+from src import nearby_stores, optimizer, transactions, user_locations
 from src.api import auth
 
 logger = logging.getLogger(__name__)
@@ -22,6 +23,32 @@ class User(BaseModel):
     longitude: Optional[float] = Field(default=-120.6625, le=180, ge=-180)
     latitude: Optional[float] = Field(default=35.3050, le=90, ge=-90)
 
+
+check_list_access_query = sqlalchemy.text("""
+    SELECT
+        EXISTS (SELECT 1 FROM users WHERE user_id = :user_id) AS user_exists,
+        EXISTS (SELECT 1 FROM shopping_list WHERE list_id = :list_id) AS list_exists,
+        EXISTS (SELECT 1 FROM shopping_list WHERE list_id = :list_id AND user_id = :user_id) AS owns_list
+""")
+
+
+def check_list_access(conn, user_id, list_id):
+    """
+    The user, list and ownership checks of the list endpoints in one round
+    trip, raising the first 404 that applies.
+    """
+    access = conn.execute(check_list_access_query, {"user_id": user_id, "list_id": list_id}).one()
+    if not access.user_exists:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+            detail="User does not exist.")
+    if not access.list_exists:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+            detail="List does not exist.")
+    if not access.owns_list:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+            detail="User is not associated with this list.")
+
+
 @router.post("/", status_code=status.HTTP_201_CREATED)
 def create_user(new_user: User):
     """
@@ -38,6 +65,8 @@ def create_user(new_user: User):
                     RETURNING user_id
                     """
                 ), user_info).scalar_one()
+            db.mark_write(user_id)
+            user_locations.invalidate(user_id)
             
             return {"user_id": user_id}
     except Exception as e:
@@ -46,7 +75,36 @@ def create_user(new_user: User):
                             detail="Failed to create user.")
             
     
+class UserLocation(BaseModel):
+    location: Optional[str] = None
+    longitude: float = Field(le=180, ge=-180)
+    latitude: float = Field(le=90, ge=-90)
+
+@router.put("/{user_id}/location", status_code=status.HTTP_204_NO_CONTENT)
+@db.writes_user_data
+def update_user_location(user_id: int, new_location: UserLocation):
+    """
+    Moves a user, their nearby stores are recomputed on the next shopping request.
+    """
+    with db.engine.begin() as conn:
+        updated = conn.execute(sqlalchemy.text("""
+            UPDATE users
+            SET longitude = :long, latitude = :lat,
+                location = COALESCE(:location, location)
+            WHERE user_id = :user_id
+            RETURNING user_id
+            """), {"user_id": user_id, "long": new_location.longitude,
+                   "lat": new_location.latitude, "location": new_location.location}).scalar()
+    if updated is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+            detail="User does not exist.")
+
+    user_locations.invalidate(user_id)
+    nearby_stores.invalidate_user(user_id)
+
+    
 @router.get("/{user_id}/lists/{list_id}/facts", status_code=status.HTTP_200_OK)
+@transactions.retry_on_conflict
 def list_facts(user_id: int, list_id: int):
     """
     Provides a breakdown of nutritional information for each item in a shopping list,
@@ -64,63 +122,31 @@ def list_facts(user_id: int, list_id: int):
         SUM((shopping_list_item.quantity) * (total_carbohydrate)) AS total_carbohydrates,
         SUM((shopping_list_item.quantity) * (total_sugars)) AS total_sugars,
         SUM((shopping_list_item.quantity) * (protein)) AS total_protein,
-        SUM((shopping_list_item.quantity) * (calories)) AS total_calories
+        SUM((shopping_list_item.quantity) * (calories)) AS total_calories,
+        COUNT(*) AS items
     FROM shopping_list
     JOIN shopping_list_item on shopping_list.list_id = shopping_list_item.list_id
     JOIN food_item on shopping_list_item.food_id = food_item.food_id
     WHERE
-    shopping_list.list_id = :list_id
+    shopping_list.list_id = :list_id AND shopping_list_item.user_id = :user_id
     GROUP BY ROLLUP (food_item.name)
     """)
     
-    with db.engine.connect().execution_options(isolation_level="REPEATABLE READ") as conn:
+    with db.read_only(user_id).connect() as conn:
         with conn.begin():
             # block of checks before executing the big sql statement to catch errors
-            try:
-                conn.execute(sqlalchemy.text("""
-                    SELECT 1 FROM users 
-                    WHERE user_id = :user_id
-                    """), {"user_id": user_id}).one()
-            except NoResultFound:
-                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                    detail="User does not exist.")
-
-            try:
-                conn.execute(sqlalchemy.text("""
-                    SELECT 1 FROM shopping_list 
-                    WHERE list_id = :list_id
-                    """), {"list_id": list_id}).one()
-            except NoResultFound:
-                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                    detail="List does not exist.")
-
-            try:
-                conn.execute(
-                    sqlalchemy.text("""
-                    SELECT 1 FROM shopping_list 
-                    WHERE list_id = :list_id AND user_id = :user_id
-                    """),{"user_id": user_id, "list_id": list_id}).one()
-            except NoResultFound:
-                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                    detail="User is not associated with this list.")
-            
-            
-            isEmpty = conn.execute(
-                sqlalchemy.text("""
-                SELECT 1
-                FROM shopping_list
-                JOIN shopping_list_item on shopping_list.list_id = shopping_list_item.list_id
-                WHERE shopping_list.list_id = :list_id
-                """),{"list_id": list_id}).scalar()
-            if isEmpty == None:
-                raise HTTPException(status_code=status.HTTP_204_NO_CONTENT,
-                    detail="List is empty, add something to it!")
+            check_list_access(conn, user_id, list_id)
             
             try:
-                nutrition_info = conn.execute(grab_facts, {"list_id": list_id})
+                nutrition_info = conn.execute(grab_facts, {"list_id": list_id, "user_id": user_id}).all()
             except Exception as e:
                 raise HTTPException(status_code=500, 
                     detail=f"Something went wrong {e}")
+
+    # An empty list still gets the ROLLUP's total row, counting 0 items
+    if not any(item.items for item in nutrition_info):
+        raise HTTPException(status_code=status.HTTP_204_NO_CONTENT,
+            detail="List is empty, add something to it!")
     
     nutrition_dict = {}
     for item in nutrition_info:
@@ -138,6 +164,7 @@ def list_facts(user_id: int, list_id: int):
 
 
 @router.post("/{user_id}/lists", status_code=status.HTTP_201_CREATED)
+@db.writes_user_data
 def create_list(user_id: int, name: str):
     """
     Make a new shopping list for customer
@@ -170,11 +197,121 @@ def create_list(user_id: int, name: str):
                 detail="Failed create shopping list"
             )
 
+# Nutrient columns the optimizer can maximise or set minimums for
+BASKET_NUTRIENTS = ["calories", "protein", "total_carbohydrate", "dietary_fiber"]
+
+class BasketRequest(BaseModel):
+    name: str
+    budget: int = Field(gt=0, le=100000)  # cents
+    maximize: str = Field(default="protein", description="protein or calories")
+    min_calories: Optional[int] = Field(default=None, ge=0)
+    min_protein: Optional[int] = Field(default=None, ge=0)
+    min_carbohydrate: Optional[int] = Field(default=None, ge=0)
+    min_fiber: Optional[int] = Field(default=None, ge=0)
+    max_quantity: int = Field(default=3, ge=1, le=10)  # of any one item
+    max_dist: float = Field(default=10, gt=0, le=nearby_stores.MAX_RADIUS_KM)
+
+@router.post("/{user_id}/lists/optimize", status_code=status.HTTP_201_CREATED)
+@db.writes_user_data
+@transactions.retry_on_conflict
+def optimize_list(user_id: int, request: BasketRequest):
+    """
+    Builds a shopping list that gets the most protein (or calories) out of a
+    budget, optionally meeting minimum calorie and macro totals, from the
+    cheapest price of each food at stores near the user.
+    """
+    if request.maximize not in ("protein", "calories"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Invalid maximize option")
+    minimums = {
+        BASKET_NUTRIENTS.index(column): minimum
+        for column, minimum in [("calories", request.min_calories),
+                                ("protein", request.min_protein),
+                                ("total_carbohydrate", request.min_carbohydrate),
+                                ("dietary_fiber", request.min_fiber)]
+        if minimum
+    }
+
+    with db.engine.connect().execution_options(isolation_level="REPEATABLE READ") as conn:
+        with conn.begin():
+            try:
+                nearby = nearby_stores.get(conn, user_id, request.max_dist)
+            except NoResultFound:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                    detail="User does not exist")
+            store_ids, _ = nearby.within(request.max_dist)
+            if not store_ids:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                    detail="No stores in range")
+
+            offers = conn.execute(sqlalchemy.text("""
+                SELECT DISTINCT ON (catalog_item.food_id)
+                       catalog_item.food_id, catalog_item.price,
+                       COALESCE(food_item.calories, 0) AS calories,
+                       COALESCE(food_item.protein, 0) AS protein,
+                       COALESCE(food_item.total_carbohydrate, 0) AS total_carbohydrate,
+                       COALESCE(food_item.dietary_fiber, 0) AS dietary_fiber
+                FROM catalog
+                JOIN catalog_item ON catalog_item.catalog_id = catalog.catalog_id
+                JOIN food_item ON food_item.food_id = catalog_item.food_id
+                WHERE catalog.store_id = ANY(:store_ids)
+                  AND catalog_item.quantity > 0
+                  AND catalog_item.price <= :budget
+                ORDER BY catalog_item.food_id, catalog_item.price
+                """), {"store_ids": store_ids, "budget": request.budget}).all()
+
+    if not offers:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Nothing nearby fits the budget")
+
+    basket = optimizer.solve(
+        [offer.price for offer in offers],
+        [[getattr(offer, column) for column in BASKET_NUTRIENTS] for offer in offers],
+        request.budget, BASKET_NUTRIENTS.index(request.maximize), minimums, request.max_quantity)
+    chosen = [(offer, int(quantity)) for offer, quantity in zip(offers, basket.quantities) if quantity > 0]
+    if not chosen:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Nothing nearby fits the budget")
+
+    with db.engine.begin() as conn:
+        list_id = conn.execute(sqlalchemy.text("""
+            WITH new_list AS (
+                INSERT INTO shopping_list (name, user_id)
+                VALUES (:name, :user_id)
+                RETURNING list_id
+            )
+            INSERT INTO shopping_list_item (list_id, food_id, user_id, quantity)
+            SELECT new_list.list_id, item.food_id, :user_id, item.quantity
+            FROM new_list, unnest(CAST(:food_ids AS int[]), CAST(:quantities AS int[]))
+                AS item(food_id, quantity)
+            RETURNING list_id
+            """), {"name": request.name, "user_id": user_id,
+                   "food_ids": [offer.food_id for offer, _ in chosen],
+                   "quantities": [quantity for _, quantity in chosen]}).scalars().first()
+
+    return {
+        "name": request.name,
+        "list_id": list_id,
+        "items": [
+            {
+                "food_id": offer.food_id,
+                "quantity": quantity,
+                "price": f"${offer.price / 100:.2f}"
+            }
+            for offer, quantity in chosen
+        ],
+        "total_cost": f"${basket.cost / 100:.2f}",
+        "totals": {column: int(total) for column, total in zip(BASKET_NUTRIENTS, basket.totals)},
+        "targets_met": basket.targets_met
+    }
+
 class Item(BaseModel):
     food_id: int
     quantity: int = Field(..., ge=1)
 
 @router.post("/{user_id}/lists/{list_id}/item", status_code=status.HTTP_201_CREATED)
+@db.writes_user_data
+@transactions.retry_on_conflict
 def add_item_to_list(list_id: int, user_id: int, items: list[Item]):
     """
     Add items to specified list, and specified user
@@ -182,33 +319,7 @@ def add_item_to_list(list_id: int, user_id: int, items: list[Item]):
     item_dicts = [{"list_id": list_id, "user_id": user_id, "food_id": item.food_id, "quantity": item.quantity} for item in items]
     with db.engine.connect().execution_options(isolation_level="REPEATABLE READ") as conn:
         with conn.begin():
-            try:
-                conn.execute(sqlalchemy.text("""
-                    SELECT 1 FROM users 
-                    WHERE user_id = :user_id
-                    """), {"user_id": user_id}).one()
-            except NoResultFound:
-                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                        detail="User does not exist.")
-
-            try:
-                conn.execute(sqlalchemy.text("""
-                    SELECT 1 FROM shopping_list 
-                    WHERE list_id = :list_id
-                    """), {"list_id": list_id}).one()
-            except NoResultFound:
-                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                    detail="List does not exist.")
-
-            try:
-                conn.execute(
-                    sqlalchemy.text("""
-                    SELECT 1 FROM shopping_list 
-                    WHERE list_id = :list_id AND user_id = :user_id
-                    """),{"user_id": user_id, "list_id": list_id}).one()
-            except NoResultFound:
-                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                    detail="User is not associated with this list.")
+            check_list_access(conn, user_id, list_id)
             
             try:
                 conn.execute(sqlalchemy.text("""
@@ -247,6 +358,8 @@ def add_item_to_list(list_id: int, user_id: int, items: list[Item]):
                 )
 
 @router.put("/{user_id}/lists/{list_id}/item", status_code=status.HTTP_204_NO_CONTENT)
+@db.writes_user_data
+@transactions.retry_on_conflict
 def edit_item_quantity_in_list(
     list_id: int,
     user_id: int,
@@ -257,38 +370,7 @@ def edit_item_quantity_in_list(
     """
     with db.engine.connect().execution_options(isolation_level="REPEATABLE READ") as conn:
         with conn.begin():
-            try:
-                conn.execute(sqlalchemy.text(""" 
-                    SELECT 1 FROM users 
-                    WHERE user_id = :user_id
-                """), {"user_id": user_id}).one()
-            except NoResultFound:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="User does not exist."
-                )
-
-            try:
-                conn.execute(sqlalchemy.text(""" 
-                    SELECT 1 FROM shopping_list 
-                    WHERE list_id = :list_id
-                """), {"list_id": list_id}).one()
-            except NoResultFound:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="List does not exist."
-                )
-
-            try:
-                conn.execute(sqlalchemy.text(""" 
-                    SELECT 1 FROM shopping_list 
-                    WHERE list_id = :list_id AND user_id = :user_id
-                """), {"user_id": user_id, "list_id": list_id}).one()
-            except NoResultFound:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="User is not associated with this list."
-                )
+            check_list_access(conn, user_id, list_id)
 
             food_ids = [item.food_id for item in items]
             existing_items = conn.execute(sqlalchemy.text("""
@@ -350,42 +432,19 @@ def edit_item_quantity_in_list(
 
 
 @router.delete("/{user_id}/lists/{list_id}/item", status_code=status.HTTP_204_NO_CONTENT)
+@db.writes_user_data
+@transactions.retry_on_conflict
 def delete_item_from_list(user_id: int, list_id: int, food_id: int):
     """
     Delete item from specified list, and specified user
     """
     with db.engine.begin() as conn:
 
-        try:
-            conn.execute(sqlalchemy.text("""
-                SELECT 1 FROM users 
-                WHERE user_id = :user_id
-                """), {"user_id": user_id}).one()
-        except NoResultFound:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                    detail="User does not exist.")
-
-        try:
-            conn.execute(sqlalchemy.text("""
-                SELECT 1 FROM shopping_list 
-                WHERE list_id = :list_id
-                """), {"list_id": list_id}).one()
-        except NoResultFound:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                detail="List does not exist.")
-
-        try:
-            conn.execute(
-                sqlalchemy.text("""
-                SELECT 1 FROM shopping_list 
-                WHERE list_id = :list_id AND user_id = :user_id
-                """),{"user_id": user_id, "list_id": list_id}).one()
-        except NoResultFound:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                detail="User is not associated with this list.")
-        user_data = {"list_id": list_id, "food_id": food_id}
+        check_list_access(conn, user_id, list_id)
+        user_data = {"list_id": list_id, "food_id": food_id, "user_id": user_id}
         check_query = sqlalchemy.text("""
-            SELECT 1 FROM shopping_list_item WHERE food_id = :food_id AND list_id = :list_id
+            SELECT 1 FROM shopping_list_item
+            WHERE food_id = :food_id AND list_id = :list_id AND user_id = :user_id
         """)
 
         try:
@@ -399,7 +458,7 @@ def delete_item_from_list(user_id: int, list_id: int, food_id: int):
         try:
             conn.execute(sqlalchemy.text("""
                     DELETE FROM shopping_list_item
-                    WHERE list_id = :list_id AND food_id = :food_id
+                    WHERE list_id = :list_id AND food_id = :food_id AND user_id = :user_id
                     """
                 ), user_data)
             return "Successfully deleted"
@@ -452,75 +511,30 @@ def get_list_history(user_id: int):
         
 
 @router.delete("/{user_id}/list/{list_id}/", status_code=status.HTTP_204_NO_CONTENT)
+@db.writes_user_data
+@transactions.retry_on_conflict
 def delete_list(user_id: int, list_id: int):
     with db.engine.begin() as conn:
-        try:
-            conn.execute(sqlalchemy.text("""
-                SELECT 1 FROM users 
-                WHERE user_id = :user_id
-                """), {"user_id": user_id}).one()
-        except NoResultFound:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                detail="User does not exist.")
-        try:
-            conn.execute(sqlalchemy.text("""
-                SELECT 1 FROM shopping_list 
-                WHERE list_id = :list_id
-                """), {"list_id": list_id}).one()
-        except NoResultFound:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                detail="List does not exist.")
-        try:
-            conn.execute(
-                sqlalchemy.text("""
-                SELECT 1 FROM shopping_list 
-                WHERE list_id = :list_id AND user_id = :user_id
-                """),{"user_id": user_id, "list_id": list_id}).one()
-        except NoResultFound:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                detail="User is not associated with this list.")
+        check_list_access(conn, user_id, list_id)
         
         conn.execute(sqlalchemy.text("""
-            DELETE FROM shopping_list_item WHERE list_id = :list_id;
+            DELETE FROM shopping_list_item WHERE list_id = :list_id AND user_id = :user_id;
             DELETE FROM shopping_list WHERE list_id = :list_id;
-            """), {"list_id":list_id})
+            """), {"list_id":list_id, "user_id": user_id})
         
 @router.get("/{user_id}/list/{list_id}", status_code=status.HTTP_200_OK)
+@transactions.retry_on_conflict
 def get_list(user_id: int, list_id: int):
-    with db.engine.begin() as conn:
-        try:
-            conn.execute(sqlalchemy.text("""
-                SELECT 1 FROM users 
-                WHERE user_id = :user_id
-                """), {"user_id": user_id}).one()
-        except NoResultFound:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                detail="User does not exist.")
-        try:
-            conn.execute(sqlalchemy.text("""
-                SELECT 1 FROM shopping_list 
-                WHERE list_id = :list_id
-                """), {"list_id": list_id}).one()
-        except NoResultFound:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                detail="List does not exist.")
-        try:
-            conn.execute(
-                sqlalchemy.text("""
-                SELECT 1 FROM shopping_list 
-                WHERE list_id = :list_id AND user_id = :user_id
-                """),{"user_id": user_id, "list_id": list_id}).one()
-        except NoResultFound:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                detail="User is not associated with this list.")
+    with db.read_only(user_id).begin() as conn:
+        check_list_access(conn, user_id, list_id)
         
         data = conn.execute(sqlalchemy.text("""
             SELECT food_item.food_id AS id, food_item.name AS name, shopping_list_item.quantity AS quantity
             FROM shopping_list_item
             JOIN shopping_list ON shopping_list.list_id = shopping_list_item.list_id
             JOIN food_item ON food_item.food_id = shopping_list_item.food_id
-            WHERE shopping_list.list_id = :list_id"""
-            ), {"list_id": list_id})
+            WHERE shopping_list.list_id = :list_id AND shopping_list_item.user_id = :user_id"""
+            ), {"list_id": list_id, "user_id": user_id})
 
         return [
             {
@@ -0,0 +1,154 @@
+"""
+Warm-up of a freshly started worker.
+
+Without it the first requests a worker serves open its database connections
+one at a time, and every new connection pays for the planner's first look
+at each table it touches. At startup warm_up() opens WARMUP_CONNECTIONS
+connections on each engine, loads the in-process indexes, then sends every
+request in WARM_REQUESTS through the app once per connection, all at the
+same time, so each pooled connection has run the hot statements. Rounds
+use different sample ids, so request coalescing does not fold them into
+one execution. GET /ready answers 503 until warm-up is done, which keeps a
+load balancer from routing to a cold worker.
+"""
+import asyncio
+import logging
+import os
+import time
+
+import httpx
+import sqlalchemy
+from fastapi.concurrency import run_in_threadpool
+
+from src import database as db
+from src import food_index, metrics, store_hours, value_index
+from src.api import auth
+
+logger = logging.getLogger(__name__)
+
+WARMUP_CONNECTIONS = int(os.environ.get("WARMUP_CONNECTIONS", "5"))  # per engine, 0 skips warm-up
+
+# (method, path), formatted with a row of sample ids per round
+WARM_REQUESTS = [
+    ("GET", "/stores/"),
+    ("GET", "/stores/{store_id}/catalog"),
+    ("POST", "/stores/compare-prices?food_id={food_id}"),
+    ("GET", "/foods/search?q={food_name}"),
+    ("GET", "/foods/best-value?user_id={user_id}"),
+    ("GET", "/shopping/route_optimize?user_id={user_id}&food_id={food_id}"),
+    ("GET", "/shopping/{user_id}/find_snack/{food_id}"),
+    ("GET", "/users/{user_id}/lists/"),
+    ("GET", "/users/{user_id}/lists/{list_id}/facts"),
+    ("GET", "/users/{user_id}/list/{list_id}"),
+]
+
+_ready = False
+_duration_ms = None
+_task = None
+
+
+def is_ready():
+    return _ready
+
+
+def open_pool(engine, size):
+    """
+    Checks out size connections at once, so that many are open in the pool.
+    """
+    connections = []
+    try:
+        for _ in range(size):
+            connections.append(engine.connect())
+    finally:
+        for conn in connections:
+            conn.close()
+
+
+def sample_ids(rounds):
+    """
+    One row of ids per round, cycling when there are fewer rows than rounds.
+    """
+    with db.engine.begin() as conn:
+        stores = conn.execute(sqlalchemy.text("""
+            SELECT store_id FROM store ORDER BY store_id LIMIT :rounds
+            """), {"rounds": rounds}).scalars().all()
+        foods = conn.execute(sqlalchemy.text("""
+            SELECT food_id, split_part(name, ' ', 1) AS food_name FROM food_item
+            WHERE name IS NOT NULL
+            ORDER BY food_id LIMIT :rounds
+            """), {"rounds": rounds}).all()
+        lists = conn.execute(sqlalchemy.text("""
+            SELECT list_id, user_id FROM shopping_list
+            WHERE user_id IS NOT NULL
+            ORDER BY list_id DESC LIMIT :rounds
+            """), {"rounds": rounds}).all()
+    if not (stores and foods and lists):
+        return []
+    return [{"store_id": stores[i % len(stores)],
+             "food_id": foods[i % len(foods)].food_id,
+             "food_name": foods[i % len(foods)].food_name,
+             "list_id": lists[i % len(lists)].list_id,
+             "user_id": lists[i % len(lists)].user_id}
+            for i in range(rounds)]
+
+
+def load_indexes():
+    food_index.current(db.engine)
+    value_index.current(db.engine)
+    with db.engine.begin() as conn:
+        store_hours.refresh(conn)
+
+
+async def send_round(client, ids):
+    for method, path in WARM_REQUESTS:
+        try:
+            response = await client.request(method, path.format(**ids))
+            if response.status_code >= 500:
+                logger.warning(f"Warm-up request {method} {path} answered {response.status_code}")
+        except Exception as e:
+            logger.warning(f"Warm-up request {method} {path} failed: {e}")
+
+
+async def warm_up(app):
+    """
+    Warms this worker up, then marks it ready. A step that fails is logged
+    and skipped: a partly warm worker still serves better than none.
+    """
+    global _ready, _duration_ms
+    start = time.monotonic()
+    try:
+        for engine in {db.engine, db.read_engine}:
+            await run_in_threadpool(open_pool, engine, min(WARMUP_CONNECTIONS, engine.pool.size()))
+        await run_in_threadpool(load_indexes)
+        rounds = await run_in_threadpool(sample_ids, WARMUP_CONNECTIONS)
+
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://warmup",
+                                     headers={"access_token": auth.api_keys[0] or ""}) as client:
+            await asyncio.gather(*(send_round(client, ids) for ids in rounds))
+    except Exception as e:
+        logger.exception(f"Warm-up failed: {e}")
+    finally:
+        _duration_ms = round((time.monotonic() - start) * 1000)
+        _ready = True
+        logger.info(f"Warm-up finished in {_duration_ms}ms")
+
+
+def start(app):
+    """
+    Starts warm-up in the background of the running event loop, so /ready
+    and /health answer meanwhile.
+    """
+    global _ready, _task
+    if WARMUP_CONNECTIONS <= 0:
+        _ready = True
+        return
+    if _task is None:
+        _task = asyncio.get_running_loop().create_task(warm_up(app))
+
+
+def _metrics():
+    return {"ready": _ready, "duration_ms": _duration_ms}
+
+
+metrics.gauge("warmup", _metrics)
@@ -0,0 +1,129 @@
+"""
+Background refresh of the best_price materialized view.
+
+best_price holds the TOP_N cheapest offers of every food across all stores,
+so price-ranked reads (compare prices, the price orderings of find snack and
+fulfill list) can skip ranking catalog_item at request time. Callers opt in
+by passing how stale a price they accept; fresh_enough() decides per request.
+
+A daemon thread refreshes the view CONCURRENTLY every REFRESH_SECONDS, so
+readers never block on it. Every API process runs the thread, but an
+advisory lock lets only one of them refresh at a time. Refresh time and
+staleness show up in /metrics.
+"""
+import logging
+import os
+import threading
+import time
+
+import sqlalchemy
+
+from src import metrics
+
+logger = logging.getLogger(__name__)
+
+TOP_N = 10  # offers kept per food, matches the view definition in schema.sql
+REFRESH_SECONDS = int(os.environ.get("BEST_PRICE_REFRESH_SECONDS", "60"))  # 0 disables the scheduler
+STATUS_SECONDS = 5  # how long a read of the refresh time is reused
+REFRESH_LOCK = 41  # pg advisory lock key
+
+_status_lock = threading.Lock()
+_age_seconds = None  # staleness when last read from the database
+_checked_at = 0.0
+_last_duration_ms = None
+_scheduler = None
+
+
+def refresh(engine):
+    """
+    Refreshes the view unless another process is already refreshing it.
+    Returns the duration in ms, or None when skipped.
+    """
+    global _last_duration_ms, _age_seconds, _checked_at
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if not conn.execute(sqlalchemy.text("SELECT pg_try_advisory_lock(:key)"),
+                            {"key": REFRESH_LOCK}).scalar_one():
+            return None
+        try:
+            # The view holds prices as of when the refresh started
+            started_at = conn.execute(sqlalchemy.text("SELECT now()")).scalar_one()
+            start = time.monotonic()
+            conn.execute(sqlalchemy.text("REFRESH MATERIALIZED VIEW CONCURRENTLY best_price"))
+            duration_ms = int((time.monotonic() - start) * 1000)
+            conn.execute(sqlalchemy.text("""
+                INSERT INTO materialized_view_refresh (view_name, refreshed_at, duration_ms)
+                VALUES ('best_price', :refreshed_at, :duration_ms)
+                ON CONFLICT (view_name) DO UPDATE
+                SET refreshed_at = EXCLUDED.refreshed_at, duration_ms = EXCLUDED.duration_ms
+                """), {"refreshed_at": started_at, "duration_ms": duration_ms})
+        finally:
+            conn.execute(sqlalchemy.text("SELECT pg_advisory_unlock(:key)"), {"key": REFRESH_LOCK})
+
+    with _status_lock:
+        _last_duration_ms = duration_ms
+        _age_seconds, _checked_at = duration_ms / 1000, time.monotonic()
+    metrics.increment("best_price_refreshes", "best_price")
+    logger.info(f"Refreshed best_price in {duration_ms}ms")
+    return duration_ms
+
+
+def staleness(conn):
+    """
+    Seconds since the prices in best_price were read, measured on the
+    database clock and re-read at most every STATUS_SECONDS.
+    """
+    global _age_seconds, _checked_at
+    with _status_lock:
+        if _age_seconds is not None and time.monotonic() - _checked_at < STATUS_SECONDS:
+            return _age_seconds + time.monotonic() - _checked_at
+
+    age = conn.execute(sqlalchemy.text("""
+        SELECT EXTRACT(EPOCH FROM now() - refreshed_at)
+        FROM materialized_view_refresh
+        WHERE view_name = 'best_price'
+        """)).scalar()
+    if age is None:
+        return None
+    with _status_lock:
+        _age_seconds, _checked_at = float(age), time.monotonic()
+    return _age_seconds
+
+
+def fresh_enough(conn, max_staleness):
+    """
+    Whether best_price may answer a caller accepting prices up to
+    max_staleness seconds old. None means the caller wants live prices.
+    """
+    if max_staleness is None:
+        return False
+    age = staleness(conn)
+    return age is not None and age <= max_staleness
+
+
+def _metrics():
+    with _status_lock:
+        age = None if _age_seconds is None else _age_seconds + time.monotonic() - _checked_at
+    return {"staleness_seconds": age, "last_refresh_ms": _last_duration_ms}
+
+
+metrics.gauge("best_price", _metrics)
+
+
+def _run(engine):
+    while True:
+        try:
+            refresh(engine)
+        except Exception as e:
+            logger.exception(f"Refreshing best_price failed: {e}")
+        time.sleep(REFRESH_SECONDS)
+
+
+def start_scheduler(engine):
+    """
+    Starts the refresh thread once per process.
+    """
+    global _scheduler
+    if REFRESH_SECONDS <= 0 or _scheduler is not None:
+        return
+    _scheduler = threading.Thread(target=_run, args=(engine,), name="best-price-refresh", daemon=True)
+    _scheduler.start()
@@ -0,0 +1,126 @@
+"""
+Binary snapshot of the catalog shared by every worker process on a host.
+
+The snapshot is one .npy file holding a record per catalog item: ids, price,
+quantity and the food's nutrients as fixed-width columns. Workers map it
+read-only with np.load(mmap_mode="r"), so the pages live once in the OS page
+cache instead of once per process, and column reads are views into the map.
+
+Snapshots are written to a temporary file next to SNAPSHOT_PATH and moved
+into place with os.replace, so readers see either the old file or the new
+one, never a partial write. A reader that mapped the old file keeps a valid
+map until it lets go of it. A lock file makes sure only one process queries
+the database and writes a new snapshot at a time. The file's mtime is set to
+when its query started, so it says how current the data is.
+"""
+import fcntl
+import logging
+import os
+import tempfile
+import time
+
+import numpy as np
+import sqlalchemy
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PATH = os.environ.get("CATALOG_SNAPSHOT_PATH",
+                               os.path.join(tempfile.gettempdir(), "crusty_cart_catalog.npy"))
+
+MISSING = -1  # price or quantity that is NULL in the database
+
+NUTRIENTS = ["serving_size", "calories", "saturated_fat", "trans_fat", "dietary_fiber",
+             "total_carbohydrate", "total_sugars", "protein"]
+
+# NULL nutrients are NaN
+DTYPE = np.dtype(
+    [("catalog_item_id", np.int64), ("food_id", np.int64), ("store_id", np.int32),
+     ("price", np.int32), ("quantity", np.int32)]
+    + [(nutrient, np.float32) for nutrient in NUTRIENTS])
+
+
+class Snapshot:
+    def __init__(self, path):
+        stat = os.stat(path)
+        self.rows = np.load(path, mmap_mode="r")
+        self.identity = (stat.st_ino, stat.st_mtime_ns)
+        self.taken_at = stat.st_mtime  # wall clock time its query started
+
+    def age_seconds(self):
+        return time.time() - self.taken_at
+
+    def is_current(self, path=None):
+        """
+        Whether the file at path is still the one this snapshot mapped.
+        """
+        try:
+            stat = os.stat(path or SNAPSHOT_PATH)
+        except FileNotFoundError:
+            return False
+        return (stat.st_ino, stat.st_mtime_ns) == self.identity
+
+
+def query(engine):
+    """
+    Reads the whole catalog into a record array, returns it with the time
+    the query started.
+    """
+    taken_at = time.time()
+    with engine.begin() as conn:
+        result = conn.execute(sqlalchemy.text(f"""
+            SELECT catalog_item.catalog_item_id, catalog_item.food_id, catalog.store_id,
+                   COALESCE(catalog_item.price, {MISSING}), COALESCE(catalog_item.quantity, {MISSING}),
+                   {", ".join(f"COALESCE(food_item.{n}::real, 'NaN')" for n in NUTRIENTS)}
+            FROM catalog_item
+            JOIN catalog ON catalog.catalog_id = catalog_item.catalog_id
+            JOIN food_item ON food_item.food_id = catalog_item.food_id
+            WHERE catalog.store_id IS NOT NULL
+            ORDER BY catalog_item.catalog_item_id
+            """))
+        rows = np.array([tuple(row) for row in result], dtype=DTYPE)
+    return rows, taken_at
+
+
+def write(rows, taken_at, path=None):
+    """
+    Atomically replaces the snapshot at path with rows.
+    """
+    path = path or SNAPSHOT_PATH
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            np.save(f, rows, allow_pickle=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.utime(tmp_path, (taken_at, taken_at))
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def load(engine, newer_than, wait=True, path=None):
+    """
+    Maps the snapshot at path, first rebuilding it from the database if it is
+    missing or its data is from before newer_than (a time.time() value).
+    With wait=False, returns None instead of waiting while another process
+    rebuilds it.
+    """
+    path = path or SNAPSHOT_PATH
+    with open(f"{path}.lock", "a") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+        except BlockingIOError:
+            return None
+        try:
+            # Another process may have rebuilt it while this one waited
+            if os.path.exists(path) and os.stat(path).st_mtime >= newer_than:
+                return Snapshot(path)
+            start = time.monotonic()
+            rows, taken_at = query(engine)
+            write(rows, taken_at, path)
+            logger.info(f"Wrote catalog snapshot of {len(rows)} items ({rows.nbytes} bytes) "
+                        f"in {(time.monotonic() - start) * 1000:.0f}ms")
+            return Snapshot(path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
@@ -0,0 +1,212 @@
+"""
+Bulk price and quantity feeds for a store's catalog.
+
+An upload is spooled as CSV (in memory, or on disk once it is large) while it
+streams in. Every line, CSV or NDJSON, is parsed on the way into the fixed
+staging columns plus an error, so a line that cannot be parsed (a wrong
+number of fields, an unbalanced quote, invalid JSON) is rejected on its own
+instead of failing the whole upload. The spooled rows are COPYed into a
+temporary staging table with every column as text, so a bad value never
+aborts the load. One statement then validates every row, updates the items
+the catalog already has, inserts the new ones and reports what it did.
+Nothing is checked with a round trip per row.
+"""
+import csv
+import io
+import json
+import tempfile
+
+import psycopg2
+import sqlalchemy
+
+COLUMNS = ["food_id", "price", "quantity"]
+SPOOL_BYTES = 8 * 1024 * 1024  # larger uploads are spooled to disk
+MAX_UPLOAD_BYTES = 200 * 1024 * 1024
+MAX_ERRORS = 100  # rejected rows listed in the response
+UPLOAD_LOCK = 43  # pg advisory lock key, paired with the store_id
+
+CSV_TYPES = {"text/csv", "application/csv"}
+NDJSON_TYPES = {"application/x-ndjson", "application/ndjson", "application/jsonl"}
+
+
+class UploadError(Exception):
+    pass
+
+
+class UploadTooLarge(UploadError):
+    pass
+
+
+def _header(line):
+    columns = [column.strip().lower() for column in line.decode("utf-8-sig").strip().split(",")]
+    unknown = [column for column in columns if column not in COLUMNS]
+    if unknown:
+        raise UploadError(f"Unknown column(s) {', '.join(unknown)}, expected {', '.join(COLUMNS)}")
+    if "food_id" not in columns or len(set(columns)) != len(columns):
+        raise UploadError("The header needs a food_id column and no column twice")
+    return columns
+
+
+def _csv_row(line, columns):
+    try:
+        fields = next(csv.reader([line.decode("utf-8")], strict=True))
+    except UnicodeDecodeError:
+        return [None, None, None, "invalid UTF-8"]
+    except csv.Error:
+        return [None, None, None, "malformed CSV, check its quotes"]
+    if len(fields) != len(columns):
+        return [None, None, None, f"expected {len(columns)} fields, got {len(fields)}"]
+    # An empty field means no value, as it did for COPY
+    record = dict(zip(columns, fields))
+    return [record.get(column) or None for column in COLUMNS] + [None]
+
+
+def _ndjson_row(line):
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return [None, None, None, "invalid JSON"]
+    if not isinstance(record, dict):
+        return [None, None, None, "expected a JSON object"]
+    return [None if record.get(column) is None else str(record[column]) for column in COLUMNS] + [None]
+
+
+def media_type(content_type):
+    """
+    The upload format for a Content-Type header, None if it is not supported.
+    """
+    media = (content_type or "").split(";")[0].strip().lower()
+    return media if media in CSV_TYPES | NDJSON_TYPES else None
+
+
+async def spool(chunks, media):
+    """
+    Reads the upload from the async iterator of byte chunks into a temporary
+    file of CSV, returns the file and the staging columns it fills, in order.
+    """
+    is_csv = media in CSV_TYPES
+
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES, mode="w+b")
+    converted = io.StringIO()
+    writer = csv.writer(converted, lineterminator="\n")
+    header = None
+
+    def write_lines(lines):
+        for line in lines:
+            line = line.rstrip(b"\r")
+            if line.strip():
+                writer.writerow(_csv_row(line, header) if is_csv else _ndjson_row(line))
+        spooled.write(converted.getvalue().encode("utf-8"))
+        converted.seek(0)
+        converted.truncate()
+
+    pending = b""
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        if size > MAX_UPLOAD_BYTES:
+            raise UploadTooLarge(f"Uploads are limited to {MAX_UPLOAD_BYTES // (1024 * 1024)}MB")
+        *lines, pending = (pending + chunk).split(b"\n")
+        if is_csv and header is None and lines:
+            header = _header(lines.pop(0))
+        write_lines(lines)
+    if is_csv and header is None:
+        if not pending.strip():
+            raise UploadError("The upload is empty")
+        header = _header(pending)
+    else:
+        write_lines([pending])
+
+    spooled.seek(0)
+    return spooled, COLUMNS + ["error"]
+
+
+# Every staged row gets a reason unless it is good to apply. When a food
+# appears more than once, the last row for it wins.
+merge_statement = sqlalchemy.text(r"""
+    WITH parsed AS (
+        SELECT line, error, price AS raw_price, quantity AS raw_quantity,
+            CASE WHEN food_id ~ '^\s*[0-9]{1,9}\s*$' THEN food_id::int END AS food_id,
+            CASE WHEN price ~ '^\s*[0-9]{1,9}\s*$' THEN price::int END AS price,
+            CASE WHEN quantity ~ '^\s*[0-9]{1,9}\s*$' THEN quantity::int END AS quantity
+        FROM catalog_upload
+    ),
+    classified AS (
+        SELECT parsed.*, listed.food_id IS NOT NULL AS listed,
+            CASE
+                WHEN parsed.error IS NOT NULL THEN parsed.error
+                WHEN parsed.food_id IS NULL THEN 'food_id must be a positive whole number'
+                WHEN parsed.raw_price IS NOT NULL AND (parsed.price IS NULL OR parsed.price = 0)
+                    THEN 'price must be a positive whole number of cents'
+                WHEN parsed.raw_quantity IS NOT NULL AND parsed.quantity IS NULL
+                    THEN 'quantity must be a whole number'
+                WHEN food_item.food_id IS NULL THEN 'unknown food_id'
+                WHEN parsed.price IS NULL AND parsed.quantity IS NULL THEN 'no price or quantity'
+                WHEN listed.food_id IS NULL AND parsed.price IS NULL THEN 'new items need a price'
+            END AS reason
+        FROM parsed
+        LEFT JOIN food_item ON food_item.food_id = parsed.food_id
+        LEFT JOIN (
+            SELECT DISTINCT food_id FROM catalog_item WHERE catalog_id = :catalog_id
+        ) AS listed ON listed.food_id = parsed.food_id
+    ),
+    valid AS (
+        SELECT DISTINCT ON (food_id) food_id, price, quantity, listed
+        FROM classified
+        WHERE reason IS NULL
+        ORDER BY food_id, line DESC
+    ),
+    updated AS (
+        UPDATE catalog_item
+        SET price = COALESCE(valid.price, catalog_item.price),
+            quantity = COALESCE(valid.quantity, catalog_item.quantity)
+        FROM valid
+        WHERE valid.listed
+          AND catalog_item.catalog_id = :catalog_id
+          AND catalog_item.food_id = valid.food_id
+        RETURNING catalog_item.catalog_item_id, catalog_item.price
+    ),
+    inserted AS (
+        INSERT INTO catalog_item (catalog_id, food_id, price, quantity)
+        SELECT :catalog_id, food_id, price, quantity
+        FROM valid
+        WHERE NOT listed
+        RETURNING catalog_item_id
+    )
+    SELECT
+        (SELECT COUNT(*) FROM inserted) AS inserted,
+        (SELECT COUNT(*) FROM updated) AS updated,
+        (SELECT COUNT(*) FROM classified WHERE reason IS NOT NULL) AS rejected,
+        (SELECT COUNT(*) FROM classified WHERE reason IS NULL) - (SELECT COUNT(*) FROM valid) AS superseded,
+        (SELECT COALESCE(json_agg(json_build_object('row', line, 'reason', reason) ORDER BY line), '[]')
+         FROM (SELECT line, reason FROM classified WHERE reason IS NOT NULL ORDER BY line LIMIT :max_errors) AS first_errors
+        ) AS errors,
+        ARRAY(SELECT catalog_item_id FROM updated ORDER BY catalog_item_id) AS updated_ids,
+        ARRAY(SELECT price FROM updated ORDER BY catalog_item_id) AS updated_prices
+    """)
+
+
+def merge(conn, catalog_id, store_id, spooled, columns):
+    """
+    Stages the spooled rows and applies them to the catalog in the
+    connection's transaction. Uploads to one store run one at a time.
+    """
+    conn.execute(sqlalchemy.text("SELECT pg_advisory_xact_lock(:key, :store_id)"),
+                 {"key": UPLOAD_LOCK, "store_id": store_id})
+    conn.execute(sqlalchemy.text("""
+        CREATE TEMPORARY TABLE catalog_upload (
+            line bigint GENERATED ALWAYS AS IDENTITY,
+            food_id text,
+            price text,
+            quantity text,
+            error text
+        ) ON COMMIT DROP
+        """))
+    spooled.seek(0)
+    with conn.connection.cursor() as cursor:
+        try:
+            cursor.copy_expert(f"COPY catalog_upload ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+                               spooled)
+        except psycopg2.DataError as e:
+            raise UploadError(f"Malformed upload: {e.diag.message_primary}")
+    return conn.execute(merge_statement, {"catalog_id": catalog_id, "max_errors": MAX_ERRORS}).one()
@@ -1,10 +1,126 @@
+import contextvars
+import functools
 import os
+import time
 import dotenv
 from sqlalchemy import create_engine
+from src import deadline, transactions
+
+# How long a user's reads stay on the primary after they write, so they see
+# their own changes even if the replica is behind.
+STICKY_SECONDS = 5
+# Carries the last write to the client, so the marker reaches whichever API
+# process or instance serves the follow-up read
+WRITE_COOKIE = "crusty_last_write"
 
 def database_connection_url():
     dotenv.load_dotenv()
 
     return os.environ.get("POSTGRES_URI")
 
-engine = create_engine(database_connection_url(), pool_pre_ping=True)
\ No newline at end of file
+def read_replica_url():
+    dotenv.load_dotenv()
+
+    return os.environ.get("POSTGRES_READ_URI")
+
+engine = create_engine(database_connection_url(), pool_pre_ping=True)
+
+# Without POSTGRES_READ_URI every read goes to the primary as before
+read_engine = (create_engine(read_replica_url(), pool_pre_ping=True)
+               if read_replica_url() else engine)
+
+for installed in {engine, read_engine}:
+    deadline.install(installed)
+    transactions.install(installed)
+
+# Read-only transactions. On the primary SERIALIZABLE READ ONLY DEFERRABLE
+# waits for a snapshot that can never fail serialization and skips predicate
+# locking. Hot standbys do not support SERIALIZABLE, so replicas use
+# REPEATABLE READ READ ONLY.
+_primary_read_only = engine.execution_options(
+    isolation_level="SERIALIZABLE", postgresql_readonly=True, postgresql_deferrable=True)
+_replica_read_only = (read_engine.execution_options(
+    isolation_level="REPEATABLE READ", postgresql_readonly=True)
+    if read_engine is not engine else _primary_read_only)
+
+class WriteMarker:
+    """
+    The last write of the client making the request: the user it changed and
+    when, as a wall clock time. Read from WRITE_COOKIE, and updated when the
+    request writes so the middleware in server.py sends the cookie back.
+    """
+    def __init__(self, user_id=None, wrote_at=None):
+        self.user_id = user_id
+        self.wrote_at = wrote_at
+        self.changed = False
+
+    @classmethod
+    def parse(cls, cookie):
+        """
+        The marker in a WRITE_COOKIE value, an empty one when it is missing
+        or invalid.
+        """
+        try:
+            user_id, wrote_at = cookie.split(":")
+            return cls(int(user_id), float(wrote_at))
+        except (AttributeError, ValueError):
+            return cls()
+
+    def cookie(self):
+        return f"{self.user_id}:{self.wrote_at:.3f}"
+
+
+# Holds the object, like deadline._current, so a write marked from the
+# endpoint's worker thread is visible to the middleware.
+_marker = contextvars.ContextVar("write_marker", default=None)
+
+
+def start_request(cookie):
+    marker = WriteMarker.parse(cookie)
+    _marker.set(marker)
+    return marker
+
+
+def mark_write(user_id):
+    """
+    Call after a user's own data changes, their reads use the primary for
+    the next STICKY_SECONDS.
+    """
+    marker = _marker.get()
+    if marker is not None and user_id is not None:
+        marker.user_id, marker.wrote_at, marker.changed = user_id, time.time(), True
+
+
+def reader(user_id=None):
+    """
+    Engine for a read-only endpoint: the replica, unless the request's write
+    marker says user_id wrote recently. Writes always use `engine`.
+    """
+    if read_engine is engine or user_id is None:
+        return read_engine
+    marker = _marker.get()
+    if (marker is not None and marker.user_id == user_id
+            and time.time() - marker.wrote_at < STICKY_SECONDS):
+        return engine
+    return read_engine
+
+
+def writes_user_data(endpoint):
+    """
+    Decorator for endpoints that change the data of their user_id parameter,
+    marks the user as a recent writer once the endpoint finishes.
+    """
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            mark_write(kwargs.get("user_id"))
+    return wrapper
+
+
+def read_only(user_id=None):
+    """
+    Engine for a read-only endpoint's transactions, chosen like reader().
+    """
+    return _primary_read_only if reader(user_id) is engine else _replica_read_only
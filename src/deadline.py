@@ -0,0 +1,107 @@
+"""
+Per-request deadlines enforced by Postgres.
+
+The HTTP middleware in server.py starts a Deadline for every request: the
+route's budget from ROUTE_BUDGETS_MS, shortened by the client's
+X-Deadline-Ms header when that asks for less. Each transaction then starts
+with SET LOCAL statement_timeout set to the time left, so Postgres cancels a
+runaway query itself and the connection goes back to the pool. Statements
+issued after the deadline passed are not sent at all. Either way the
+deadline is marked expired and the middleware answers 503.
+"""
+import contextvars
+import time
+
+from sqlalchemy import event
+
+DEADLINE_HEADER = "X-Deadline-Ms"
+DEFAULT_BUDGET_MS = 2000
+MIN_TIMEOUT_MS = 1  # statement_timeout = 0 would mean no timeout at all
+
+# Endpoint function name -> latency budget in ms, for routes that need more
+# (or should get less) than DEFAULT_BUDGET_MS
+ROUTE_BUDGETS_MS = {
+    "get_stores": 500,
+    "get_catalog": 1000,
+    "compare_prices": 500,
+    "search_foods": 500,
+    "find_snack": 1000,
+    "fulfill_list": 5000,
+    "optimize_list": 5000,
+    "optimize_shopping_routes": 5000,
+    "best_value": 5000,
+    "upload_catalog": 60000,
+}
+
+QUERY_CANCELED = "57014"  # Postgres SQLSTATE for statement_timeout
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    def __init__(self, budget_ms):
+        self.budget_ms = budget_ms
+        self.expires_at = time.monotonic() + budget_ms / 1000
+        self.expired = False
+
+    def remaining_ms(self):
+        return (self.expires_at - time.monotonic()) * 1000
+
+
+# Holds the object rather than a flag, so marking it expired from the
+# endpoint's worker thread is visible to the middleware.
+_current = contextvars.ContextVar("deadline", default=None)
+
+
+def budget_ms(route_name, header_value=None):
+    """
+    The route's budget, or the client's deadline header if that is shorter.
+    Invalid header values are ignored.
+    """
+    budget = ROUTE_BUDGETS_MS.get(route_name, DEFAULT_BUDGET_MS)
+    try:
+        requested = int(header_value)
+    except (TypeError, ValueError):
+        return budget
+    return max(min(budget, requested), 0)
+
+
+def start(budget):
+    deadline = Deadline(budget)
+    _current.set(deadline)
+    return deadline
+
+
+def current():
+    return _current.get()
+
+
+def install(engine):
+    """
+    Applies request deadlines to every transaction on the engine.
+    """
+    @event.listens_for(engine, "begin")
+    def set_statement_timeout(conn):
+        deadline = current()
+        if deadline is None:
+            return
+        remaining = int(deadline.remaining_ms())
+        if remaining < MIN_TIMEOUT_MS:
+            deadline.expired = True
+            raise DeadlineExceeded(f"{deadline.budget_ms}ms deadline passed before the transaction started")
+        conn.exec_driver_sql(f"SET LOCAL statement_timeout = {remaining}")
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def check_deadline(conn, cursor, statement, parameters, context, executemany):
+        deadline = current()
+        if deadline is not None and deadline.remaining_ms() < MIN_TIMEOUT_MS:
+            deadline.expired = True
+            raise DeadlineExceeded(f"{deadline.budget_ms}ms deadline passed")
+
+    @event.listens_for(engine, "handle_error")
+    def mark_canceled(context):
+        deadline = current()
+        if deadline is not None and getattr(context.original_exception, "pgcode", None) == QUERY_CANCELED:
+            deadline.expired = True
@@ -0,0 +1,68 @@
+"""
+Conditional GETs for the store list and store catalogs.
+
+Their ETags are built from versions that triggers bump in the same
+transaction as any change to what the response shows (see store_version
+and catalog_version in schema.sql). A poll that sends its ETag back in
+If-None-Match costs a couple of primary key lookups and gets a 304 while
+nothing changed, instead of running and sending the full query again.
+
+The ETags are weak: GZipMiddleware sends the same tag with the compressed
+and the identity body, which are not byte-for-byte equal.
+"""
+import sqlalchemy
+from fastapi import Response, status
+
+from src import metrics
+
+# Stores may poll without caching: a cached copy is revalidated every time
+CACHE_CONTROL = "no-cache"
+
+stores_version_statement = sqlalchemy.text("SELECT version FROM store_version")
+
+catalog_version_statement = sqlalchemy.text("""
+    SELECT store_version.version AS stores,
+        COALESCE((SELECT version FROM catalog_version WHERE store_id = :store_id), 0) AS catalog,
+        EXISTS (SELECT 1 FROM store WHERE store_id = :store_id) AS store_exists
+    FROM store_version
+    """)
+
+
+def stores_tag(conn):
+    """
+    The ETag of GET /stores/ as of the connection's snapshot.
+    """
+    return f'W/"s{conn.execute(stores_version_statement).scalar_one()}"'
+
+
+def catalog_tag(conn, store_id):
+    """
+    The ETag of a store's catalog as of the connection's snapshot, None when
+    the store does not exist, so that even If-None-Match: * gets its 404.
+    """
+    versions = conn.execute(catalog_version_statement, {"store_id": store_id}).one()
+    if not versions.store_exists:
+        return None
+    return f'W/"c{versions.stores}.{versions.catalog}"'
+
+
+def matches(if_none_match, etag):
+    """
+    Whether an If-None-Match header names etag. The comparison is weak, as
+    RFC 9110 asks for If-None-Match, so W/ prefixes are ignored. A missing
+    resource (etag None) matches nothing, not even *.
+    """
+    if not if_none_match or etag is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag.removeprefix("W/") for tag in if_none_match.split(","))
+
+
+def headers(etag):
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+
+
+def not_modified(etag, route):
+    metrics.increment("not_modified", route)
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers(etag))
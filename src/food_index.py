@@ -0,0 +1,140 @@
+"""
+In-memory prefix index over food_item.name for search and autocomplete.
+
+Every word of every name goes into one sorted array of (word, food_id), so
+the foods with a word starting with some prefix are a contiguous slice found
+by bisect. A multi-word query walks the slice of its rarest word and checks
+the other words against each candidate, then ranks every match. A slice
+longer than FULL_RANK_LIMIT (a one or two letter prefix at 100k foods) is
+not walked per query: the first query for that prefix ranks the whole
+slice once and keeps its best MAX_CANDIDATES foods for the index's
+lifetime. That ranking is exact for a one-word query. A multi-word query
+whose words all have such long slices only ranks the matches among those
+candidates. Lookups stay well under a millisecond at 100k foods without
+touching the database.
+
+The index is rebuilt from the database on first use, after invalidate(), or
+once older than REFRESH_SECONDS. The API never writes food_item, foods come
+from data loads outside it, so in practice new and renamed foods show up
+within REFRESH_SECONDS. Only one thread rebuilds at a time while the others
+keep answering from the previous index.
+"""
+import bisect
+import heapq
+import re
+import threading
+import time
+
+import sqlalchemy
+
+REFRESH_SECONDS = 300
+FULL_RANK_LIMIT = 2000  # longest prefix slice walked per query
+MAX_CANDIDATES = 250  # ranked foods kept for each longer slice
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+class FoodIndex:
+    def __init__(self, rows):
+        self.names = {}
+        self.words = {}
+        self.joined = {}
+        entries = []
+        for food_id, name in rows:
+            if not name:
+                continue
+            words = tuple(normalize(name))
+            self.names[food_id] = name
+            self.words[food_id] = words
+            self.joined[food_id] = " ".join(words)
+            entries.extend((word, food_id) for word in set(words))
+        entries.sort()
+        self.keys = [word for word, _ in entries]
+        self.ids = [food_id for _, food_id in entries]
+        self.top = {}  # prefix -> its best MAX_CANDIDATES food ids, for long slices
+        self.built_at = time.monotonic()
+
+    def prefix_range(self, prefix):
+        start = bisect.bisect_left(self.keys, prefix)
+        end = bisect.bisect_left(self.keys, prefix + "\uffff", start)
+        return start, end
+
+    def rank_key(self, food_id, joined):
+        # Names that start with the query first, then shorter (more specific) names
+        return not self.joined[food_id].startswith(joined), len(self.names[food_id]), food_id
+
+    def top_candidates(self, prefix, start, end):
+        top = self.top.get(prefix)
+        if top is None:
+            # Racing threads compute the same list, either one may be kept
+            top = self.top[prefix] = heapq.nsmallest(
+                MAX_CANDIDATES, set(self.ids[start:end]), key=lambda food_id: self.rank_key(food_id, prefix))
+        return top
+
+    def search(self, query, limit):
+        terms = normalize(query)
+        if not terms:
+            return []
+
+        ranges = [self.prefix_range(term) for term in terms]
+        start, end = min(ranges, key=lambda bounds: bounds[1] - bounds[0])
+        others = terms[:]
+        rarest = others.pop(ranges.index((start, end)))
+
+        if end - start <= FULL_RANK_LIMIT:
+            candidates = set(self.ids[start:end])
+        else:
+            candidates = self.top_candidates(rarest, start, end)
+        matches = [food_id for food_id in candidates
+                   if all(any(word.startswith(term) for word in self.words[food_id]) for term in others)]
+
+        joined = " ".join(terms)
+        best = heapq.nsmallest(limit, matches, key=lambda food_id: self.rank_key(food_id, joined))
+        return [(food_id, self.names[food_id]) for food_id in best]
+
+
+_index = None
+_refresh_lock = threading.Lock()
+_invalidated = False
+
+
+def normalize(text):
+    return _WORD.findall(text.lower())
+
+
+def refresh(engine):
+    global _index, _invalidated
+    # Cleared before reading, so an invalidate() racing the read still
+    # triggers another rebuild
+    _invalidated = False
+    with engine.begin() as conn:
+        rows = conn.execute(sqlalchemy.text("""
+            SELECT food_id, name FROM food_item
+            """)).all()
+    _index = FoodIndex(rows)
+
+
+def invalidate():
+    """
+    Call after food items are added, renamed or removed in this process.
+    """
+    global _invalidated
+    _invalidated = True
+
+
+def current(engine):
+    """
+    The loaded index, building it first if there is none. Takes the engine
+    rather than a connection so the common case never checks one out.
+    """
+    if _index is None:
+        with _refresh_lock:
+            if _index is None:
+                refresh(engine)
+    elif _invalidated or time.monotonic() - _index.built_at > REFRESH_SECONDS:
+        if _refresh_lock.acquire(blocking=False):
+            try:
+                refresh(engine)
+            finally:
+                _refresh_lock.release()
+    return _index
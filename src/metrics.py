@@ -0,0 +1,32 @@
+"""
+In-process counters for operational metrics, served at GET /metrics.
+
+Counters are keyed by name and route and only ever go up. Gauges are
+functions returning {key: value}, evaluated whenever metrics are read. Like
+the caches, both are per worker process.
+"""
+import threading
+from collections import defaultdict
+
+_counters = defaultdict(lambda: defaultdict(int))
+_gauges = {}
+_lock = threading.Lock()
+
+
+def increment(name, route, amount=1):
+    with _lock:
+        _counters[name][route] += amount
+
+
+def gauge(name, read):
+    with _lock:
+        _gauges[name] = read
+
+
+def snapshot():
+    with _lock:
+        values = {name: dict(routes) for name, routes in _counters.items()}
+        gauges = list(_gauges.items())
+    for name, read in gauges:
+        values[name] = read()
+    return values
@@ -0,0 +1,120 @@
+"""
+Per-user cache of the stores within MAX_RADIUS_KM of them, sorted by distance.
+
+Users rarely move and stores almost never do, so the shopping endpoints read
+distances from here instead of running earth_distance for every candidate
+row. Entries are built lazily from the user's coordinates in
+user_locations, evicted least-recently-used past MAX_USERS, and dropped
+when the user's or any store's location changes. Each worker process has
+its own cache, so TTL_SECONDS bounds how long a change made through another
+worker (or directly in SQL) can go unnoticed.
+"""
+import bisect
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import sqlalchemy
+
+from src import user_locations
+
+MAX_RADIUS_KM = 50
+MAX_USERS = 10000
+TTL_SECONDS = 300
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+find_nearby_stores = sqlalchemy.text("""
+    SELECT store.store_id,
+        earth_distance(
+            ll_to_earth(store.latitude, store.longitude),
+            ll_to_earth(:latitude, :longitude)
+        ) / 1000 AS distance
+    FROM store
+    WHERE earth_box(ll_to_earth(:latitude, :longitude), :radius * 1000)
+            @> ll_to_earth(store.latitude, store.longitude)
+        AND earth_distance(
+            ll_to_earth(store.latitude, store.longitude),
+            ll_to_earth(:latitude, :longitude)
+        ) < :radius * 1000
+    ORDER BY distance
+""")
+
+
+@dataclass
+class NearbyStores:
+    latitude: float
+    longitude: float
+    radius: float
+    store_ids: list
+    distances: list  # km, ascending
+    built_at: float = field(default_factory=time.monotonic)
+
+    def __post_init__(self):
+        self.distance_by_store = dict(zip(self.store_ids, self.distances))
+
+    def within(self, max_dist):
+        """
+        Store ids and distances of the stores closer than max_dist km.
+        """
+        end = bisect.bisect_left(self.distances, max_dist)
+        return self.store_ids[:end], self.distances[:end]
+
+    def distance_to(self, store_id):
+        return self.distance_by_store.get(store_id)
+
+
+def _build(conn, user_id, radius):
+    location = user_locations.get(conn, user_id)
+    rows = conn.execute(find_nearby_stores, {"latitude": location.latitude, "longitude": location.longitude,
+                                             "radius": radius}).all()
+    return NearbyStores(
+        latitude=location.latitude,
+        longitude=location.longitude,
+        radius=radius,
+        store_ids=[row.store_id for row in rows],
+        distances=[row.distance for row in rows],
+    )
+
+
+def get(conn, user_id, max_dist=MAX_RADIUS_KM):
+    """
+    Nearby stores for a user, built on first use. Raises NoResultFound when
+    the user does not exist. Ranges past MAX_RADIUS_KM are computed on the
+    spot and not cached.
+    """
+    if max_dist > MAX_RADIUS_KM:
+        return _build(conn, user_id, max_dist)
+
+    with _lock:
+        nearby = _cache.get(user_id)
+        if nearby is not None and time.monotonic() - nearby.built_at < TTL_SECONDS:
+            _cache.move_to_end(user_id)
+            return nearby
+
+    nearby = _build(conn, user_id, MAX_RADIUS_KM)
+    with _lock:
+        _cache[user_id] = nearby
+        _cache.move_to_end(user_id)
+        while len(_cache) > MAX_USERS:
+            _cache.popitem(last=False)
+    return nearby
+
+
+def invalidate_user(user_id):
+    """
+    Call after a user's latitude/longitude changes.
+    """
+    with _lock:
+        _cache.pop(user_id, None)
+
+
+def invalidate_stores():
+    """
+    Call after a store is added or moves. Any user's neighbourhood may have
+    changed, so every entry goes.
+    """
+    with _lock:
+        _cache.clear()
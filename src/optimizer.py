@@ -0,0 +1,134 @@
+"""
+Budget-constrained basket optimizer.
+
+Picks how many of each candidate item to buy so the basket stays within a
+budget in cents while maximising one nutrient, optionally subject to minimum
+totals of others. Each round is a bounded 0/1 knapsack: every item is split
+into binary quantity chunks (1, 2, 4, ...) and the DP over budget is one
+vectorized NumPy update per chunk. Minimum targets are handled by weighting
+the nutrients that fall short more heavily and solving again, for at most
+MAX_ROUNDS rounds or SOLVE_SECONDS.
+
+Solve time is bounded by MAX_ITEMS * log2(max_quantity) chunks times
+MAX_BUDGET_STEPS budget steps; larger budgets are bucketed, rounding every
+price up so the basket never goes over budget.
+"""
+import math
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+MAX_BUDGET_STEPS = 2000
+MAX_ITEMS = 400
+MAX_ROUNDS = 6
+SOLVE_SECONDS = 0.5
+
+
+@dataclass
+class Basket:
+    quantities: np.ndarray  # per candidate item, 0 for items left out
+    cost: int
+    totals: np.ndarray  # per nutrient
+    targets_met: bool
+
+
+def quantity_chunks(max_quantity):
+    """
+    Splits 0..max_quantity into binary chunks, e.g. 5 -> [1, 2, 2], so any
+    quantity up to max_quantity is a sum of a subset of them.
+    """
+    chunks = []
+    size = 1
+    while max_quantity > 0:
+        chunks.append(min(size, max_quantity))
+        max_quantity -= chunks[-1]
+        size *= 2
+    return chunks
+
+
+def knapsack(costs, values, capacity):
+    """
+    0/1 knapsack over integer costs. Returns a boolean mask of the chosen
+    entries maximising total value with total cost <= capacity.
+    """
+    best = np.zeros(capacity + 1)
+    taken = np.zeros((len(costs), capacity + 1), dtype=bool)
+    for i, (cost, value) in enumerate(zip(costs, values)):
+        if cost > capacity or value <= 0:
+            continue
+        candidate = best[:capacity + 1 - cost] + value
+        improved = candidate > best[cost:]
+        taken[i, cost:] = improved
+        best[cost:] = np.where(improved, candidate, best[cost:])
+
+    chosen = np.zeros(len(costs), dtype=bool)
+    remaining = capacity
+    for i in range(len(costs) - 1, -1, -1):
+        if taken[i, remaining]:
+            chosen[i] = True
+            remaining -= costs[i]
+    return chosen
+
+
+def solve(prices, nutrients, budget, objective, minimums=None, max_quantity=3):
+    """
+    prices: cents per item, shape (n,)
+    nutrients: amount of each nutrient per item, shape (n, m)
+    objective: column of nutrients to maximise
+    minimums: {column: minimum total} targets the basket should meet
+    """
+    prices = np.asarray(prices, dtype=np.int64)
+    nutrients = np.asarray(nutrients, dtype=np.float64)
+    minimums = minimums or {}
+    if len(prices) == 0:
+        # np.asarray([]) has no nutrient axis, so the shapes below don't apply
+        totals = np.zeros(max([objective, *minimums]) + 1)
+        return Basket(np.zeros(0, dtype=np.int64), 0, totals,
+                      all(minimum <= 0 for minimum in minimums.values()))
+    n, m = nutrients.shape
+
+    # Normalise every nutrient to its target (or its largest item for the
+    # objective) so the weights below are comparable across units.
+    scale = np.ones(m)
+    scale[objective] = max(nutrients[:, objective].max(initial=0), 1)
+    for column, minimum in minimums.items():
+        scale[column] = max(minimum, 1)
+    weights = np.zeros(m)
+    weights[objective] = 1
+    for column in minimums:
+        weights[column] = 1
+
+    candidates = np.flatnonzero((prices > 0) & (prices <= budget))
+    if len(candidates) > MAX_ITEMS:
+        density = (nutrients[candidates] / scale) @ weights / prices[candidates]
+        candidates = candidates[np.argsort(-density, kind="stable")[:MAX_ITEMS]]
+
+    bucket = max(1, math.ceil(budget / MAX_BUDGET_STEPS))
+    capacity = budget // bucket
+    chunks = quantity_chunks(max_quantity)
+    chunk_items = np.repeat(candidates, len(chunks))
+    chunk_sizes = np.tile(chunks, len(candidates))
+    chunk_costs = np.ceil(prices[chunk_items] * chunk_sizes / bucket).astype(np.int64)
+
+    best = None
+    deadline = time.monotonic() + SOLVE_SECONDS
+    for _ in range(MAX_ROUNDS):
+        values = (nutrients[chunk_items] / scale) @ weights * chunk_sizes
+        chosen = knapsack(chunk_costs, values, capacity)
+
+        quantities = np.zeros(n, dtype=np.int64)
+        np.add.at(quantities, chunk_items[chosen], chunk_sizes[chosen])
+        totals = quantities @ nutrients
+        short = [column for column, minimum in minimums.items() if totals[column] < minimum]
+        basket = Basket(quantities, int(quantities @ prices), totals, not short)
+
+        if best is None or (basket.targets_met, basket.totals[objective]) > (
+                best.targets_met, best.totals[objective]):
+            best = basket
+        if not short or time.monotonic() > deadline:
+            break
+        for column in short:
+            weights[column] *= 2
+
+    return best
@@ -0,0 +1,165 @@
+"""
+Maintenance of the price_history table and its daily rollups.
+
+Triggers on catalog_item append every price change to price_history, which
+is range-partitioned by month. A daemon thread in each API process runs
+maintain() every ROLLUP_SECONDS. It makes sure partitions exist for the
+coming months and rolls up price_history into price_history_daily, from
+the day of the last completed rollup (recorded in materialized_view_refresh)
+through today, so days missed while the job was down are filled in too. A
+day's rollup covers the price every catalog item had when the day began as
+well as the changes during it, so a food whose price held steady still has
+a price that day. The opening price is the old price of the item's first
+change since, or its current price. Carrying every item's price forward
+takes a pass over catalog_item, which happens once for each new day. The
+day the last rollup ran on is only redone for the foods that changed that
+day, reading their items through the food_id index. price_history is read
+from the start of that day on, which the BRIN index on changed_at narrows
+down to a few block ranges. Trend queries read the rollups only. An
+advisory lock lets only one process maintain at a time, and the partition
+and rollup steps fail independently.
+"""
+import logging
+import os
+import threading
+import time
+
+import sqlalchemy
+
+from src import metrics
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_SECONDS = int(os.environ.get("PRICE_ROLLUP_SECONDS", "300"))  # 0 disables the scheduler
+PARTITION_MONTHS_AHEAD = 3
+MAINTENANCE_LOCK = 44  # pg advisory lock key
+
+rollup_statement = sqlalchemy.text("""
+    WITH resume AS (
+        SELECT (SELECT (refreshed_at AT TIME ZONE 'UTC')::date FROM materialized_view_refresh
+                WHERE view_name = 'price_history_daily') AS last_day,
+            (now() AT TIME ZONE 'UTC')::date AS today
+    ),
+    -- Days after the last rollup have not been carried forward yet
+    days AS (
+        SELECT day::date AS day, day AT TIME ZONE 'UTC' AS day_start,
+            resume.last_day IS NULL OR day::date > resume.last_day AS carry_forward
+        FROM resume,
+            generate_series(COALESCE(resume.last_day, resume.today)::timestamp, resume.today::timestamp,
+                            interval '1 day') AS day
+    ),
+    changes AS (
+        SELECT catalog_item_id, food_id, changed_at, old_price, price,
+            (changed_at AT TIME ZONE 'UTC')::date AS day
+        FROM price_history
+        WHERE changed_at >= (SELECT MIN(day_start) FROM days)
+    ),
+    first_changes AS (
+        SELECT DISTINCT ON (days.day, changes.catalog_item_id)
+            days.day, changes.catalog_item_id, changes.old_price
+        FROM days
+        JOIN changes ON changes.changed_at >= days.day_start
+        ORDER BY days.day, changes.catalog_item_id, changes.changed_at
+    ),
+    -- Every item on a new day, only the items of foods that changed on a
+    -- day that was already carried forward
+    opening_items AS (
+        SELECT days.day, catalog_item.catalog_item_id, catalog_item.food_id, catalog_item.price
+        FROM days
+        CROSS JOIN catalog_item
+        WHERE days.carry_forward AND catalog_item.food_id IS NOT NULL
+        UNION ALL
+        SELECT days.day, catalog_item.catalog_item_id, catalog_item.food_id, catalog_item.price
+        FROM days
+        JOIN (SELECT DISTINCT day, food_id FROM changes) AS changed_foods ON changed_foods.day = days.day
+        JOIN catalog_item ON catalog_item.food_id = changed_foods.food_id
+        WHERE NOT days.carry_forward
+    ),
+    -- An item added since the day began had no price yet, its first
+    -- change has no old price
+    opening AS (
+        SELECT opening_items.day, opening_items.food_id,
+            CASE WHEN first_changes.catalog_item_id IS NULL THEN opening_items.price
+                 ELSE first_changes.old_price END AS price
+        FROM opening_items
+        LEFT JOIN first_changes ON first_changes.day = opening_items.day
+            AND first_changes.catalog_item_id = opening_items.catalog_item_id
+    ),
+    listed AS (
+        SELECT day, food_id, price, 0 AS changed FROM opening WHERE price IS NOT NULL
+        UNION ALL
+        SELECT day, food_id, price, 1 FROM changes
+    )
+    INSERT INTO price_history_daily (food_id, day, min_price, max_price, price_sum, price_count, change_count)
+    SELECT food_id, day, MIN(price), MAX(price), SUM(price), COUNT(*), SUM(changed)
+    FROM listed
+    GROUP BY food_id, day
+    ON CONFLICT (food_id, day) DO UPDATE
+    SET min_price = EXCLUDED.min_price, max_price = EXCLUDED.max_price,
+        price_sum = EXCLUDED.price_sum, price_count = EXCLUDED.price_count,
+        change_count = EXCLUDED.change_count
+    """)
+
+
+def maintain(engine):
+    """
+    Creates upcoming partitions and rolls up every day since the last
+    rollup, unless another process is already doing so. Returns the number
+    of rolled up (food, day) rows, or None when skipped.
+    """
+    # Each statement commits on its own, so adding a partition (which briefly
+    # locks price_history against the triggers' inserts) is not held open
+    # for the length of the rollup
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if not conn.execute(sqlalchemy.text("SELECT pg_try_advisory_lock(:key)"),
+                            {"key": MAINTENANCE_LOCK}).scalar_one():
+            return None
+        try:
+            # A failed partition step must not hold up the rollup, the
+            # default partition keeps taking rows meanwhile
+            try:
+                conn.execute(sqlalchemy.text("SELECT create_price_history_partitions(:months)"),
+                             {"months": PARTITION_MONTHS_AHEAD})
+            except Exception as e:
+                conn.rollback()
+                logger.exception(f"Creating price history partitions failed: {e}")
+            # Only recorded once the rollup succeeded, so a failed run is
+            # picked up again from the same day
+            started_at = conn.execute(sqlalchemy.text("SELECT now()")).scalar_one()
+            start = time.monotonic()
+            rolled_up = conn.execute(rollup_statement).rowcount
+            duration_ms = int((time.monotonic() - start) * 1000)
+            conn.execute(sqlalchemy.text("""
+                INSERT INTO materialized_view_refresh (view_name, refreshed_at, duration_ms)
+                VALUES ('price_history_daily', :refreshed_at, :duration_ms)
+                ON CONFLICT (view_name) DO UPDATE
+                SET refreshed_at = EXCLUDED.refreshed_at, duration_ms = EXCLUDED.duration_ms
+                """), {"refreshed_at": started_at, "duration_ms": duration_ms})
+        finally:
+            conn.execute(sqlalchemy.text("SELECT pg_advisory_unlock(:key)"), {"key": MAINTENANCE_LOCK})
+    metrics.increment("price_rollups", "price_history")
+    logger.info(f"Rolled up {rolled_up} daily price rows in {duration_ms}ms")
+    return rolled_up
+
+
+def _run(engine):
+    while True:
+        try:
+            maintain(engine)
+        except Exception as e:
+            logger.exception(f"Price history maintenance failed: {e}")
+        time.sleep(ROLLUP_SECONDS)
+
+
+_scheduler = None
+
+
+def start_scheduler(engine):
+    """
+    Starts the maintenance thread once per process.
+    """
+    global _scheduler
+    if ROLLUP_SECONDS <= 0 or _scheduler is not None:
+        return
+    _scheduler = threading.Thread(target=_run, args=(engine,), name="price-history", daemon=True)
+    _scheduler.start()
@@ -0,0 +1,143 @@
+"""
+Retention job for shopping lists nobody has touched in a while.
+
+Moves lists (and their items) whose updated_at is older than --days into
+shopping_list_archive / shopping_list_item_archive, or deletes them outright
+with --delete. Work happens in chunks of --batch-size lists, each its own
+short transaction, with a pause in between so WAL is written at a steady
+trickle and replicas and autovacuum keep up. Chunks lock their lists with
+SKIP LOCKED, so a list a user is editing right now is simply left for the
+next run instead of blocking either side.
+
+Usage, from the repository root:
+    python -m src.retention --days 180
+    python -m src.retention --days 365 --delete --batch-size 200 --pause 0.5
+"""
+import argparse
+import logging
+import sys
+import time
+
+import sqlalchemy
+
+from src import database as db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_PAUSE_SECONDS = 0.2
+
+
+def chunk_statement(archive):
+    """
+    One chunk: pick the stalest unlocked lists, remove their items and then
+    the lists, optionally copying both into the archive tables.
+    """
+    return sqlalchemy.text(f"""
+        WITH stale AS (
+            SELECT list_id, user_id
+            FROM shopping_list
+            WHERE updated_at < :cutoff
+            ORDER BY updated_at
+            LIMIT :batch_size
+            FOR UPDATE SKIP LOCKED
+        ),
+        removed_items AS (
+            DELETE FROM shopping_list_item
+            USING stale
+            WHERE shopping_list_item.list_id = stale.list_id
+              AND shopping_list_item.user_id = stale.user_id
+            RETURNING shopping_list_item.list_id, shopping_list_item.food_id,
+                      shopping_list_item.user_id, shopping_list_item.quantity
+        ),
+        removed_lists AS (
+            DELETE FROM shopping_list
+            USING stale
+            WHERE shopping_list.list_id = stale.list_id
+            RETURNING shopping_list.list_id, shopping_list.name,
+                      shopping_list.user_id, shopping_list.updated_at
+        ){''',
+        archived_items AS (
+            INSERT INTO shopping_list_item_archive (list_id, food_id, user_id, quantity)
+            SELECT list_id, food_id, user_id, quantity FROM removed_items
+            ON CONFLICT DO NOTHING
+        ),
+        archived_lists AS (
+            INSERT INTO shopping_list_archive (list_id, name, user_id, updated_at)
+            SELECT list_id, name, user_id, updated_at FROM removed_lists
+            ON CONFLICT DO NOTHING
+        )''' if archive else ""}
+        SELECT (SELECT COUNT(*) FROM removed_lists) AS lists,
+               (SELECT COUNT(*) FROM removed_items) AS items
+    """)
+
+
+def run(engine, days, archive=True, batch_size=DEFAULT_BATCH_SIZE,
+        pause=DEFAULT_PAUSE_SECONDS, dry_run=False):
+    """
+    Processes every list untouched for `days` days as of the start of the
+    run. Returns (lists, items) removed.
+    """
+    with engine.begin() as conn:
+        cutoff = conn.execute(sqlalchemy.text("""
+            SELECT now() - make_interval(days => :days)
+            """), {"days": days}).scalar_one()
+        total = conn.execute(sqlalchemy.text("""
+            SELECT COUNT(*) FROM shopping_list WHERE updated_at < :cutoff
+            """), {"cutoff": cutoff}).scalar_one()
+
+    action = "archive" if archive else "delete"
+    logger.info(f"{total} lists untouched since {cutoff:%Y-%m-%d} to {action}")
+    if dry_run or total == 0:
+        return 0, 0
+
+    statement = chunk_statement(archive)
+    lists_done = items_done = 0
+    started = time.monotonic()
+    while True:
+        with engine.begin() as conn:
+            # Losing the last chunk in a crash just means redoing it, so
+            # don't wait for each commit to be flushed
+            conn.execute(sqlalchemy.text("SET LOCAL synchronous_commit = off"))
+            conn.execute(sqlalchemy.text("SET LOCAL lock_timeout = '2s'"))
+            chunk = conn.execute(statement, {"cutoff": cutoff, "batch_size": batch_size}).one()
+
+        if chunk.lists == 0:
+            break
+        lists_done += chunk.lists
+        items_done += chunk.items
+
+        elapsed = time.monotonic() - started
+        rate = lists_done / elapsed if elapsed else 0
+        remaining = max(total - lists_done, 0)
+        eta = f"{remaining / rate:.0f}s" if rate else "?"
+        logger.info(f"{lists_done}/{total} lists ({100 * lists_done / total:.1f}%), "
+                    f"{items_done} items, {rate:.0f} lists/s, ETA {eta}")
+        time.sleep(pause)
+
+    logger.info(f"Done: {action}d {lists_done} lists and {items_done} items "
+                f"in {time.monotonic() - started:.1f}s")
+    return lists_done, items_done
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive or delete stale shopping lists in small batches")
+    parser.add_argument("--days", type=int, required=True,
+                        help="Remove lists whose items have not changed for this many days")
+    parser.add_argument("--delete", action="store_true",
+                        help="Delete instead of moving into the archive tables")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Lists per transaction, smaller means shorter locks")
+    parser.add_argument("--pause", type=float, default=DEFAULT_PAUSE_SECONDS,
+                        help="Seconds to sleep between batches")
+    parser.add_argument("--dry-run", action="store_true", help="Only count the lists that would be removed")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s",
+                        handlers=[logging.StreamHandler(sys.stdout)])
+    run(db.engine, args.days, archive=not args.delete, batch_size=args.batch_size,
+        pause=args.pause, dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Coalescing of identical concurrent reads.
+
+When the same read (same route, same parameters) is already running, later
+callers wait for it and get its result, or its exception, instead of
+running the same SQL again. Nothing is cached: once the first call returns,
+the next identical request executes again. Metrics count executions and
+the waiters that shared one, per route.
+"""
+import functools
+import threading
+
+from src import deadline, metrics
+
+_calls = {}
+_lock = threading.Lock()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.leader_timed_out = False
+
+
+def do(key, fn):
+    """
+    Runs fn() unless a call with the same key is in flight, in which case
+    waits for that one. key[0] is the route name used in metrics.
+
+    The shared call runs under the leader's deadline, which the leader's
+    client may have shortened. When that deadline ends it, waiters whose
+    own deadline is still live run fn() again rather than failing with it,
+    and the others fail with their own deadline expired, so they get a 503.
+    Waiters never wait past their own deadline either, so a leader stuck
+    somewhere its deadline does not reach cannot hang them with it.
+    """
+    while True:
+        with _lock:
+            call = _calls.get(key)
+            leader = call is None
+            if leader:
+                call = _calls[key] = _Call()
+
+        if not leader:
+            mine = deadline.current()
+            if not call.done.wait(None if mine is None else max(mine.remaining_ms(), 0) / 1000):
+                mine.expired = True
+                raise deadline.DeadlineExceeded(f"{mine.budget_ms}ms deadline passed waiting for {key[0]}")
+            metrics.increment("singleflight_shared", key[0])
+            if call.error is None:
+                return call.result
+            if not call.leader_timed_out:
+                raise call.error
+            if mine is None or mine.remaining_ms() >= deadline.MIN_TIMEOUT_MS:
+                metrics.increment("singleflight_retried", key[0])
+                continue
+            mine.expired = True
+            raise deadline.DeadlineExceeded(f"{mine.budget_ms}ms deadline passed")
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            mine = deadline.current()
+            call.leader_timed_out = mine is not None and mine.expired
+            raise
+        finally:
+            with _lock:
+                del _calls[key]
+            call.done.set()
+            metrics.increment("singleflight_executions", key[0])
+
+
+def normalize(value):
+    return value if isinstance(value, (int, float, str, bool, type(None))) else repr(value)
+
+
+def coalesce(route):
+    """
+    Decorator for read-only endpoints, keyed by route and the endpoint's
+    parameters. The wrapper keeps the endpoint's signature, so FastAPI still
+    sees the original parameters.
+    """
+    def decorator(endpoint):
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            key = (route, tuple(normalize(arg) for arg in args),
+                   tuple(sorted((name, normalize(value)) for name, value in kwargs.items())))
+            return do(key, lambda: endpoint(*args, **kwargs))
+        return wrapper
+    return decorator
@@ -0,0 +1,124 @@
+"""
+Precomputed opening hours of every store, for "open now / open at" filters.
+
+store.open_time/close_time are read as times of day (their dates are
+ignored) and turned into a sorted list of boundaries over the 1440 minutes of
+a day. Between two boundaries the set of open stores doesn't change, so
+finding the stores open at a given time is one bisect. Hours that close
+before they open wrap past midnight. Stores with missing or equal open/close
+times count as always open.
+
+Store hours are wall-clock times in STORE_TIMEZONE, so every time is
+converted to that zone before it is looked up. An open_at without a zone
+is taken to be in it already.
+
+The structure is rebuilt on the first lookup after invalidate() or once it
+is older than REFRESH_SECONDS, which bounds how long hours changed outside
+this process go unnoticed.
+"""
+import bisect
+import os
+import threading
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import sqlalchemy
+
+MINUTES_PER_DAY = 24 * 60
+REFRESH_SECONDS = 300
+STORE_TIMEZONE = ZoneInfo(os.environ.get("STORE_TIMEZONE", "America/Los_Angeles"))
+
+_lock = threading.Lock()
+_boundaries = None   # sorted minute-of-day where the open set changes
+_open_sets = None    # frozenset of open store ids from each boundary on
+_loaded_at = 0.0
+_invalidated = False
+
+
+def _minute_of_day(moment):
+    return moment.hour * 60 + moment.minute
+
+
+def _intervals(open_time, close_time):
+    if open_time is None or close_time is None:
+        return [(0, MINUTES_PER_DAY)]
+    start, end = _minute_of_day(open_time), _minute_of_day(close_time)
+    if start == end:
+        return [(0, MINUTES_PER_DAY)]
+    if start < end:
+        return [(start, end)]
+    return [(start, MINUTES_PER_DAY), (0, end)]
+
+
+def _build(rows):
+    intervals = [(row.store_id, start, end)
+                 for row in rows
+                 for start, end in _intervals(row.open_time, row.close_time)]
+
+    boundaries = sorted({0} | {start for _, start, _ in intervals}
+                        | {end for _, _, end in intervals if end < MINUTES_PER_DAY})
+    open_sets = [
+        frozenset(store_id for store_id, start, end in intervals if start <= boundary < end)
+        for boundary in boundaries
+    ]
+    return boundaries, open_sets
+
+
+def refresh(conn):
+    global _boundaries, _open_sets, _loaded_at, _invalidated
+
+    # Cleared before reading, so an invalidate() racing the read still
+    # forces the next lookup to refresh
+    with _lock:
+        _invalidated = False
+    rows = conn.execute(sqlalchemy.text("""
+        SELECT store_id, open_time, close_time
+        FROM store
+        """)).all()
+    boundaries, open_sets = _build(rows)
+    with _lock:
+        _boundaries, _open_sets = boundaries, open_sets
+        _loaded_at = time.monotonic()
+
+
+def invalidate():
+    """
+    Call after a store's hours change or a store is added.
+    """
+    global _invalidated
+    with _lock:
+        _invalidated = True
+
+
+def open_store_ids(conn, at):
+    """
+    Ids of the stores open at the given datetime.
+    """
+    if _boundaries is None or _invalidated or time.monotonic() - _loaded_at > REFRESH_SECONDS:
+        refresh(conn)
+
+    with _lock:
+        boundaries, open_sets = _boundaries, _open_sets
+    return open_sets[bisect.bisect_right(boundaries, _minute_of_day(store_time(at))) - 1]
+
+
+def store_time(at):
+    """
+    at as a wall-clock time in STORE_TIMEZONE.
+    """
+    if at.tzinfo is None:
+        return at.replace(tzinfo=STORE_TIMEZONE)
+    return at.astimezone(STORE_TIMEZONE)
+
+
+def requested_time(open_now, open_at):
+    """
+    The time an endpoint should filter on: open_at if given, the current
+    time if open_now, otherwise None for no filtering.
+    """
+    if open_at is not None:
+        return store_time(open_at)
+    if open_now:
+        return datetime.now(STORE_TIMEZONE)
+    return None
@@ -0,0 +1,114 @@
+"""
+Retries for transactions that lose a concurrency conflict.
+
+Serialization failures (REPEATABLE READ / SERIALIZABLE update conflicts, and
+replica queries cancelled by recovery) and deadlocks are safe to retry from
+the top, since the failed transaction rolled back everything it did. The
+retry_on_conflict decorator reruns an endpoint when one of its statements
+failed that way, whatever the endpoint turned the error into, with jittered
+exponential backoff. Retries are capped per request by MAX_ATTEMPTS and the
+request's deadline, and across the process by a retry budget so a conflict
+storm is not multiplied by retries. Once out of attempts the client gets a
+409 instead of a 500.
+"""
+import contextvars
+import functools
+import logging
+import random
+import threading
+import time
+
+from fastapi import HTTPException, status
+from sqlalchemy import event
+
+from src import deadline, metrics
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 4
+BASE_BACKOFF_SECONDS = 0.01
+RETRYABLE = {
+    "40001",  # serialization_failure
+    "40P01",  # deadlock_detected
+}
+
+# Every request adds RETRY_BUDGET_RATIO tokens (up to RETRY_BUDGET_MAX) and
+# every retry spends one, so retries stay a fraction of overall traffic.
+RETRY_BUDGET_RATIO = 0.2
+RETRY_BUDGET_MAX = 20.0
+
+_retry_tokens = RETRY_BUDGET_MAX
+_budget_lock = threading.Lock()
+
+
+class _Attempt:
+    def __init__(self):
+        self.conflict = False
+
+
+_attempt = contextvars.ContextVar("transaction_attempt", default=None)
+
+
+def install(engine):
+    """
+    Flags the running attempt when a statement fails with a retryable error.
+    """
+    @event.listens_for(engine, "handle_error")
+    def mark_conflict(context):
+        attempt = _attempt.get()
+        if attempt is not None and getattr(context.original_exception, "pgcode", None) in RETRYABLE:
+            attempt.conflict = True
+
+
+def _deposit():
+    global _retry_tokens
+    with _budget_lock:
+        _retry_tokens = min(_retry_tokens + RETRY_BUDGET_RATIO, RETRY_BUDGET_MAX)
+
+
+def _withdraw():
+    global _retry_tokens
+    with _budget_lock:
+        if _retry_tokens < 1:
+            return False
+        _retry_tokens -= 1
+        return True
+
+
+def backoff_seconds(attempt_number):
+    return BASE_BACKOFF_SECONDS * 2 ** (attempt_number - 1) * random.uniform(0.5, 1.5)
+
+
+def retry_on_conflict(endpoint):
+    """
+    Decorator for endpoints, retries are counted in /metrics under the
+    endpoint's name.
+    """
+    route = endpoint.__name__
+
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        _deposit()
+        for attempt_number in range(1, MAX_ATTEMPTS + 1):
+            attempt = _Attempt()
+            token = _attempt.set(attempt)
+            try:
+                return endpoint(*args, **kwargs)
+            except Exception:
+                if not attempt.conflict:
+                    raise
+                wait = backoff_seconds(attempt_number)
+                current = deadline.current()
+                out_of_time = current is not None and current.remaining_ms() < wait * 1000
+                if attempt_number == MAX_ATTEMPTS or out_of_time or not _withdraw():
+                    metrics.increment("transaction_conflicts_failed", route)
+                    logger.warning(f"{route} gave up after {attempt_number} conflicting attempt(s)")
+                    raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                        detail="Too many concurrent changes, try again.")
+            finally:
+                _attempt.reset(token)
+
+            metrics.increment("transaction_retries", route)
+            time.sleep(wait)
+
+    return wrapper
@@ -0,0 +1,77 @@
+"""
+Per-process LRU cache of user coordinates, including users that do not exist.
+
+Every routing request starts from its user's latitude and longitude, and
+nearby_stores rebuilds its entries (on expiry, or for everyone once a store
+moves) from them too. Coordinates change only through
+PUT /users/{user_id}/location, which invalidates the entry, so they are
+kept for TTL_SECONDS. That TTL bounds how long a move made through another
+worker goes unnoticed. A missing user is remembered for the shorter
+MISSING_TTL_SECONDS, so repeated requests for a bad user_id do not reach
+the database either, while a user created through another worker shows up
+soon. create_user drops the entry for the new id right away.
+"""
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import sqlalchemy
+from sqlalchemy.exc import NoResultFound
+
+from src import metrics
+
+MAX_USERS = 50000
+TTL_SECONDS = 300
+MISSING_TTL_SECONDS = 30
+
+_cache = OrderedDict()  # user_id -> (Location or None when missing, cached_at)
+_lock = threading.Lock()
+
+find_location = sqlalchemy.text("""
+    SELECT latitude, longitude FROM users WHERE user_id = :user_id
+""")
+
+
+@dataclass(frozen=True)
+class Location:
+    latitude: float
+    longitude: float
+
+
+def get(conn, user_id):
+    """
+    The user's Location. Raises NoResultFound when the user does not exist.
+    """
+    now = time.monotonic()
+    with _lock:
+        entry = _cache.get(user_id)
+        if entry is not None:
+            location, cached_at = entry
+            if now - cached_at < (TTL_SECONDS if location is not None else MISSING_TTL_SECONDS):
+                _cache.move_to_end(user_id)
+                metrics.increment("user_location_hits", "user_locations")
+                if location is None:
+                    raise NoResultFound("User does not exist.")
+                return location
+
+    row = conn.execute(find_location, {"user_id": user_id}).one_or_none()
+    location = None if row is None else Location(row.latitude, row.longitude)
+    with _lock:
+        _cache[user_id] = (location, now)
+        _cache.move_to_end(user_id)
+        while len(_cache) > MAX_USERS:
+            _cache.popitem(last=False)
+    metrics.increment("user_location_misses", "user_locations")
+
+    if location is None:
+        raise NoResultFound("User does not exist.")
+    return location
+
+
+def invalidate(user_id):
+    """
+    Call after a user is created or their latitude/longitude changes.
+    """
+    with _lock:
+        _cache.pop(user_id, None)
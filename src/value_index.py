@@ -0,0 +1,247 @@
+"""
+Precomputed rankings of catalog items by cost per nutrient.
+
+The catalog itself is the memory-mapped snapshot from catalog_snapshot, so
+worker processes share one copy of it. For each metric (cents per gram of
+protein, per calorie, per serving) the snapshot rows with a price and a
+non-zero amount of that nutrient are argsorted by their ratio once per
+snapshot, so top-k is a walk from the front instead of computing and sorting
+every ratio per request. Each ranking is also split by store, so top() for
+a user's nearby stores only walks their items. update_prices() keeps items
+re-priced since the snapshot was taken in a small sorted overlay per metric
+that top() merges in.
+
+update_prices() only reaches the process that handled the change. Every
+other process picks it up from price_history, which the catalog_item
+triggers append to in the same transaction: at most every SYNC_SECONDS a
+read replays the changes since the last one into the overlay. Items added
+through another process show up the same way, since they are unknown to
+the snapshot and force a new one. Removed items and nutrient changes are
+only picked up by the next snapshot. A new snapshot is written after
+invalidate() or once older than REFRESH_SECONDS, and every process moves
+to the newest snapshot on its next read.
+"""
+import bisect
+import heapq
+import itertools
+import logging
+import threading
+import time
+from dataclasses import dataclass
+
+import numpy as np
+import sqlalchemy
+
+from src import catalog_snapshot, metrics
+
+logger = logging.getLogger(__name__)
+
+REFRESH_SECONDS = 600
+SYNC_SECONDS = 1.0  # how often a process replays price changes made by the others
+# Re-read this much before the last change seen, a transaction that started
+# earlier may commit after it. Replaying a change twice is harmless.
+SYNC_OVERLAP_SECONDS = 10.0
+CHUNK = 256  # ranked rows filtered per numpy call in top()
+
+price_changes_statement = sqlalchemy.text("""
+    SELECT catalog_item_id, price, extract(epoch FROM changed_at) AS changed_at
+    FROM price_history
+    WHERE changed_at > to_timestamp(:since)
+    ORDER BY changed_at
+    """)
+
+# metric -> food_item column the price is divided by
+METRICS = {
+    "protein": "protein",
+    "calories": "calories",
+    "serving": "serving_size",
+}
+
+
+@dataclass
+class Offer:
+    catalog_item_id: int
+    food_id: int
+    store_id: int
+    price: int
+
+
+class ValueIndex:
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        rows = snapshot.rows
+        self.rankings = {}
+        self.by_store = {}  # metric -> store_id -> positions in the ranking, ascending
+        for metric, column in METRICS.items():
+            amounts = rows[column]
+            # NaN (unknown) amounts compare false, so they drop out here
+            ranked = np.flatnonzero((rows["price"] != catalog_snapshot.MISSING) & (amounts > 0))
+            ratios = rows["price"][ranked] / amounts[ranked]
+            # Rows are in catalog_item_id order, a stable sort keeps ties that way
+            self.rankings[metric] = ranked[np.argsort(ratios, kind="stable")].astype(np.int32)
+            stores = rows["store_id"][self.rankings[metric]]
+            order = np.argsort(stores, kind="stable")
+            groups = np.split(order, np.flatnonzero(np.diff(stores[order])) + 1)
+            self.by_store[metric] = {int(stores[group[0]]): group.astype(np.int32)
+                                     for group in groups if len(group)}
+        self.repriced = {}  # catalog_item_id -> (Offer, time.time() of the change)
+        self.overlay = {metric: [] for metric in METRICS}  # sorted (ratio, catalog_item_id, Offer)
+        self.lock = threading.Lock()
+        self.synced_to = snapshot.taken_at  # changed_at of the last price change replayed
+        self.synced_at = time.monotonic()
+
+    def _ranked_rows(self, metric, store_ids, skip_ids):
+        rows = self.snapshot.rows
+        column = METRICS[metric]
+        ranking = self.rankings[metric]
+        if store_ids is not None:
+            by_store = self.by_store[metric]
+            positions = [by_store[store_id] for store_id in store_ids if store_id in by_store]
+            ranking = ranking[np.sort(np.concatenate(positions))] if positions else ranking[:0]
+        for start in range(0, len(ranking), CHUNK):
+            chunk = rows[ranking[start:start + CHUNK]]
+            keep = ~np.isin(chunk["catalog_item_id"], skip_ids)
+            for row in chunk[keep]:
+                offer = Offer(catalog_item_id=int(row["catalog_item_id"]), food_id=int(row["food_id"]),
+                              store_id=int(row["store_id"]), price=int(row["price"]))
+                yield offer.price / float(row[column]), offer
+
+    def top(self, metric, k, store_ids=None):
+        """
+        The k offers with the lowest cents per unit of the metric, optionally
+        only at the given stores, as (cents_per_unit, Offer) pairs.
+        """
+        with self.lock:
+            skip_ids = np.fromiter(self.repriced, dtype=np.int64, count=len(self.repriced))
+            overlay = [(ratio, offer) for ratio, _, offer in self.overlay[metric]
+                       if store_ids is None or offer.store_id in store_ids]
+        ranked = heapq.merge(self._ranked_rows(metric, store_ids, skip_ids), overlay,
+                             key=lambda pair: pair[0])
+        return list(itertools.islice(ranked, k))
+
+    def update_price(self, catalog_item_id, price, changed_at=None):
+        rows = self.snapshot.rows
+        position = np.searchsorted(rows["catalog_item_id"], catalog_item_id)
+        if position == len(rows) or rows["catalog_item_id"][position] != catalog_item_id:
+            return False
+        row = rows[position]
+        offer = Offer(catalog_item_id=catalog_item_id, food_id=int(row["food_id"]),
+                      store_id=int(row["store_id"]), price=price)
+        with self.lock:
+            previous = self.repriced.get(catalog_item_id)
+            for metric, column in METRICS.items():
+                amount = float(row[column])
+                if not amount > 0:
+                    continue
+                overlay = self.overlay[metric]
+                if previous is not None:
+                    old_key = (previous[0].price / amount, catalog_item_id)
+                    i = bisect.bisect_left(overlay, old_key)
+                    if i < len(overlay) and overlay[i][:2] == old_key:
+                        del overlay[i]
+                bisect.insort(overlay, (price / amount, catalog_item_id, offer))
+            self.repriced[catalog_item_id] = (offer, changed_at or time.time())
+        return True
+
+    def sync(self, engine):
+        """
+        Replays price changes other processes made since the last sync.
+        """
+        with engine.begin() as conn:
+            changes = conn.execute(price_changes_statement,
+                                   {"since": self.synced_to - SYNC_OVERLAP_SECONDS}).all()
+        for change in changes:
+            if not self.update_price(change.catalog_item_id, change.price, float(change.changed_at)):
+                invalidate()
+        if changes:
+            self.synced_to = max(self.synced_to, float(changes[-1].changed_at))
+        self.synced_at = time.monotonic()
+
+
+_index = None
+_refresh_lock = threading.Lock()
+_invalidated_at = 0.0
+
+
+def _switch(snapshot):
+    """
+    Ranks a newly mapped snapshot, carrying over price changes it predates.
+    """
+    global _index
+    index = ValueIndex(snapshot)
+    if _index is not None:
+        with _index.lock:
+            repriced = list(_index.repriced.values())
+        for offer, changed_at in repriced:
+            if changed_at > snapshot.taken_at:
+                index.update_price(offer.catalog_item_id, offer.price, changed_at)
+    _index = index
+
+
+def refresh(engine, wait=True):
+    newer_than = max(time.time() - REFRESH_SECONDS, _invalidated_at)
+    snapshot = catalog_snapshot.load(engine, newer_than, wait=wait)
+    if snapshot is not None:
+        _switch(snapshot)
+
+
+def invalidate():
+    """
+    Call after catalog items are added or removed, or food nutrients change.
+    """
+    global _invalidated_at
+    _invalidated_at = time.time()
+
+
+def update_prices(changes):
+    """
+    Moves re-priced catalog items to their new rank. Takes
+    (catalog_item_id, price) pairs; unknown items force a rebuild.
+    """
+    if _index is None:
+        return
+    for catalog_item_id, price in changes:
+        if not _index.update_price(catalog_item_id, price):
+            invalidate()
+
+
+def current(engine):
+    """
+    The loaded rankings, building them first if there are none. Only one
+    thread per process reloads a stale snapshot, and it does not wait for
+    another process that is already rebuilding it, while the others keep
+    reading the old one.
+    """
+    index = _index
+    if index is None:
+        with _refresh_lock:
+            if _index is None:
+                refresh(engine)
+    elif (not index.snapshot.is_current() or index.snapshot.taken_at < _invalidated_at
+          or index.snapshot.age_seconds() > REFRESH_SECONDS):
+        if _refresh_lock.acquire(blocking=False):
+            try:
+                refresh(engine, wait=False)
+            finally:
+                _refresh_lock.release()
+    elif time.monotonic() - index.synced_at > SYNC_SECONDS:
+        if _refresh_lock.acquire(blocking=False):
+            try:
+                index.sync(engine)
+            except Exception as e:
+                # Serve the overlay as it is, the next read tries again
+                logger.warning(f"Syncing price changes failed: {e}")
+            finally:
+                _refresh_lock.release()
+    return _index
+
+
+def _metrics():
+    index = _index
+    if index is None:
+        return {"items": None, "bytes": None, "age_seconds": None}
+    return {"items": len(index.snapshot.rows), "bytes": index.snapshot.rows.nbytes,
+            "age_seconds": index.snapshot.age_seconds()}
+
+
+metrics.gauge("catalog_snapshot", _metrics)
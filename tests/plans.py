@@ -0,0 +1,103 @@
+"""
+Helpers for turning EXPLAIN (FORMAT JSON) output into something tests can
+assert on and a human can read in a diff.
+"""
+import difflib
+
+PLANNABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+
+def is_plannable(statement):
+    return statement.lstrip().upper().startswith(PLANNABLE)
+
+
+def explain(conn, statement, parameters):
+    """
+    Runs EXPLAIN (ANALYZE, BUFFERS) for one captured statement inside a
+    savepoint that is always rolled back, so DML is safe to analyze.
+    Returns the top-level plan dictionary.
+    """
+    savepoint = conn.begin_nested()
+    try:
+        result = conn.exec_driver_sql(
+            "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement,
+            parameters or {}).scalar_one()
+    finally:
+        savepoint.rollback()
+    return result[0]
+
+
+def walk(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from walk(child)
+
+
+def describe(node):
+    description = node["Node Type"]
+    if "Relation Name" in node:
+        description += f" on {node['Relation Name']}"
+    if "Index Name" in node:
+        description += f" using {node['Index Name']}"
+    return description
+
+
+def shape(plan):
+    """
+    Plan tree as indented node descriptions, without costs or timings, so it
+    only changes when the planner picks a different strategy.
+    """
+    lines = []
+
+    def visit(node, depth):
+        lines.append("  " * depth + "-> " + describe(node))
+        for child in node.get("Plans", []):
+            visit(child, depth + 1)
+
+    visit(plan["Plan"], 0)
+    return lines
+
+
+def render(plan):
+    """
+    Plan tree with actual rows and times, for failure messages.
+    """
+    lines = []
+
+    def visit(node, depth):
+        lines.append("  " * depth + "-> " + describe(node)
+                     + f"  (rows={node.get('Actual Rows')} loops={node.get('Actual Loops')}"
+                     + f" time={node.get('Actual Total Time')}ms)")
+        for child in node.get("Plans", []):
+            visit(child, depth + 1)
+
+    visit(plan["Plan"], 0)
+    lines.append(f"Execution Time: {plan.get('Execution Time')} ms")
+    return "\n".join(lines)
+
+
+def seq_scanned_relations(plan):
+    return {node["Relation Name"] for node in walk(plan["Plan"])
+            if node["Node Type"] == "Seq Scan"}
+
+
+def indexes_used(plan):
+    return {node["Index Name"] for node in walk(plan["Plan"]) if "Index Name" in node}
+
+
+def rows_scanned(plan):
+    """
+    Heap/index rows a plan touched: rows returned plus rows thrown away by
+    filters, over every loop of every scan node.
+    """
+    total = 0
+    for node in walk(plan["Plan"]):
+        if "Scan" in node["Node Type"]:
+            loops = node.get("Actual Loops", 1)
+            total += (node.get("Actual Rows", 0) + node.get("Rows Removed by Filter", 0)) * loops
+    return total
+
+
+def diff(expected, actual, name):
+    return "\n".join(difflib.unified_diff(
+        expected, actual, fromfile=f"{name} (expected)", tofile=f"{name} (actual)", lineterm=""))
@@ -0,0 +1,93 @@
+"""
+performance/partition_shopping_list_item.sql against lists that predate it.
+
+The migration runs in a scratch database created next to the test database,
+so the seeded dataset the other tests share keeps its layout. Needs psql on
+PATH, since the script uses psql's \\if and \\gexec.
+"""
+import os
+import shutil
+import subprocess
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from tests.conftest import REPO_ROOT, SCHEMA_SQL
+
+MIGRATION_SQL = os.path.join(REPO_ROOT, "performance", "partition_shopping_list_item.sql")
+
+
+@pytest.fixture
+def migrated_db(db_engine):
+    """
+    A scratch database with schema.sql, two lists with items, then the
+    partitioning migration. Yields (engine, [list_id, list_id]).
+    """
+    if shutil.which("psql") is None:
+        pytest.skip("psql is not on PATH")
+    import sqlalchemy
+    generate_data = pytest.importorskip("generate_data")
+
+    name = f"{db_engine.url.database}_partition_migration"
+    url = db_engine.url.set(database=name)
+    with db_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql(f'DROP DATABASE IF EXISTS "{name}"')
+        conn.exec_driver_sql(f'CREATE DATABASE "{name}"')
+
+    engine = sqlalchemy.create_engine(url)
+    try:
+        with engine.begin() as conn:
+            generate_data.reset_tables(conn, SCHEMA_SQL)
+            user_id = conn.execute(sqlalchemy.text("""
+                INSERT INTO users (name) VALUES ('partition_test') RETURNING user_id
+                """)).scalar_one()
+            list_ids = conn.execute(sqlalchemy.text("""
+                INSERT INTO shopping_list (name, user_id)
+                VALUES ('kept', :user_id), ('stale', :user_id)
+                RETURNING list_id
+                """), {"user_id": user_id}).scalars().all()
+            conn.execute(sqlalchemy.text("""
+                INSERT INTO shopping_list_item (list_id, food_id, user_id, quantity)
+                SELECT list_id, food_id, :user_id, 1
+                FROM unnest(CAST(:list_ids AS int[])) AS list_id, (SELECT food_id FROM food_item LIMIT 2) AS food
+                """), {"user_id": user_id, "list_ids": list_ids})
+
+        psql_url = url.set(drivername="postgresql").render_as_string(hide_password=False)
+        subprocess.run(["psql", "-v", "ON_ERROR_STOP=1", "-v", "partitions=4", "-q",
+                        "-d", psql_url, "-f", MIGRATION_SQL], check=True, capture_output=True)
+
+        yield engine, list_ids
+    finally:
+        engine.dispose()
+        with db_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.exec_driver_sql(f'DROP DATABASE IF EXISTS "{name}"')
+
+
+def test_lists_from_before_the_migration_can_be_deleted(migrated_db):
+    import sqlalchemy
+    from src import retention
+
+    engine, (kept_id, stale_id) = migrated_db
+    with engine.begin() as conn:
+        assert conn.execute(sqlalchemy.text("""
+            SELECT COUNT(*) FROM shopping_list_item_unpartitioned
+            """)).scalar_one() == 4
+
+        # What DELETE /users/{user_id}/lists/{list_id} runs
+        conn.execute(sqlalchemy.text("""
+            DELETE FROM shopping_list_item WHERE list_id = :list_id;
+            DELETE FROM shopping_list WHERE list_id = :list_id;
+            """), {"list_id": kept_id})
+
+        conn.execute(sqlalchemy.text("""
+            UPDATE shopping_list SET updated_at = now() - interval '1 year' WHERE list_id = :list_id
+            """), {"list_id": stale_id})
+        removed = conn.execute(retention.chunk_statement(archive=True), {
+            "cutoff": datetime.now(timezone.utc) - timedelta(days=30), "batch_size": 10}).one()
+        assert (removed.lists, removed.items) == (1, 2)
+
+        assert conn.execute(sqlalchemy.text("SELECT COUNT(*) FROM shopping_list")).scalar_one() == 0
+        # The copy kept for rolling back still has every row
+        assert conn.execute(sqlalchemy.text("""
+            SELECT COUNT(*) FROM shopping_list_item_unpartitioned
+            """)).scalar_one() == 4
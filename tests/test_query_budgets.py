@@ -0,0 +1,92 @@
+"""
+Statement and row-scan budgets per route.
+
+Every case drives one endpoint through the API, counts the statements it
+sends to Postgres, and re-runs each of them under EXPLAIN ANALYZE to count
+the rows their scans touched. A per-item query loop or an extra validation
+round trip fails the statement budget, and a lookup that lost its index or
+reads far more than it returns fails the row budget, before either shows up
+as latency.
+
+Statement budgets hold with every in-process cache cold, so test order does
+not matter. Row budgets are sized for the default TEST_DATA_SCALE and grow
+in proportion on larger datasets.
+"""
+import os
+from dataclasses import dataclass
+from typing import Callable
+
+import pytest
+
+from tests import plans
+
+DEFAULT_SCALE = 0.5
+ROW_BUDGET_FACTOR = max(1.0, float(os.environ.get("TEST_DATA_SCALE", DEFAULT_SCALE)) / DEFAULT_SCALE)
+
+
+@dataclass
+class Budget:
+    name: str
+    request: Callable
+    statements: int
+    rows_scanned: int
+
+
+BUDGETS = [
+    Budget("list_facts",
+           lambda client, ids: client.get(f"/users/{ids['user_id']}/lists/{ids['list_id']}/facts"),
+           statements=2, rows_scanned=200),
+    Budget("get_list",
+           lambda client, ids: client.get(f"/users/{ids['user_id']}/list/{ids['list_id']}"),
+           statements=2, rows_scanned=200),
+    Budget("edit_item_quantity",
+           lambda client, ids: client.put(f"/users/{ids['user_id']}/lists/{ids['list_id']}/item",
+                                          json=[{"food_id": ids["food_id"], "quantity": 2}]),
+           statements=3, rows_scanned=200),
+    Budget("get_stores",
+           lambda client, ids: client.get("/stores/"),
+           statements=2, rows_scanned=100),
+    Budget("get_catalog",
+           lambda client, ids: client.get(f"/stores/{ids['store_id']}/catalog"),
+           statements=2, rows_scanned=5000),
+    Budget("get_catalog_not_modified",
+           lambda client, ids: client.get(f"/stores/{ids['store_id']}/catalog", headers={"If-None-Match": "*"}),
+           statements=1, rows_scanned=10),
+    Budget("compare_prices",
+           lambda client, ids: client.post("/stores/compare-prices", params={"food_id": ids["food_id"]}),
+           statements=2, rows_scanned=500),
+    Budget("find_snack",
+           lambda client, ids: client.get(f"/shopping/{ids['user_id']}/find_snack/{ids['food_id']}"),
+           # the no-store-in-range 404 looks the food up to name it
+           statements=4, rows_scanned=500),
+    Budget("fulfill_list",
+           lambda client, ids: client.get(f"/shopping/{ids['user_id']}/fulfill_list/{ids['list_id']}"),
+           statements=4, rows_scanned=3000),
+]
+
+
+@pytest.mark.parametrize("budget", BUDGETS, ids=lambda budget: budget.name)
+def test_query_budgets(budget, client, sample_ids, recorded_statements, db_engine):
+    response = budget.request(client, sample_ids)
+    assert response.status_code < 500, response.text
+
+    statements = [(statement, parameters) for statement, parameters in recorded_statements
+                  if plans.is_plannable(statement)]
+    listing = "\n\n".join(statement.strip() for statement, _ in statements)
+    assert statements, f"{budget.name} issued no SQL"
+    assert len(statements) <= budget.statements, (
+        f"{budget.name} ran {len(statements)} statements, budget is {budget.statements}:\n{listing}")
+
+    scanned = {}
+    with db_engine.connect() as conn:
+        with conn.begin():
+            for number, (statement, parameters) in enumerate(statements, 1):
+                plan = plans.explain(conn, statement, parameters)
+                scanned[f"{budget.name}.{number}"] = (plans.rows_scanned(plan), statement, plan)
+
+    total = sum(rows for rows, _, _ in scanned.values())
+    limit = budget.rows_scanned * ROW_BUDGET_FACTOR
+    assert total <= limit, (
+        f"{budget.name} scanned {total} rows, budget is {limit:.0f}:\n"
+        + "\n\n".join(f"{name}: {rows} rows\n{statement.strip()}\n\n{plans.render(plan)}"
+                      for name, (rows, statement, plan) in scanned.items()))
@@ -0,0 +1,144 @@
+"""
+Query plan regression tests.
+
+Every scenario drives one endpoint through the API, captures the SQL it
+sends, and runs EXPLAIN (ANALYZE, BUFFERS) on each statement against the
+seeded dataset. A scenario fails when a plan sequentially scans one of the
+big tables, stops using an index the endpoint relies on, runs over its time
+budget, or no longer matches the plan shape recorded in expected_plans/.
+A statement without a recorded shape fails too, so a new query cannot slip
+in unreviewed. Shapes are numbered in the order a scenario sends its
+statements, which the steady_caches fixture (see conftest.py) keeps the
+same however the tests are ordered or selected.
+
+Recorded shapes depend on the dataset, so record them at the default
+TEST_DATA_SCALE (see conftest.py) and commit tests/expected_plans/:
+
+    UPDATE_PLANS=1 pytest tests/test_query_plans.py
+"""
+import os
+from dataclasses import dataclass, field
+from typing import Callable
+
+import pytest
+
+from tests import plans
+
+EXPECTED_PLANS_DIR = os.path.join(os.path.dirname(__file__), "expected_plans")
+UPDATE_PLANS = os.environ.get("UPDATE_PLANS") == "1"
+
+# Tables that are far too big to read in full on any request path
+NO_SEQ_SCAN = {"catalog_item", "shopping_list_item"}
+DEFAULT_BUDGET_MS = 25.0
+
+
+@dataclass
+class Scenario:
+    name: str
+    request: Callable
+    indexes: set = field(default_factory=set)
+    budget_ms: float = DEFAULT_BUDGET_MS
+
+
+SCENARIOS = [
+    Scenario("get_stores",
+             lambda client, ids: client.get("/stores/")),
+    Scenario("get_catalog",
+             lambda client, ids: client.get(f"/stores/{ids['store_id']}/catalog"),
+             indexes={"idx_catalog_item_catalog"}),
+    # Its statement and row counts are held down in test_query_budgets.py,
+    # a tight time budget would only measure how busy the machine is
+    Scenario("get_catalog_not_modified",
+             lambda client, ids: client.get(f"/stores/{ids['store_id']}/catalog", headers={"If-None-Match": "*"})),
+    Scenario("compare_prices",
+             lambda client, ids: client.post("/stores/compare-prices",
+                                             params={"food_id": ids["food_id"]}),
+             indexes={"idx_catalog_item_composite"}),
+    Scenario("get_list_history",
+             lambda client, ids: client.get(f"/users/{ids['user_id']}/lists/"),
+             indexes={"idx_shopping_list_user"}),
+    Scenario("list_facts",
+             lambda client, ids: client.get(f"/users/{ids['user_id']}/lists/{ids['list_id']}/facts"),
+             indexes={"shopping_list_item_pkey"}),
+    Scenario("get_list",
+             lambda client, ids: client.get(f"/users/{ids['user_id']}/list/{ids['list_id']}"),
+             indexes={"shopping_list_item_pkey"}),
+    Scenario("route_optimize",
+             lambda client, ids: client.get("/shopping/route_optimize",
+                                            params={"user_id": ids["user_id"], "food_id": ids["food_id"]}),
+             indexes={"idx_catalog_item_composite"}),
+    Scenario("route_optimize_batch",
+             lambda client, ids: client.post("/shopping/route_optimize",
+                                             json={"user_id": ids["user_id"],
+                                                   "items": [{"food_id": ids["food_id"]},
+                                                             {"food_id": ids["unused_food_id"], "budget": 500}]}),
+             indexes={"idx_catalog_item_composite"}),
+    Scenario("fulfill_list",
+             lambda client, ids: client.get(f"/shopping/{ids['user_id']}/fulfill_list/{ids['list_id']}"),
+             indexes={"idx_catalog_item_composite"},
+             budget_ms=50.0),
+    Scenario("find_snack",
+             lambda client, ids: client.get(f"/shopping/{ids['user_id']}/find_snack/{ids['food_id']}"),
+             indexes={"idx_catalog_item_composite"}),
+    Scenario("price_trend",
+             lambda client, ids: client.get(f"/foods/{ids['food_id']}/price-trend", params={"days": 90}),
+             indexes={"price_history_daily_pkey"}),
+    Scenario("search_foods_fuzzy",
+             lambda client, ids: client.get("/foods/search", params={"q": "Chikcen Brest"})),
+    Scenario("create_list",
+             lambda client, ids: client.post(f"/users/{ids['user_id']}/lists", params={"name": "plan_test"})),
+    Scenario("edit_item_quantity",
+             lambda client, ids: client.put(f"/users/{ids['user_id']}/lists/{ids['list_id']}/item",
+                                            json=[{"food_id": ids["food_id"], "quantity": 2}])),
+]
+
+
+def expected_shape_path(name):
+    return os.path.join(EXPECTED_PLANS_DIR, f"{name}.txt")
+
+
+def check_shape(name, shape):
+    path = expected_shape_path(name)
+    if UPDATE_PLANS:
+        os.makedirs(EXPECTED_PLANS_DIR, exist_ok=True)
+        with open(path, "w") as file:
+            file.write("\n".join(shape) + "\n")
+        return
+    assert os.path.exists(path), (
+        f"No recorded plan shape for {name}, rerun with UPDATE_PLANS=1 and commit {path}:\n"
+        + "\n".join(shape))
+
+    with open(path) as file:
+        expected = file.read().splitlines()
+    assert expected == shape, (
+        f"Plan for {name} changed, rerun with UPDATE_PLANS=1 if this is intended:\n"
+        + plans.diff(expected, shape, name))
+
+
+@pytest.mark.parametrize("scenario", SCENARIOS, ids=lambda scenario: scenario.name)
+def test_query_plans(scenario, client, sample_ids, recorded_statements, db_engine):
+    response = scenario.request(client, sample_ids)
+    assert response.status_code < 500, response.text
+
+    statements = [(statement, parameters) for statement, parameters in recorded_statements
+                  if plans.is_plannable(statement)]
+    assert statements, f"{scenario.name} issued no SQL"
+
+    used_indexes = set()
+    with db_engine.connect() as conn:
+        with conn.begin():
+            for number, (statement, parameters) in enumerate(statements, 1):
+                name = f"{scenario.name}.{number}"
+                plan = plans.explain(conn, statement, parameters)
+                readable = f"{statement.strip()}\n\n{plans.render(plan)}"
+
+                scanned = plans.seq_scanned_relations(plan) & NO_SEQ_SCAN
+                assert not scanned, f"{name} sequentially scans {sorted(scanned)}:\n{readable}"
+                assert plan["Execution Time"] <= scenario.budget_ms, (
+                    f"{name} took {plan['Execution Time']}ms, budget is {scenario.budget_ms}ms:\n{readable}")
+
+                check_shape(name, plans.shape(plan))
+                used_indexes |= plans.indexes_used(plan)
+
+    missing = scenario.indexes - used_indexes
+    assert not missing, f"{scenario.name} no longer uses {sorted(missing)}, used {sorted(used_indexes)}"